@@ -71,6 +71,9 @@ def create_app(config_class=Config):
     from .api.routes import api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
 
+    from .api.metrics import metrics_bp
+    app.register_blueprint(metrics_bp)
+
     @app.route('/check')
     def check():
         return 'Success'
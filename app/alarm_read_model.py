@@ -0,0 +1,132 @@
+import time
+import threading
+from .models import Alarm
+
+def alarm_entry(alarm: Alarm) -> dict:
+    return {
+        'alarm_id': alarm.id,
+        'user_id': alarm.user_id,
+        'camera_id': alarm.camera_id,
+        'vehicle_track_id': alarm.vehicle_track_id,
+        'set_at': alarm.set_at.isoformat()
+    }
+
+def _alarm_key(entry: dict) -> tuple:
+    return entry['user_id'], entry['camera_id'], entry['vehicle_track_id']
+
+class ActiveAlarmReadModel:
+    """
+    Активные тревоги в памяти главного процесса, сгруппированные по пользователям,
+    чтобы частые запросы API не ходили в БД. Загружается при старте, обновляется
+    в set_alarm, unset_alarm и при снятии тревоги обработчиком событий;
+    расхождения с БД исправляет фоновая проверка (alarm_read_model_consistency_worker).
+    Каждое изменение увеличивает version.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_user = {}
+        self._user_ids = {}
+        self._version = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @staticmethod
+    def _group_by_user(alarms: list) -> dict:
+        by_user = {}
+        for alarm in alarms:
+            entry = alarm_entry(alarm)
+            by_user.setdefault(entry['user_id'], {})[entry['alarm_id']] = entry
+        return by_user
+
+    def _replace(self, by_user: dict):
+        self._by_user = by_user
+        self._user_ids = {alarm_id: user_id for user_id, user_alarms in by_user.items() for alarm_id in user_alarms}
+        self._version += 1
+
+    def load(self, alarms: list):
+        """Заменяет содержимое активными тревогами из БД."""
+
+        by_user = self._group_by_user(alarms)
+        with self._lock:
+            self._replace(by_user)
+
+    def add(self, alarm: Alarm):
+        entry = alarm_entry(alarm)
+        with self._lock:
+            self._by_user.setdefault(entry['user_id'], {})[entry['alarm_id']] = entry
+            self._user_ids[entry['alarm_id']] = entry['user_id']
+            self._version += 1
+
+    def remove(self, alarm_id: int) -> bool:
+        """:return: False, если тревоги в модели не было."""
+
+        with self._lock:
+            user_id = self._user_ids.pop(alarm_id, None)
+            if user_id is None:
+                return False
+            user_alarms = self._by_user[user_id]
+            del user_alarms[alarm_id]
+            if not user_alarms:
+                del self._by_user[user_id]
+            self._version += 1
+            return True
+
+    def user_alarms(self, user_id: int) -> list:
+        """:return: Активные тревоги пользователя в порядке создания (словари alarm_entry)."""
+
+        with self._lock:
+            return [dict(entry) for _, entry in sorted(self._by_user.get(user_id, {}).items())]
+
+    def user_track_alarms(self, user_id: int) -> dict:
+        """:return: Словарь {(camera_id, track_id): alarm_id} активных тревог пользователя."""
+
+        with self._lock:
+            return {(entry['camera_id'], entry['vehicle_track_id']): alarm_id for alarm_id, entry in self._by_user.get(user_id, {}).items()}
+
+    def reconcile(self, alarms: list, expected_version: int) -> tuple | None:
+        """
+        Сверяет модель с активными тревогами из БД и при расхождении перезагружает её.
+        :param expected_version: Версия модели до запроса к БД; если модель успела измениться, сверка пропускается.
+        :return: (число тревог только в БД, число тревог только в модели) или None, если сверка пропущена.
+        """
+
+        by_user = self._group_by_user(alarms)
+        db_entries = {alarm_id: _alarm_key(entry) for user_alarms in by_user.values() for alarm_id, entry in user_alarms.items()}
+        with self._lock:
+            if self._version != expected_version:
+                return None
+            model_entries = {alarm_id: _alarm_key(entry) for user_alarms in self._by_user.values() for alarm_id, entry in user_alarms.items()}
+            if db_entries == model_entries:
+                return 0, 0
+            self._replace(by_user)
+
+        missing = sum(1 for alarm_id, key in db_entries.items() if model_entries.get(alarm_id) != key)
+        stale = sum(1 for alarm_id in model_entries if alarm_id not in db_entries)
+        return missing, stale
+
+def alarm_read_model_consistency_worker(flask_app, read_model: ActiveAlarmReadModel, running_flag_shared, interval_s: float):
+    """Периодически сверяет модель активных тревог с БД (поток главного процесса)."""
+
+    worker_logger = flask_app.logger
+    worker_logger.info(f'Alarm read model consistency check started (every {interval_s}s)')
+
+    next_check_at = time.monotonic() + interval_s
+    while running_flag_shared.value:
+        if time.monotonic() < next_check_at:
+            time.sleep(1)
+            continue
+        next_check_at = time.monotonic() + interval_s
+        try:
+            with flask_app.app_context():
+                expected_version = read_model.version
+                alarms = Alarm.query.filter_by(is_active=True).all()
+                result = read_model.reconcile(alarms, expected_version)
+            if result is None:
+                worker_logger.debug('Alarm read model changed during consistency check. Will retry next time')
+            elif any(result):
+                worker_logger.warning(f'Alarm read model was out of sync with DB ({result[0]} missing, {result[1]} stale alarm(s)). Reloaded')
+        except Exception as e:
+            worker_logger.error(f'Error in alarm read model consistency check: {e}', exc_info=True)
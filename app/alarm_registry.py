@@ -0,0 +1,75 @@
+class AlarmRegistry:
+    """
+    Реестр активных сигнализаций, общий для процессов (поверх прокси multiprocessing.Manager).
+    Каждое изменение увеличивает версию, поэтому читатели (детектор) перечитывают
+    реестр целиком только когда он действительно изменился.
+    """
+
+    def __init__(self, alarms_shared, version_shared, lock_shared):
+        self._alarms = alarms_shared
+        self._version = version_shared
+        self._lock = lock_shared
+
+    @classmethod
+    def from_manager(cls, manager) -> 'AlarmRegistry':
+        return cls(manager.dict(), manager.Value('i', 0), manager.Lock())
+
+    @property
+    def version(self) -> int:
+        return self._version.value
+
+    def add(self, alarm_id: int, alarm_data: dict):
+        with self._lock:
+            self._alarms[alarm_id] = alarm_data
+            self._version.value += 1
+
+    def remove(self, alarm_id: int) -> bool:
+        """:return: False, если сигнализации в реестре не было."""
+
+        with self._lock:
+            if self._alarms.pop(alarm_id, None) is None:
+                return False
+            self._version.value += 1
+            return True
+
+    def __contains__(self, alarm_id: int) -> bool:
+        return alarm_id in self._alarms
+
+    def snapshot(self) -> tuple[int, dict]:
+        """:return: Согласованная пара (версия, {alarm_id: alarm_data})."""
+
+        with self._lock:
+            return self._version.value, self._alarms.copy()
+
+class AlarmTrackIndex:
+    """
+    Локальный индекс детектора: (camera_id, track_id) -> список сигнализаций на этом треке.
+    Перестраивается из AlarmRegistry только при смене версии реестра.
+    """
+
+    def __init__(self, registry: AlarmRegistry, default_camera_id: str):
+        self.registry = registry
+        self.default_camera_id = default_camera_id
+        self.version = None
+        self._by_camera = {}
+
+    def refresh(self) -> bool:
+        """:return: True, если индекс был перестроен."""
+
+        if self.registry.version == self.version:
+            return False
+
+        version, alarms = self.registry.snapshot()
+        by_camera = {}
+        for alarm_db_id, alarm_data in alarms.items():
+            camera_id = alarm_data.get('camera_id', self.default_camera_id)
+            camera_tracks = by_camera.setdefault(camera_id, {})
+            camera_tracks.setdefault(alarm_data.get('track_id'), []).append({**alarm_data, 'alarm_db_id': alarm_db_id})
+        self._by_camera = by_camera
+        self.version = version
+        return True
+
+    def for_camera(self, camera_id: str) -> dict:
+        """:return: {track_id: [alarm_info, ...]} для камеры; alarm_info содержит alarm_db_id."""
+
+        return self._by_camera.get(camera_id, {})
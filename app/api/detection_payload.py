@@ -0,0 +1,95 @@
+import json
+import threading
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode()
+
+class DetectionPayload:
+    """
+    Ответ /api/vehicles/detected для одной версии снимка детекций, сериализованный один раз.
+    Каждая машина хранится готовым JSON-фрагментом с alarmed_by_user=false; на запрос
+    пересериализуются только машины под тревогами вызывающего пользователя.
+    """
+
+    def __init__(self, version: int, timestamp: float, camera_vehicles: dict):
+        self.version = version
+        self.timestamp = timestamp
+        # {camera_id: [(track_id, словарь машины, JSON-фрагмент), ...]}
+        self.camera_vehicles = camera_vehicles
+        self._bodies = {}
+
+    def _camera_ids(self, camera_id: str | None) -> list:
+        return [camera_id] if camera_id is not None else list(self.camera_vehicles)
+
+    def vehicles(self, camera_id: str | None = None) -> dict:
+        """:return: Словарь {(camera_id, track_id): словарь машины} без полей тревог."""
+
+        return {(camera, track_id): vehicle for camera in self._camera_ids(camera_id) for track_id, vehicle, _ in self.camera_vehicles.get(camera, ())}
+
+    def count(self, camera_id: str | None = None) -> int:
+        return sum(len(self.camera_vehicles.get(camera, ())) for camera in self._camera_ids(camera_id))
+
+    def _body(self, fragments) -> bytes:
+        return b'{"detected_vehicles":[' + b','.join(fragments) + b'],"timestamp":' + _dumps(self.timestamp) + b'}'
+
+    def render(self, camera_id: str | None = None, user_alarms: dict | None = None) -> bytes:
+        """
+        Тело ответа с тревогами пользователя.
+        :param camera_id: Только машины этой камеры (None - всех камер).
+        :param user_alarms: Словарь {(camera_id, track_id): alarm_id} активных тревог пользователя.
+        :return: JSON в байтах.
+        """
+
+        camera_ids = self._camera_ids(camera_id)
+        user_alarms = user_alarms or {}
+        has_overlay = any(
+            (camera, track_id) in user_alarms
+            for camera in camera_ids for track_id, _, _ in self.camera_vehicles.get(camera, ())
+        )
+        if not has_overlay:
+            # Общее тело без тревог - одно на версию снимка и фильтр камеры
+            body = self._bodies.get(camera_id)
+            if body is None:
+                body = self._bodies[camera_id] = self._body(
+                    fragment for camera in camera_ids for _, _, fragment in self.camera_vehicles.get(camera, ())
+                )
+            return body
+
+        fragments = []
+        for camera in camera_ids:
+            for track_id, vehicle, fragment in self.camera_vehicles.get(camera, ()):
+                alarm_id = user_alarms.get((camera, track_id))
+                fragments.append(fragment if alarm_id is None else _dumps({**vehicle, 'alarmed_by_user': True, 'alarm_id': alarm_id}))
+        return self._body(fragments)
+
+class DetectionPayloadCache:
+    """
+    Сериализует снимок детекций (DetectionSnapshot) при первом запросе после каждой публикации детектора;
+    остальные запросы к той же версии получают готовый DetectionPayload.
+    """
+
+    def __init__(self, detection_snapshot, class_map: dict):
+        self.detection_snapshot = detection_snapshot
+        self.class_map = class_map
+        self._lock = threading.Lock()
+        self._payload = None
+
+    def current(self) -> DetectionPayload:
+        payload = self._payload
+        if payload is not None and payload.version == self.detection_snapshot.version:
+            return payload
+
+        with self._lock:
+            # Пока ждали блокировку, версию мог уже сериализовать другой поток
+            payload = self._payload
+            if payload is not None and payload.version == self.detection_snapshot.version:
+                return payload
+            version, timestamp, records = self.detection_snapshot.read()
+            camera_vehicles = {}
+            for camera_id in self.detection_snapshot.camera_ids:
+                camera_vehicles[camera_id] = [
+                    (vehicle['track_id'], vehicle, _dumps({**vehicle, 'alarmed_by_user': False, 'alarm_id': None}))
+                    for vehicle in self.detection_snapshot.api_detections(records, self.class_map, camera_id)
+                ]
+            payload = self._payload = DetectionPayload(version, timestamp, camera_vehicles)
+            return payload
@@ -0,0 +1,121 @@
+import json
+import time
+import logging
+import threading
+
+stream_logger = logging.getLogger('app.api.detection_stream')
+
+class DetectionBroadcaster:
+    """
+    Единственный этап раздачи детекций подписчикам SSE: один поток следит за версией снимка детекций
+    и будит ждущих клиентов, когда детектор опубликовал новый кадр. Кадр сериализуется один раз
+    (DetectionPayloadCache), клиенты лишь считают разницу со своим последним отправленным состоянием.
+    Пока подписчиков нет, поток спит.
+    """
+
+    def __init__(self, payload_cache, poll_interval_s: float = 0.02):
+        self.payload_cache = payload_cache
+        self.poll_interval_s = poll_interval_s
+
+        self._condition = threading.Condition()
+        self._payload = None
+        self._subscribers = 0
+        self._thread = None
+
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
+
+    def subscribe(self):
+        with self._condition:
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='DetectionBroadcasterThread', daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def unsubscribe(self):
+        with self._condition:
+            self._subscribers -= 1
+
+    def wait_for_update(self, last_version: int | None, timeout_s: float):
+        """
+        Ждёт публикации с версией, отличной от last_version.
+        :return: DetectionPayload или None по таймауту.
+        """
+
+        with self._condition:
+            updated = self._condition.wait_for(lambda: self._payload is not None and self._payload.version != last_version, timeout_s)
+            return self._payload if updated else None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._subscribers > 0)
+            try:
+                payload = self.payload_cache.current()
+            except Exception as e:
+                stream_logger.error(f'Error reading detection snapshot for stream: {e}', exc_info=True)
+                time.sleep(1)
+                continue
+            if payload is not self._payload:
+                with self._condition:
+                    self._payload = payload
+                    self._condition.notify_all()
+            time.sleep(self.poll_interval_s)
+
+def _sse(event: str, data: dict, event_id: int | None = None) -> str:
+    id_line = f'id: {event_id}\n' if event_id is not None else ''
+    return f'event: {event}\n{id_line}data: {json.dumps(data, separators=(',', ':'))}\n\n'
+
+def detection_delta(sent: dict, current: dict) -> dict:
+    """
+    Разница между двумя состояниями {(camera_id, track_id): машина}.
+    :return: Словарь added/moved (машины целиком) и removed (camera_id, track_id).
+    """
+
+    return {
+        'added': [vehicle for key, vehicle in current.items() if key not in sent],
+        'moved': [vehicle for key, vehicle in current.items() if key in sent and sent[key] != vehicle],
+        'removed': [{'camera_id': camera_id, 'track_id': track_id} for camera_id, track_id in sent.keys() - current.keys()]
+    }
+
+def stream_detection_events(broadcaster: DetectionBroadcaster, camera_id: str | None, max_fps: float, keepalive_s: float):
+    """
+    Генератор событий SSE одного клиента: сначала snapshot со всеми машинами, затем delta.
+    Не чаще max_fps в секунду; кадры, пришедшие между отправками, сливаются в одну разницу.
+    """
+
+    min_interval_s = 1 / max_fps if max_fps > 0 else 0.0
+    sent = None
+    version = None
+    last_sent_at = 0.0
+
+    broadcaster.subscribe()
+    try:
+        yield f'retry: {int(keepalive_s * 1000)}\n\n'
+        while True:
+            delay_s = last_sent_at + min_interval_s - time.monotonic()
+            if delay_s > 0:
+                time.sleep(delay_s)
+
+            payload = broadcaster.wait_for_update(version, keepalive_s)
+            if payload is None:
+                yield ': keepalive\n\n'
+                continue
+            version = payload.version
+            current = payload.vehicles(camera_id)
+
+            if sent is None:
+                message = _sse('snapshot', {'timestamp': payload.timestamp, 'vehicles': list(current.values())}, version)
+            else:
+                delta = detection_delta(sent, current)
+                if not any(delta.values()):
+                    continue
+                message = _sse('delta', {'timestamp': payload.timestamp, **delta}, version)
+
+            sent = current
+            last_sent_at = time.monotonic()
+            yield message
+    finally:
+        broadcaster.unsubscribe()
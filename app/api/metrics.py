@@ -0,0 +1,51 @@
+import time
+from flask import Blueprint, Response, current_app
+from .routes import SHARED_DATA
+from ..metrics import render_prometheus
+
+metrics_bp = Blueprint('metrics', __name__)
+
+def _per_camera(values: dict | None, scale: float = 1.0) -> list:
+    return [({'camera': camera_id}, value * scale if value is not None and scale != 1.0 else value) for camera_id, value in (values or {}).items()]
+
+def detector_stats_gauges(stats: dict) -> list:
+    """Переводит статистику детектора (detector_stats) в метрики для /metrics."""
+
+    if not stats:
+        return []
+    updated_at = stats.get('updated_at')
+    capture_lag_avg_ms = stats.get('capture_lag_avg_ms')
+    return [
+        ('detector_inference_fps', 'gauge', 'Frames inferred per second over the last stats window.', [({}, stats.get('inference_fps'))]),
+        ('detector_inference_seconds_per_frame', 'gauge', 'Average model time per inferred frame.', [({}, stats.get('inference_ms_per_frame', 0) / 1000)]),
+        ('detector_capture_lag_seconds', 'gauge', 'Time from frame capture to inference per camera.', _per_camera(stats.get('capture_lag_ms'), 0.001)),
+        ('detector_capture_lag_avg_seconds', 'gauge', 'Average capture-to-inference lag over the last stats window.', [({}, capture_lag_avg_ms / 1000 if capture_lag_avg_ms is not None else None)]),
+        ('detector_motion_gate_skip_ratio', 'gauge', 'Share of frames skipped by the motion gate over the last stats window.', [({}, stats.get('motion_gate_skip_ratio'))]),
+        ('detector_process_cpu_percent', 'gauge', 'CPU usage of the detector process.', [({}, stats.get('process_cpu_pct'))]),
+        ('detector_stats_age_seconds', 'gauge', 'Seconds since the detector last updated its stats.', [({}, time.time() - updated_at if updated_at else None)]),
+        ('camera_frames_captured_total', 'counter', 'Frames decoded from the camera.', _per_camera(stats.get('frames_captured'))),
+        ('camera_frames_dropped_total', 'counter', 'Frames replaced by a newer one before inference picked them up.', _per_camera(stats.get('frames_dropped'))),
+        ('camera_frame_buffer_bytes', 'gauge', 'Memory held by the pre-event frame buffer.', _per_camera(stats.get('frame_buffer_bytes'))),
+        ('camera_frame_buffer_skipped_total', 'counter', 'Frames left out of the pre-event buffer because the JPEG encode queue was full.', _per_camera(stats.get('frame_buffer_skipped'))),
+        ('camera_pending_recordings', 'gauge', 'Event videos waiting for post-event frames.', _per_camera(stats.get('pending_recordings')))
+    ]
+
+@metrics_bp.route('/metrics', methods=['GET'], endpoint='get_metrics_ep')
+def get_metrics():
+    try:
+        process_metrics = dict(SHARED_DATA['metrics']) if SHARED_DATA['metrics'] is not None else {}
+        stats = dict(SHARED_DATA['detector_stats']) if SHARED_DATA['detector_stats'] is not None else {}
+
+        queue_depths = []
+        for queue_name, queue in SHARED_DATA['queues'].items():
+            try:
+                queue_depths.append(({'queue': queue_name}, queue.qsize()))
+            except NotImplementedError:
+                continue
+    except Exception as e:
+        current_app.logger.error(f'Error collecting metrics: {e}', exc_info=True)
+        return Response('# Error collecting metrics\n', status=500, mimetype='text/plain')
+
+    gauges = detector_stats_gauges(stats)
+    gauges.append(('queue_depth', 'gauge', 'Items waiting in inter-process queues.', queue_depths))
+    return Response(render_prometheus(process_metrics, gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -5,18 +5,59 @@ from flask import request, jsonify, current_app, send_from_directory
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from . import api_bp
 from .. import db
-from ..models import Alarm, AlarmEvent, User, TelegramVerificationCode
+from ..models import Alarm, AlarmEvent, User, TelegramVerificationCode, parse_event_details
+from ..detection.postprocess import VEHICLE_CLASS_MAP
+from ..pagination import encode_cursor, keyset_before
+from .detection_payload import DetectionPayloadCache
+from .detection_stream import DetectionBroadcaster, stream_detection_events
 
 SHARED_DATA = {
-    'last_processed_bboxes': None,
-    'active_alarms': None
+    'detection_snapshot': None,
+    'detection_payload': None,
+    'detection_stream': None,
+    'active_alarms': None,
+    'alarm_read_model': None,
+    'detector_stats': None,
+    'metrics': None,
+    'queues': {}
 }
 
-def initialize_shared_data(last_bboxes_mp_list, active_alarms_mp_dict):
+def initialize_shared_data(detection_snapshot, alarm_registry, detector_stats_mp_dict=None, metrics_mp_dict=None, queues=None, alarm_read_model=None):
     """Инициализирует общие данные, переданные из главного процесса."""
-    SHARED_DATA['last_processed_bboxes'] = last_bboxes_mp_list
-    SHARED_DATA['active_alarms'] = active_alarms_mp_dict
-    current_app.logger.info('Shared data (bboxes, active_alarms) initialized in API module')
+    SHARED_DATA['detection_snapshot'] = detection_snapshot
+    SHARED_DATA['detection_payload'] = DetectionPayloadCache(detection_snapshot, VEHICLE_CLASS_MAP) if detection_snapshot is not None else None
+    SHARED_DATA['detection_stream'] = DetectionBroadcaster(SHARED_DATA['detection_payload']) if detection_snapshot is not None else None
+    SHARED_DATA['active_alarms'] = alarm_registry
+    SHARED_DATA['alarm_read_model'] = alarm_read_model
+    SHARED_DATA['detector_stats'] = detector_stats_mp_dict
+    SHARED_DATA['metrics'] = metrics_mp_dict
+    SHARED_DATA['queues'] = queues or {}
+    current_app.logger.info('Shared data (detection snapshot, active_alarms, alarm read model, detector_stats, metrics) initialized in API module')
+
+# Счётчики версий начинаются с нуля при каждом запуске; метка запуска не даёт ETag прошлого запуска совпасть с новым
+BOOT_NONCE = os.urandom(4).hex()
+
+def _alarms_version() -> int | None:
+    """:return: Версия модели тревог или None без модели: тогда ответ по БД не версионируется и не кэшируется."""
+
+    return SHARED_DATA['alarm_read_model'].version if SHARED_DATA['alarm_read_model'] is not None else None
+
+def _no_store(response):
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def _with_etag(response, etag: str):
+    response.set_etag(f'{BOOT_NONCE}-{etag}')
+    # Клиенты кэшируют ответ, но каждый раз переспрашивают сервер с If-None-Match
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _not_modified(etag: str):
+    """:return: Ответ 304, если у клиента уже есть версия etag, иначе None."""
+
+    if request.if_none_match.contains(f'{BOOT_NONCE}-{etag}'):
+        return _with_etag(current_app.response_class(status=304), etag)
+    return None
 
 @api_bp.route('/alarms/<int:vehicle_track_id>', methods=['POST'], endpoint='set_alarm_ep')
 @jwt_required() 
@@ -32,21 +73,21 @@ def set_alarm(vehicle_track_id):
         current_app.logger.warning(f'User {current_user_id}: Set alarm attempt missing vehicle_track_id')
         return jsonify({'msg': 'vehicle_track_id is required'}), 400
 
+    data = request.get_json(silent=True) or {}
+    camera_id = data.get('camera_id') or request.args.get('camera_id') or current_app.config.get('DEFAULT_CAMERA_ID')
+    if camera_id not in current_app.config.get('CAMERA_SOURCES', {}):
+        current_app.logger.warning(f'User {current_user_id}: Set alarm attempt for unknown camera_id {camera_id}')
+        return jsonify({'msg': f'Unknown camera_id: {camera_id}'}), 400
+
     vehicle_exists_in_last_detection = False
     last_detection_timestamp = 0.0
 
-    if SHARED_DATA['last_processed_bboxes'] is not None and len(SHARED_DATA['last_processed_bboxes']) == 2:
+    if SHARED_DATA['detection_snapshot'] is not None:
         try:
-            current_detections = SHARED_DATA['last_processed_bboxes'][0]
-            last_detection_timestamp = SHARED_DATA['last_processed_bboxes'][1]
-
-            if current_detections:
-                for vehicle_data in current_detections:
-                    if vehicle_data.get('track_id') == vehicle_track_id:
-                        vehicle_exists_in_last_detection = True
-                        break
+            _, last_detection_timestamp, records = SHARED_DATA['detection_snapshot'].read()
+            vehicle_exists_in_last_detection = SHARED_DATA['detection_snapshot'].has_track(records, camera_id, vehicle_track_id)
         except Exception as e:
-            current_app.logger.error(f'Error accessing shared bboxes during set_alarm: {e}', exc_info=True)
+            current_app.logger.error(f'Error reading detection snapshot during set_alarm: {e}', exc_info=True)
 
     MAX_DETECTION_AGE_SECONDS = 10
     current_time = time.time()
@@ -57,11 +98,12 @@ def set_alarm(vehicle_track_id):
             current_app.logger.warning(f'User {current_user_id}: Cannot verify existence of track_id {vehicle_track_id}. Detection data is stale ({(current_time - last_detection_timestamp):.1f})s old')
             return jsonify({'msg': f'Cannot set alarm: detection data is too old ({int(current_time - last_detection_timestamp)}s)'}), 400
         else:
-            current_app.logger.warning(f'User {current_user_id}: Attempt to set alarm for non-currently-detected vehicle_track_id {vehicle_track_id}')
-            return jsonify({'msg': f'Vehicle with track ID {vehicle_track_id} is not currently detected'}), 404
+            current_app.logger.warning(f'User {current_user_id}: Attempt to set alarm for non-currently-detected vehicle_track_id {vehicle_track_id} on camera {camera_id}')
+            return jsonify({'msg': f'Vehicle with track ID {vehicle_track_id} is not currently detected on camera {camera_id}'}), 404
 
     existing_alarm = Alarm.query.filter_by(
         user_id=current_user_id,
+        camera_id=camera_id,
         vehicle_track_id=vehicle_track_id,
         is_active=True
     ).first()
@@ -73,26 +115,32 @@ def set_alarm(vehicle_track_id):
     try:
         new_alarm = Alarm(
             user_id = current_user_id,
+            camera_id=camera_id,
             vehicle_track_id=vehicle_track_id,
             set_at=datetime.now(timezone.utc),
             is_active=True
         )
         db.session.add(new_alarm)
         db.session.commit()
-        current_app.logger.info(f'User {current_user_id}: Alarm (ID: {new_alarm.id}) set for vehicle_track_id {vehicle_track_id}')
+        current_app.logger.info(f'User {current_user_id}: Alarm (ID: {new_alarm.id}) set for vehicle_track_id {vehicle_track_id} on camera {camera_id}')
         
         if SHARED_DATA['active_alarms'] is not None:
-            SHARED_DATA['active_alarms'][new_alarm.id] = {
+            SHARED_DATA['active_alarms'].add(new_alarm.id, {
                 'track_id': new_alarm.vehicle_track_id,
-                'user_id': new_alarm.user_id
-            }
+                'user_id': new_alarm.user_id,
+                'camera_id': new_alarm.camera_id
+            })
             current_app.logger.info(f'Added Alarm ID {new_alarm.id} to shared active alarms')
         else:
             current_app.logger.warning('SHARED_DATA[\'active_alarms\'] is not initialized. Cannot update for detector')
 
+        if SHARED_DATA['alarm_read_model'] is not None:
+            SHARED_DATA['alarm_read_model'].add(new_alarm)
+
         return jsonify({
             'msg': 'Alarm set successfully',
             'alarm_id': new_alarm.id,
+            'camera_id': new_alarm.camera_id,
             'vehicle_track_id': new_alarm.vehicle_track_id,
             'user_id': new_alarm.user_id
         }), 201
@@ -126,14 +174,16 @@ def unset_alarm(alarm_id):
         current_app.logger.info(f'User {current_user_id}: Alarm (ID: {alarm.id}) unset for vehicle_track_id {alarm.vehicle_track_id}')
 
         if SHARED_DATA['active_alarms'] is not None:
-            if alarm_id in SHARED_DATA['active_alarms']:
-                del SHARED_DATA['active_alarms'][alarm_id]
+            if SHARED_DATA['active_alarms'].remove(alarm_id):
                 current_app.logger.info(f'Removed Alarm ID {alarm_id} from shared active_alarms')
             else:
                 current_app.logger.warning(f'Attempted to remove non-existent Alarm ID {alarm_id} from shared active_alarms')
         else:
             current_app.logger.warning('SHARED_DATA[\'active_alarms\'] is not initialized. Cannot update for detector')
 
+        if SHARED_DATA['alarm_read_model'] is not None:
+            SHARED_DATA['alarm_read_model'].remove(alarm_id)
+
         return jsonify({'msg': 'Alarm unset successfully', 'alarm_id': alarm.id}), 200
     except Exception as e:
         db.session.rollback()
@@ -145,15 +195,27 @@ def unset_alarm(alarm_id):
 def get_active_alarms():
     current_user_id = int(get_jwt_identity())
 
+    if SHARED_DATA['alarm_read_model'] is not None:
+        # Версия модели тревог меняется при каждом изменении активных тревог
+        etag = f'alarms-{_alarms_version()}-u{current_user_id}'
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+        alarms_data = [{key: value for key, value in alarm.items() if key != 'user_id'} for alarm in SHARED_DATA['alarm_read_model'].user_alarms(current_user_id)]
+        current_app.logger.debug(f'User {current_user_id}: Fetched {len(alarms_data)} active alarms (read model)')
+        return _with_etag(jsonify(alarms_data), etag), 200
+
     try:
         alarms = Alarm.query.filter_by(user_id=current_user_id, is_active=True).all()
         alarms_data = [{
             'alarm_id': alarm.id,
+            'camera_id': alarm.camera_id,
             'vehicle_track_id': alarm.vehicle_track_id,
             'set_at': alarm.set_at.isoformat()
         } for alarm in alarms]
         current_app.logger.debug(f'User {current_user_id}: Fetched {len(alarms_data)} active alarms')
-        return jsonify(alarms_data), 200
+        return _no_store(jsonify(alarms_data)), 200
     except Exception as e:
         current_app.logger.error(f'User {current_user_id}: Error fetching active alarms: {e}')
         return jsonify({'msg': 'An error occurred while fetching alarms'}), 500
@@ -162,99 +224,183 @@ def get_active_alarms():
 @jwt_required()
 def get_detected_vehicles():
     current_user_id = int(get_jwt_identity())
+    camera_id_filter = request.args.get('camera_id')
 
-    processed_bboxes_list = []
-    timestamp = 0.0
+    # Ответ меняется только с новым кадром детектора или изменением тревог; обе версии читаются из памяти процесса
+    alarms_version = _alarms_version()
+    if SHARED_DATA['detection_snapshot'] is not None and alarms_version is not None:
+        not_modified = _not_modified(f'detected-{SHARED_DATA['detection_snapshot'].version}-{alarms_version}-u{current_user_id}')
+        if not_modified is not None:
+            return not_modified
 
-    if SHARED_DATA['last_processed_bboxes'] is not None and len(SHARED_DATA['last_processed_bboxes']) == 2:
+    payload = None
+    if SHARED_DATA['detection_payload'] is not None:
         try:
-            raw_data_from_detector = SHARED_DATA['last_processed_bboxes'][0]
-            timestamp = SHARED_DATA['last_processed_bboxes'][1]
-
-            if raw_data_from_detector is not None:
-                processed_bboxes_list = list(raw_data_from_detector)
-            else:
-                processed_bboxes_list = []
+            payload = SHARED_DATA['detection_payload'].current()
         except Exception as e:
-            current_app.logger.error(f'Error accessing shared bboxes: {e}', exc_info=True)
-            processed_bboxes_list = []
-            timestamp = 0.0
+            current_app.logger.error(f'Error reading detection snapshot: {e}', exc_info=True)
     else:
-        current_app.logger.warning('SHARED_DATA[\'last_processed_bboxes\'] is not initialized or has incorrect format')
+        current_app.logger.warning('SHARED_DATA[\'detection_payload\'] is not initialized')
 
-    active_user_alarms_track_ids = {
-        alarm.vehicle_track_id: alarm.id for alarm in Alarm.query.filter_by(user_id=current_user_id, is_active=True).all()
-    }
+    if payload is None:
+        return jsonify({'detected_vehicles': [], 'timestamp': 0.0}), 200
+
+    if SHARED_DATA['alarm_read_model'] is not None:
+        active_user_alarms_track_ids = SHARED_DATA['alarm_read_model'].user_track_alarms(current_user_id)
+    else:
+        active_user_alarms_track_ids = {
+            (alarm.camera_id, alarm.vehicle_track_id): alarm.id for alarm in Alarm.query.filter_by(user_id=current_user_id, is_active=True).all()
+        }
+
+    # Детекции сериализуются один раз на кадр; здесь к ним только подставляются тревоги пользователя
+    body = payload.render(camera_id_filter, active_user_alarms_track_ids)
+    current_app.logger.debug(f'User {current_user_id}: Fetched {payload.count(camera_id_filter)} detected vehicles (timestamp: {payload.timestamp})')
+    response = current_app.response_class(body, status=200, mimetype='application/json')
+    if alarms_version is None:
+        # Тревоги прочитаны из БД, версии у них нет
+        return _no_store(response)
+    return _with_etag(response, f'detected-{payload.version}-{alarms_version}-u{current_user_id}')
+
+@api_bp.route('/vehicles/stream', methods=['GET'], endpoint='stream_detected_vehicles_ep')
+@jwt_required()
+def stream_detected_vehicles():
+    current_user_id = int(get_jwt_identity())
+    camera_id_filter = request.args.get('camera_id')
+
+    if SHARED_DATA['detection_stream'] is None:
+        current_app.logger.warning('SHARED_DATA[\'detection_stream\'] is not initialized')
+        return jsonify({'msg': 'Detection stream is not available'}), 503
+
+    if camera_id_filter is not None and camera_id_filter not in current_app.config.get('CAMERA_SOURCES', {}):
+        return jsonify({'msg': f'Unknown camera_id: {camera_id_filter}'}), 400
+
+    # Клиент может попросить реже, но не чаще настроенного предела
+    max_fps = current_app.config.get('DETECTION_STREAM_MAX_FPS')
+    requested_fps = request.args.get('max_fps', type=float)
+    if requested_fps is not None and 0 < requested_fps < max_fps:
+        max_fps = requested_fps
+
+    current_app.logger.info(f'User {current_user_id}: Subscribed to detection stream (camera: {camera_id_filter or 'all'}, max {max_fps} fps, {SHARED_DATA['detection_stream'].subscribers + 1} subscriber(s))')
+    return current_app.response_class(
+        stream_detection_events(SHARED_DATA['detection_stream'], camera_id_filter, max_fps, current_app.config.get('DETECTION_STREAM_KEEPALIVE_S')),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@api_bp.route('/cameras', methods=['GET'], endpoint='get_cameras_ep')
+@jwt_required()
+def get_cameras():
+    cameras = [{
+        'camera_id': camera_id,
+        'is_default': camera_id == current_app.config.get('DEFAULT_CAMERA_ID'),
+        'roi': current_app.config.get('CAMERA_ROIS', {}).get(camera_id)
+    } for camera_id in current_app.config.get('CAMERA_SOURCES', {})]
+    return jsonify(cameras), 200
+
+@api_bp.route('/detector/stats', methods=['GET'], endpoint='get_detector_stats_ep')
+@jwt_required()
+def get_detector_stats():
+    if SHARED_DATA['detector_stats'] is None:
+        current_app.logger.warning('SHARED_DATA[\'detector_stats\'] is not initialized')
+        return jsonify({'msg': 'Detector stats are not available'}), 503
 
-    enriched_vehicles = []
-    if processed_bboxes_list:
-        for vehicle_data in processed_bboxes_list:
-            track_id = vehicle_data.get('track_id')
-            is_alarmed_by_current_user = False
-            current_alarm_id = None
-            if track_id is not None and track_id in active_user_alarms_track_ids:
-                is_alarmed_by_current_user = True
-                current_alarm_id = active_user_alarms_track_ids[track_id]
-            enriched_vehicles.append({
-                **vehicle_data,
-                'alarmed_by_user': is_alarmed_by_current_user,
-                'alarm_id': current_alarm_id
+    try:
+        stats = dict(SHARED_DATA['detector_stats'])
+    except Exception as e:
+        current_app.logger.error(f'Error accessing shared detector stats: {e}', exc_info=True)
+        return jsonify({'msg': 'An error occurred while fetching detector stats'}), 500
+
+    return jsonify(stats), 200
+
+def _alarm_history_items(alarms_on_page: list) -> list:
+    """Тревоги страницы истории вместе с их событиями."""
+
+    # События всех тревог страницы - одним запросом, а не отдельным запросом на каждую тревогу.
+    # Выбираются только нужные столбцы: ORM-объекты событий здесь не нужны
+    events_by_alarm = {alarm.id: [] for alarm in alarms_on_page}
+    if events_by_alarm:
+        page_events = db.session.query(AlarmEvent.alarm_id, AlarmEvent.id, AlarmEvent.event_type, AlarmEvent.timestamp, AlarmEvent.details_json)\
+            .filter(AlarmEvent.alarm_id.in_(list(events_by_alarm)))\
+            .order_by(AlarmEvent.alarm_id, AlarmEvent.timestamp.asc(), AlarmEvent.id.asc())\
+            .all()
+        for alarm_id, event_id, event_type, timestamp, details_json in page_events:
+            events_by_alarm[alarm_id].append({
+                'event_id': event_id,
+                'event_type': event_type,
+                'timestamp': timestamp.isoformat(),
+                # details - строка JSON, как раньше; разобранный объект отдаётся отдельным полем,
+                # чтобы не ломать существующих клиентов
+                'details': details_json,
+                'details_parsed': parse_event_details(details_json)
             })
-    # TODO
 
-    current_app.logger.debug(f'User {current_user_id}: Fetched {len(enriched_vehicles)} detected vehicles (timestamp: {timestamp})')
-    return jsonify({
-        'detected_vehicles': enriched_vehicles,
-        'timestamp': timestamp
-    }), 200
+    return [{
+        'alarm_id': alarm.id,
+        'camera_id': alarm.camera_id,
+        'vehicle_track_id': alarm.vehicle_track_id,
+        'set_at': alarm.set_at.isoformat(),
+        'unset_at': alarm.unset_at.isoformat() if alarm.unset_at else None,
+        'is_active': alarm.is_active,
+        'events': events_by_alarm[alarm.id]
+    } for alarm in alarms_on_page]
 
 @api_bp.route('/alarms/history', methods=['GET'], endpoint='get_alarm_history_ep')
 @jwt_required()
 def get_alarm_history():
     current_user_id = int(get_jwt_identity())
     page = request.args.get('page', 1, type=int)
+    # Keyset-режим включается явно параметром cursor (пустой - первая страница), иначе прежний постраничный ответ
+    cursor = request.args.get('cursor')
     per_page = request.args.get('per_page', 10, type=int)
+    include_total = request.args.get('include_total', 'False').lower() in ['true', '1', 't']
 
     if per_page > 100:
         per_page = 100
 
     try:
-        alarms_query = Alarm.query.filter_by(user_id=current_user_id).order_by(Alarm.set_at.desc())
-        paginated_alarms = alarms_query.paginate(page=page, per_page=per_page, error_out=False)
-        
-        alarms_on_page = paginated_alarms.items
-        history_data = []
-        for alarm in alarms_on_page:
-            events_data = [{
-                'event_id': event.id,
-                'event_type': event.event_type,
-                'timestamp': event.timestamp.isoformat(),
-                'details': event.details_json
-            } for event in alarm.events.order_by(AlarmEvent.timestamp.asc()).all()]
-
-            history_data.append({
-                'alarm_id': alarm.id,
-                'vehicle_track_id': alarm.vehicle_track_id,
-                'set_at': alarm.set_at.isoformat(),
-                'unset_at': alarm.unset_at.isoformat() if alarm.unset_at else None,
-                'is_active': alarm.is_active,
-                'events': events_data
-            })
-
+        alarms_query = Alarm.query.filter_by(user_id=current_user_id)
+
+        if cursor is None:
+            # Постраничный режим (OFFSET + COUNT) оставлен для старых клиентов
+            paginated_alarms = alarms_query.order_by(Alarm.set_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+            history_data = _alarm_history_items(paginated_alarms.items)
+            current_app.logger.debug(f'User {current_user_id}: Fetched alarm history page {page} ({len(history_data)} items)')
+            return jsonify({
+                "alarms_history": history_data,
+                "pagination": {
+                    "page": paginated_alarms.page,
+                    "per_page": paginated_alarms.per_page,
+                    "total_pages": paginated_alarms.pages, # Общее количество страниц
+                    "total_items": paginated_alarms.total, # Общее количество записей
+                    "has_next": paginated_alarms.has_next, # Есть ли следующая страница
+                    "has_prev": paginated_alarms.has_prev, # Есть ли предыдущая страница
+                    "next_page_num": paginated_alarms.next_num if paginated_alarms.has_next else None,
+                    "prev_page_num": paginated_alarms.prev_num if paginated_alarms.has_prev else None
+                }
+            }), 200
+
+        # Keyset-пагинация по (set_at, id): стоимость страницы не зависит от её глубины
+        keyset_query = alarms_query
+        if cursor:
+            try:
+                keyset_query = keyset_query.filter(keyset_before(Alarm.set_at, Alarm.id, cursor))
+            except ValueError:
+                return jsonify({'msg': 'Invalid cursor'}), 400
+        alarms_on_page = keyset_query.order_by(Alarm.set_at.desc(), Alarm.id.desc()).limit(per_page + 1).all()
+        has_next = len(alarms_on_page) > per_page
+        alarms_on_page = alarms_on_page[:per_page]
+
+        pagination = {
+            'per_page': per_page,
+            'has_next': has_next,
+            'next_cursor': encode_cursor(alarms_on_page[-1].set_at, alarms_on_page[-1].id) if has_next else None
+        }
+        if include_total:
+            pagination['total_items'] = alarms_query.count()
+
+        history_data = _alarm_history_items(alarms_on_page)
         current_app.logger.debug(f'User {current_user_id}: Fetched alarm history ({len(history_data)} items)')
-        return jsonify({
-            "alarms_history": history_data,
-            "pagination": {
-                "page": paginated_alarms.page,
-                "per_page": paginated_alarms.per_page,
-                "total_pages": paginated_alarms.pages, # Общее количество страниц
-                "total_items": paginated_alarms.total, # Общее количество записей
-                "has_next": paginated_alarms.has_next, # Есть ли следующая страница
-                "has_prev": paginated_alarms.has_prev, # Есть ли предыдущая страница
-                "next_page_num": paginated_alarms.next_num if paginated_alarms.has_next else None,
-                "prev_page_num": paginated_alarms.prev_num if paginated_alarms.has_prev else None
-            }
-        }), 200
+        return jsonify({'alarms_history': history_data, 'pagination': pagination}), 200
     except Exception as e:
         current_app.logger.error(f'User {current_user_id}: Error fetching alarm history: {e}')
         current_app.logger.exception('Exception details for alarm history error:')
@@ -1,4 +1,5 @@
 import os
+import json
 # import logging
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -9,6 +10,90 @@ dotenv_path = os.path.join(project_root, '.env')
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path, override=True)
 
+def parse_camera_sources(camera_sources: str | None, default_source: str) -> dict:
+    """
+    Разбирает список камер вида 'parking_a=rtsp://...,parking_b=rtsp://...'.
+    Камеры без явного идентификатора получают идентификатор вида camN.
+    :return: Словарь {camera_id: source} в порядке объявления.
+    """
+
+    if not camera_sources:
+        return {'main': default_source}
+
+    cameras = {}
+    for index, entry in enumerate(part.strip() for part in camera_sources.split(',')):
+        if not entry:
+            continue
+        camera_id, separator, source = entry.partition('=')
+        if not separator or ':' in camera_id or '/' in camera_id:
+            camera_id, source = f'cam{index + 1}', entry
+        cameras[camera_id.strip()] = source.strip()
+    return cameras or {'main': default_source}
+
+def parse_camera_rois(camera_rois: str | None, camera_ids) -> dict:
+    """
+    Разбирает области интереса камер из JSON вида {"parking_a": [[[0.1, 0.4], [0.9, 0.4], [0.9, 1.0], [0.1, 1.0]]]}.
+    Координаты вершин полигонов нормированы на размер кадра (0..1).
+    :return: Словарь {camera_id: [polygon, ...]}; камеры без ROI в него не попадают.
+    """
+
+    if not camera_rois:
+        return {}
+
+    rois = json.loads(camera_rois)
+    if not isinstance(rois, dict):
+        raise ValueError('CAMERA_ROIS must be a JSON object of camera_id -> list of polygons')
+    for camera_id, polygons in rois.items():
+        if camera_id not in camera_ids:
+            raise ValueError(f'CAMERA_ROIS: unknown camera_id {camera_id}')
+        for polygon in polygons:
+            if len(polygon) < 3 or not all(len(point) == 2 and all(0.0 <= c <= 1.0 for c in point) for point in polygon):
+                raise ValueError(f'CAMERA_ROIS: camera {camera_id} has an invalid polygon {polygon}; expected 3+ [x, y] points in 0..1')
+    return {camera_id: polygons for camera_id, polygons in rois.items() if polygons}
+
+def build_detector_config(config) -> dict:
+    """
+    Собирает конфигурацию процесса детектора из конфигурации приложения.
+    :param config: Конфигурация Flask или любой словарь с ключами Config.
+    :return: Словарь настроек для detect_vehicles.
+    """
+
+    return {
+        'cameras': config.get('CAMERA_SOURCES'),
+        'default_camera_id': config.get('DEFAULT_CAMERA_ID'),
+        'camera_rois': config.get('CAMERA_ROIS'),
+        'yolo_model_path': config.get('YOLO_MODEL_PATH'),
+        'inference_backend': config.get('INFERENCE_BACKEND'),
+        'inference_int8': config.get('INFERENCE_INT8'),
+        'inference_calibration_source': config.get('INFERENCE_CALIBRATION_SOURCE'),
+        'inference_calibration_frames': config.get('INFERENCE_CALIBRATION_FRAMES'),
+        'tracker_config': config.get('YOLO_TRACKER_CONFIG'),
+        'img_height': config.get('YOLO_IMG_HEIGHT'),
+        'img_width': config.get('YOLO_IMG_WIDTH'),
+        'conf_thresh': config.get('YOLO_CONF_THRESH'),
+        'iou_thresh': config.get('YOLO_IOU_THRESH'),
+        'verbose': config.get('YOLO_VERBOSE'),
+        'detection_time_window': config.get('DETECTION_TIME_WINDOW'),
+        'detection_min_distance': config.get('DETECTION_MIN_DISTANCE'),
+        'disappearance_thresh_s': config.get('DISAPPEARANCE_THRESH_S'),
+        'detector_debug_draw': config.get('DETECTOR_DEBUG_DRAW'),
+        'motion_gate_enabled': config.get('MOTION_GATE_ENABLED'),
+        'motion_gate_pixel_delta': config.get('MOTION_GATE_PIXEL_DELTA'),
+        'motion_gate_cell_threshold': config.get('MOTION_GATE_CELL_THRESHOLD'),
+        'motion_gate_max_skip_s': config.get('MOTION_GATE_MAX_SKIP_S'),
+        'log_level': config.get('LOG_LEVEL'),
+        'video_save_path': config.get('VIDEO_SAVE_PATH'),
+        'video_fps': config.get('VIDEO_FPS'),
+        'camera_fps': config.get('CAMERA_FPS'),
+        'video_seconds_before_event': config.get('VIDEO_SECONDS_BEFORE_EVENT'),
+        'video_seconds_after_event': config.get('VIDEO_SECONDS_AFTER_EVENT'),
+        'frame_buffer_mode': config.get('FRAME_BUFFER_MODE'),
+        'frame_buffer_max_mb': config.get('FRAME_BUFFER_MAX_MB'),
+        'frame_buffer_jpeg_quality': config.get('FRAME_BUFFER_JPEG_QUALITY'),
+        'decoder_backend': config.get('DECODER_BACKEND'),
+        'decoder_threads': config.get('DECODER_THREADS')
+    }
+
 class Config:
     """Базовый класс конфигурации."""
 
@@ -23,15 +108,36 @@ class Config:
     FLASK_RUN_PORT = int(os.environ.get('FLASK_RUN_PORT', 5000))
 
     RTSP_SOURCE = os.environ.get('RTSP_SOURCE', 'http://127.0.0.1:3393')
+    CAMERA_SOURCES = parse_camera_sources(os.environ.get('CAMERA_SOURCES'), RTSP_SOURCE)
+    DEFAULT_CAMERA_ID = os.environ.get('DEFAULT_CAMERA_ID') or next(iter(CAMERA_SOURCES))
+    CAMERA_ROIS = parse_camera_rois(os.environ.get('CAMERA_ROIS'), CAMERA_SOURCES)
 
     YOLO_MODEL_PATH = os.environ.get('YOLO_MODEL_PATH', 'yolo11m.pt')
     YOLO_IMG_HEIGHT = int(os.environ.get('YOLO_IMG_HEIGHT', 704))
     YOLO_IMG_WIDTH = int(os.environ.get('YOLO_IMG_WIDTH', 576))
     YOLO_CONF_THRESH = float(os.environ.get('YOLO_CONF_THRESH', 0.675))
     YOLO_IOU_THRESH = float(os.environ.get('YOLO_IOU_THRESH', 0.7))
+    YOLO_TRACKER_CONFIG = os.environ.get('YOLO_TRACKER_CONFIG', 'botsort.yaml')
     YOLO_VERBOSE = os.environ.get('YOLO_VERBOSE', 'False').lower() in ['true', '1', 't']
 
+    INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch').lower()
+    INFERENCE_INT8 = os.environ.get('INFERENCE_INT8', 'False').lower() in ['true', '1', 't']
+    INFERENCE_CALIBRATION_SOURCE = os.environ.get('INFERENCE_CALIBRATION_SOURCE') or os.environ.get('VIDEO_SAVE_PATH', 'instance/event_videos')
+    INFERENCE_CALIBRATION_FRAMES = int(os.environ.get('INFERENCE_CALIBRATION_FRAMES', 300))
+
+    DECODER_BACKEND = os.environ.get('DECODER_BACKEND', 'opencv').lower()
+    DECODER_THREADS = int(os.environ.get('DECODER_THREADS', 0))
+
     DETECTOR_DEBUG_DRAW = os.environ.get('DETECTOR_DEBUG_DRAW', 'False').lower() in ['true', '1', 't']
+    DETECTION_SNAPSHOT_CAPACITY = int(os.environ.get('DETECTION_SNAPSHOT_CAPACITY', 1024))
+    DETECTION_STREAM_MAX_FPS = float(os.environ.get('DETECTION_STREAM_MAX_FPS', 5.0))
+    DETECTION_STREAM_KEEPALIVE_S = float(os.environ.get('DETECTION_STREAM_KEEPALIVE_S', 15.0))
+    ALARM_READ_MODEL_CHECK_INTERVAL_S = float(os.environ.get('ALARM_READ_MODEL_CHECK_INTERVAL_S', 60.0))
+
+    MOTION_GATE_ENABLED = os.environ.get('MOTION_GATE_ENABLED', 'False').lower() in ['true', '1', 't']
+    MOTION_GATE_PIXEL_DELTA = int(os.environ.get('MOTION_GATE_PIXEL_DELTA', 25))
+    MOTION_GATE_CELL_THRESHOLD = float(os.environ.get('MOTION_GATE_CELL_THRESHOLD', 0.02))
+    MOTION_GATE_MAX_SKIP_S = float(os.environ.get('MOTION_GATE_MAX_SKIP_S', 2.0))
 
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI') or 'sqlite:///' + os.path.join(project_root, 'instance', 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
@@ -46,10 +152,23 @@ class Config:
     CAMERA_FPS = int(os.environ.get('CAMERA_FPS', 25))
     VIDEO_SECONDS_BEFORE_EVENT = int(os.environ.get('VIDEO_SECONDS_BEFORE_EVENT', 5))
     VIDEO_SECONDS_AFTER_EVENT = int(os.environ.get('VIDEO_SECONDS_AFTER_EVENT', 15))
+    FRAME_BUFFER_MODE = os.environ.get('FRAME_BUFFER_MODE', 'shm').lower()
+    FRAME_BUFFER_MAX_MB = int(os.environ.get('FRAME_BUFFER_MAX_MB', 0))
+    FRAME_BUFFER_JPEG_QUALITY = int(os.environ.get('FRAME_BUFFER_JPEG_QUALITY', 80))
 
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'another_really_unsecure_key'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
 
     TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
-    NOTIFICATION_COOLDOWN_SECONDS = int(os.environ.get('NOTIFICATION_COOLDOWN_SECONDS', 60))
\ No newline at end of file
+    TELEGRAM_API_BASE_URL = os.environ.get('TELEGRAM_API_BASE_URL', 'https://api.telegram.org')
+    TELEGRAM_REQUEST_TIMEOUT_S = float(os.environ.get('TELEGRAM_REQUEST_TIMEOUT_S', 10.0))
+    NOTIFICATION_QUEUE_MAX_SIZE = int(os.environ.get('NOTIFICATION_QUEUE_MAX_SIZE', 1000))
+    NOTIFICATION_SEND_CONCURRENCY = int(os.environ.get('NOTIFICATION_SEND_CONCURRENCY', 8))
+    NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', 5))
+    NOTIFICATION_RETRY_BACKOFF_S = float(os.environ.get('NOTIFICATION_RETRY_BACKOFF_S', 1.0))
+    TELEGRAM_CHAT_RATE_PER_S = float(os.environ.get('TELEGRAM_CHAT_RATE_PER_S', 1.0))
+    TELEGRAM_GLOBAL_RATE_PER_S = float(os.environ.get('TELEGRAM_GLOBAL_RATE_PER_S', 30.0))
+    NOTIFICATION_COOLDOWN_SECONDS = int(os.environ.get('NOTIFICATION_COOLDOWN_SECONDS', 60))
+    EVENT_BATCH_MAX_SIZE = int(os.environ.get('EVENT_BATCH_MAX_SIZE', 100))
+    EVENT_BATCH_MAX_WAIT_S = float(os.environ.get('EVENT_BATCH_MAX_WAIT_S', 0.05))
\ No newline at end of file
@@ -0,0 +1,227 @@
+import os
+import json
+import glob
+import logging
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+INFERENCE_BACKENDS = ('torch', 'onnx', 'openvino')
+
+backends_logger = logging.getLogger('VehicleDetectorProcess.backends')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov')
+
+def artifact_path(model_path: str, backend: str, int8: bool = False) -> str:
+    """Путь к экспортированной модели рядом с .pt (там же, куда её кладёт экспорт ultralytics)."""
+
+    base, _ = os.path.splitext(model_path)
+    suffix = '_int8' if int8 else ''
+    if backend == 'onnx':
+        return f'{base}{suffix}.onnx'
+    if backend == 'openvino':
+        return f'{base}{suffix}_openvino_model'
+    return model_path
+
+def _metadata_path(artifact: str) -> str:
+    return f'{artifact.rstrip(os.sep)}.alertcam.json'
+
+def _export_metadata(model_path: str, imgsz: tuple, int8: bool) -> dict:
+    return {
+        'source': os.path.basename(model_path),
+        'source_mtime': int(os.path.getmtime(model_path)),
+        'imgsz': list(imgsz),
+        'int8': int8
+    }
+
+def _is_cached(artifact: str, expected_metadata: dict) -> bool:
+    if not os.path.exists(artifact) or not os.path.exists(_metadata_path(artifact)):
+        return False
+    try:
+        with open(_metadata_path(artifact)) as f:
+            cached_metadata = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return all(cached_metadata.get(key) == value for key, value in expected_metadata.items())
+
+def collect_calibration_frames(source: str, count: int) -> list:
+    """
+    Собирает кадры для калибровки INT8: равномерно по изображениям и видео в каталоге
+    (например, записанным видео событий) или по видеофайлу/потоку.
+    :return: Список кадров BGR.
+    """
+
+    if os.path.isdir(source):
+        paths = sorted(
+            path for path in glob.glob(os.path.join(source, '*'))
+            if path.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS)
+        )
+    else:
+        paths = [source]
+    if not paths:
+        raise ValueError(f'No images or videos for INT8 calibration found in {source}')
+
+    per_source = max(1, -(-count // len(paths)))
+    frames = []
+    for path in paths:
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            frame = cv2.imread(path)
+            if frame is not None:
+                frames.append(frame)
+            continue
+
+        cap = cv2.VideoCapture(path)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        step = max(1, total_frames // per_source) if total_frames > 0 else 1
+        index = 0
+        taken = 0
+        while taken < per_source:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if index % step == 0:
+                frames.append(frame)
+                taken += 1
+            index += 1
+        cap.release()
+    if not frames:
+        raise ValueError(f'Could not read any frames for INT8 calibration from {source}')
+    return frames[:count]
+
+def _write_calibration_dataset(frames: list, model_names: dict, dataset_dir: str) -> str:
+    """Складывает кадры в мини-датасет ultralytics (для калибровки OpenVINO через NNCF)."""
+
+    images_dir = os.path.join(dataset_dir, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+    for i, frame in enumerate(frames):
+        cv2.imwrite(os.path.join(images_dir, f'calib_{i:05d}.jpg'), frame)
+    data_yaml = os.path.join(dataset_dir, 'calibration.yaml')
+    with open(data_yaml, 'w') as f:
+        json.dump({'path': dataset_dir, 'train': 'images', 'val': 'images', 'names': model_names}, f)
+    return data_yaml
+
+def preprocess_for_onnx(frame, imgsz: tuple) -> np.ndarray:
+    """Та же подготовка входа, что и в предикторе ultralytics: letterbox, BGR->RGB, CHW, 0..1."""
+
+    from ultralytics.data.augment import LetterBox
+
+    image = LetterBox(new_shape=imgsz, auto=False)(image=frame)
+    image = image[..., ::-1].transpose(2, 0, 1)
+    return np.ascontiguousarray(image, dtype=np.float32)[None] / 255.0
+
+def quantize_onnx_int8(fp32_path: str, int8_path: str, frames: list, imgsz: tuple):
+    """Статическая INT8-квантизация ONNX-модели (onnxruntime), откалиброванная на кадрах камеры."""
+
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class FramesReader(CalibrationDataReader):
+        def __init__(self, input_name):
+            self._inputs = iter({input_name: preprocess_for_onnx(frame, imgsz)} for frame in frames)
+
+        def get_next(self):
+            return next(self._inputs, None)
+
+    fp32_model = onnx.load(fp32_path)
+    # Квантуются только свёртки: декодирование боксов в голове Detect (Sigmoid, Softmax, арифметика)
+    # остаётся во float, как и свёртка DFL после Softmax - в INT8 они сильно теряют точность
+    nodes = list(fp32_model.graph.node)
+    softmax_index = next((i for i, node in enumerate(nodes) if node.op_type == 'Softmax'), len(nodes))
+    nodes_to_exclude = [node.name for node in nodes[softmax_index:] if node.op_type == 'Conv']
+
+    quantize_static(
+        fp32_path,
+        int8_path,
+        FramesReader(fp32_model.graph.input[0].name),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        op_types_to_quantize=['Conv'],
+        nodes_to_exclude=nodes_to_exclude
+    )
+
+    # quantize_static не переносит метаданные ultralytics (имена классов, stride, imgsz)
+    int8_model = onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, int8_path)
+
+def export_model(model_path: str, backend: str, imgsz: tuple, int8: bool = False, calibration_source: str | None = None, calibration_frames: int = 300) -> str:
+    """
+    Экспортирует .pt в формат бэкенда (или берёт из кэша рядом с .pt, если он собран с теми же параметрами).
+    :return: Путь к артефакту для YOLO(...).
+    """
+
+    artifact = artifact_path(model_path, backend, int8)
+    expected_metadata = _export_metadata(model_path, imgsz, int8)
+    if _is_cached(artifact, expected_metadata):
+        backends_logger.info(f'Using cached {backend}{' INT8' if int8 else ''} model: {artifact}')
+        return artifact
+
+    frames = None
+    if int8:
+        if not calibration_source:
+            raise ValueError('INT8 quantization requires INFERENCE_CALIBRATION_SOURCE (recorded frames or videos from the camera)')
+        frames = collect_calibration_frames(calibration_source, calibration_frames)
+        backends_logger.info(f'Collected {len(frames)} calibration frame(s) from {calibration_source}')
+        expected_metadata['calibration_frames'] = len(frames)
+
+    backends_logger.info(f'Exporting {model_path} to {backend}{' INT8' if int8 else ''} at imgsz={imgsz}. This may take a while...')
+    model = YOLO(model_path)
+    if backend == 'onnx':
+        fp32_artifact = artifact_path(model_path, 'onnx')
+        exported = model.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+        if exported != fp32_artifact:
+            os.replace(exported, fp32_artifact)
+        if int8:
+            quantize_onnx_int8(fp32_artifact, artifact, frames, imgsz)
+    elif backend == 'openvino':
+        export_kwargs = {'format': 'openvino', 'imgsz': imgsz, 'dynamic': True}
+        if int8:
+            import tempfile
+            with tempfile.TemporaryDirectory(prefix='alertcam_calib_') as dataset_dir:
+                data_yaml = _write_calibration_dataset(frames, model.names, dataset_dir)
+                exported = model.export(int8=True, data=data_yaml, batch=1, **export_kwargs)
+        else:
+            exported = model.export(**export_kwargs)
+        if os.path.normpath(exported) != os.path.normpath(artifact):
+            os.replace(exported, artifact)
+    else:
+        raise ValueError(f'Unknown inference backend: {backend}. Expected one of {INFERENCE_BACKENDS}')
+
+    with open(_metadata_path(artifact), 'w') as f:
+        json.dump(expected_metadata, f)
+    backends_logger.info(f'Exported {backend} model cached at {artifact}')
+    return artifact
+
+def load_detection_model(
+        model_path: str,
+        backend: str = 'torch',
+        imgsz: tuple = (640, 640),
+        int8: bool = False,
+        calibration_source: str | None = None,
+        calibration_frames: int = 300
+) -> tuple:
+    """
+    Загружает модель детекции для выбранного бэкенда.
+    :return: Пара (YOLO, дополнительные аргументы predict для этого бэкенда).
+    """
+
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f'Unknown inference backend: {backend}. Expected one of {INFERENCE_BACKENDS}')
+
+    if backend == 'torch':
+        import torch
+        if int8:
+            backends_logger.warning('INT8 quantization is only supported for onnx/openvino backends; running float PyTorch')
+        # half=True имеет смысл только на GPU; на CPU ultralytics молча считает во float32
+        return YOLO(model_path), {'half': torch.cuda.is_available()}
+
+    if not model_path.endswith('.pt'):
+        # Уже экспортированная модель: используем как есть
+        return YOLO(model_path, task='detect'), {'device': 'cpu'}
+
+    artifact = export_model(model_path, backend, imgsz, int8, calibration_source, calibration_frames)
+    return YOLO(artifact, task='detect'), {'device': 'cpu'}
@@ -0,0 +1,318 @@
+import cv2
+import time
+import logging
+import threading
+from .frame_ring import SharedFrameRing
+from .jpeg_buffer import JpegFrameBuffer
+from .decoders import DECODER_BACKENDS, open_capture
+
+FRAME_BUFFER_MODES = ('shm', 'jpeg')
+REPLAY_PACES = ('file', 'fast')
+# Слотов хватает, чтобы грабер не успел по кругу дойти до кадра, который сейчас копируется для инференса
+MIN_FRAME_RING_SLOTS = 4
+
+capture_logger = logging.getLogger('VehicleDetectorProcess.capture')
+
+class FrameGrabber(threading.Thread):
+    """
+    Поток захвата кадров.
+    Непрерывно декодирует видеопоток, складывает каждый кадр в буфер для видео событий
+    и отдаёт инференсу только самый свежий кадр (latest-frame-wins).
+
+    Режимы буфера: 'shm' - кольцевой буфер несжатых кадров в разделяемой памяти,
+    'jpeg' - кадры сжимаются в JPEG в отдельном потоке и хранятся в памяти процесса детектора.
+
+    Декодер: 'opencv' (cv2.VideoCapture) или 'pyav' - многопоточный FFmpeg, отдающий кадры
+    сразу в размере для детекции (см. decoders.PyAvCapture).
+
+    При replay_pace источник считается записанным видеофайлом: метки времени кадров берутся из файла
+    (секунды от начала), а по концу файла поток завершается с finished=True вместо переподключения.
+    'file' - кадры отдаются в темпе исходного видео, 'fast' - так быстро, как их забирает детектор,
+    но без пропусков (следующий кадр публикуется только после того, как забран предыдущий).
+    """
+
+    def __init__(
+            self,
+            source,
+            running_flag_shared,
+            target_width: int,
+            buffer_size: int,
+            camera_id: str = 'main',
+            new_frame_event: threading.Event | None = None,
+            buffer_mode: str = 'shm',
+            buffer_max_bytes: int | None = None,
+            buffer_max_age_s: float | None = None,
+            jpeg_quality: int = 80,
+            replay_pace: str | None = None,
+            decoder_backend: str = 'opencv',
+            decoder_threads: int = 0,
+            stage_observer=None,
+            max_read_failures: int = 5,
+            base_retry_delay: int = 2
+    ):
+        super().__init__(name=f'FrameGrabberThread-{camera_id}', daemon=True)
+        self.source = source
+        self.camera_id = camera_id
+        self.new_frame_event = new_frame_event
+        self.running_flag_shared = running_flag_shared
+        self.target_width = target_width
+        self.stage_observer = stage_observer
+
+        if decoder_backend not in DECODER_BACKENDS:
+            raise ValueError(f'Unknown decoder backend: {decoder_backend}. Expected one of {DECODER_BACKENDS}')
+        self.decoder_backend = decoder_backend
+        self.decoder_threads = decoder_threads
+        self.max_read_failures = max_read_failures
+        self.base_retry_delay = base_retry_delay
+
+        if buffer_mode not in FRAME_BUFFER_MODES:
+            raise ValueError(f'Unknown frame buffer mode: {buffer_mode}. Expected one of {FRAME_BUFFER_MODES}')
+        self.buffer_mode = buffer_mode
+        self.buffer_size = buffer_size
+        self.buffer_max_bytes = buffer_max_bytes
+        self.frame_ring = None
+        self.jpeg_buffer = None
+        if buffer_mode == 'jpeg':
+            self.jpeg_buffer = JpegFrameBuffer(
+                camera_id,
+                max_age_s=buffer_max_age_s,
+                max_bytes=buffer_max_bytes or float('inf'),
+                quality=jpeg_quality
+            )
+        self._source_shape = None
+
+        if replay_pace is not None and replay_pace not in REPLAY_PACES:
+            raise ValueError(f'Unknown replay pace: {replay_pace}. Expected one of {REPLAY_PACES}')
+        self.replay_pace = replay_pace
+        self.finished = False
+        self._replay_frame_index = 0
+        self._replay_wall_anchor = None
+
+        self._condition = threading.Condition()
+        self._latest = None
+        self._latest_seq = 0
+        self._taken_seq = 0
+        self._stopped = False
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def _is_running(self) -> bool:
+        return not self._stopped and self.running_flag_shared.value
+
+    def _detection_shape(self, frame) -> tuple:
+        original_height, original_width = frame.shape[:2]
+        if original_width > self.target_width:
+            ratio = self.target_width / original_width
+            return (int(original_height * ratio), self.target_width, frame.shape[2])
+        return frame.shape
+
+    def _create_frame_ring(self, frame_shape: tuple) -> SharedFrameRing:
+        slots = self.buffer_size
+        if self.buffer_max_bytes:
+            slots_in_budget = int(self.buffer_max_bytes // SharedFrameRing.required_bytes(1, frame_shape))
+            if slots_in_budget < slots:
+                capture_logger.warning(
+                    f'Camera {self.camera_id}: Frame buffer budget of {self.buffer_max_bytes / 2**20:.0f} MB fits only '
+                    f'{slots_in_budget} of {slots} raw frames; pre-event video will be shorter. Consider FRAME_BUFFER_MODE=jpeg'
+                )
+                slots = max(slots_in_budget, MIN_FRAME_RING_SLOTS)
+        frame_ring = SharedFrameRing.create(slots, frame_shape)
+        capture_logger.info(
+            f'Camera {self.camera_id}: Created shared frame ring {frame_ring.name} '
+            f'({slots} slots of {frame_ring.frame_shape}, '
+            f'{SharedFrameRing.required_bytes(slots, frame_ring.frame_shape) / 2**20:.0f} MB)'
+        )
+        return frame_ring
+
+    def _publish_jpeg(self, frame, timestamp: float):
+        detection_shape = self._detection_shape(frame)
+        if detection_shape != frame.shape:
+            resize_started_at = time.perf_counter()
+            frame = cv2.resize(frame, (detection_shape[1], detection_shape[0]), interpolation=cv2.INTER_AREA)
+            if self.stage_observer is not None:
+                self.stage_observer.observe('resize', time.perf_counter() - resize_started_at)
+
+        with self._condition:
+            if self._latest is not None and self._taken_seq < self._latest_seq:
+                self.frames_dropped += 1
+            self._latest_seq += 1
+            self._latest = (self._latest_seq, frame, timestamp)
+            self.frames_captured += 1
+            self._condition.notify_all()
+        self.jpeg_buffer.submit(self._latest_seq, frame, timestamp)
+        if self.new_frame_event is not None:
+            self.new_frame_event.set()
+
+    def _replay_timestamp(self, cap) -> float:
+        """Метка времени кадра записанного видео (секунды от начала файла); в темпе 'file' ещё и выдерживает паузу до него."""
+
+        media_timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if media_timestamp <= 0 and self._replay_frame_index:
+            media_timestamp = self._replay_frame_index / (cap.get(cv2.CAP_PROP_FPS) or 25)
+        self._replay_frame_index += 1
+
+        if self.replay_pace == 'file':
+            if self._replay_wall_anchor is None:
+                self._replay_wall_anchor = time.time() - media_timestamp
+            delay = self._replay_wall_anchor + media_timestamp - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            with self._condition:
+                while self._taken_seq < self._latest_seq and self._is_running():
+                    self._condition.wait(timeout=0.5)
+        return media_timestamp
+
+    def _publish(self, frame, timestamp: float):
+        if self.buffer_mode == 'jpeg':
+            self._publish_jpeg(frame, timestamp)
+            return
+
+        if self.frame_ring is None:
+            self.frame_ring = self._create_frame_ring(self._detection_shape(frame))
+        elif frame.shape != self._source_shape and self._detection_shape(frame) != self.frame_ring.frame_shape:
+            capture_logger.warning(f'Camera {self.camera_id}: Frame size changed to {frame.shape}, scaling into ring slots of {self.frame_ring.frame_shape}')
+
+        self._source_shape = frame.shape
+
+        # Уменьшение кадра выполняется сразу в слот разделяемой памяти, без промежуточной копии
+        resize_started_at = time.perf_counter()
+        seq = self.frame_ring.write(frame, timestamp)
+        if self.stage_observer is not None:
+            # Уменьшение и копирование в слот - одна операция
+            self.stage_observer.observe('resize', time.perf_counter() - resize_started_at)
+        with self._condition:
+            if self._latest is not None and self._taken_seq < self._latest_seq:
+                self.frames_dropped += 1
+            self._latest_seq = seq
+            self._latest = (seq, self.frame_ring.slot_view(seq), timestamp)
+            self.frames_captured += 1
+            self._condition.notify_all()
+        if self.new_frame_event is not None:
+            self.new_frame_event.set()
+
+    def run(self):
+        cap = None
+        consecutive_read_failures = 0
+
+        capture_logger.info(f'Frame grabber started for camera {self.camera_id}, source: {self.source}')
+        while self._is_running():
+            try:
+                if cap is None or not cap.isOpened():
+                    capture_logger.info(f'Camera {self.camera_id}: Opening video capture for {self.source} ({self.decoder_backend} decoder)...')
+                    if cap:
+                        cap.release()
+                    cap = open_capture(self.source, self.decoder_backend, self.target_width, self.decoder_threads)
+                    if not cap.isOpened() and self.replay_pace:
+                        capture_logger.error(f'Camera {self.camera_id}: Failed to open recorded video {self.source}')
+                        break
+                    if not cap.isOpened():
+                        capture_logger.warning(f'Camera {self.camera_id}: Failed to open video capture. Retrying...')
+                        time.sleep(5)
+                        continue
+                    capture_logger.info(f'Camera {self.camera_id}: Video capture opened successfully')
+                    consecutive_read_failures = 0
+
+                decode_started_at = time.perf_counter()
+                ret, frame = cap.read()
+                if ret and self.stage_observer is not None:
+                    self.stage_observer.observe('decode', time.perf_counter() - decode_started_at)
+                if ret:
+                    consecutive_read_failures = 0
+                    self._publish(frame, self._replay_timestamp(cap) if self.replay_pace else time.time())
+                elif self.replay_pace:
+                    capture_logger.info(f'Camera {self.camera_id}: End of recorded video after {self._replay_frame_index} frame(s)')
+                    break
+                else:
+                    consecutive_read_failures += 1
+                    capture_logger.warning(f'Camera {self.camera_id}: Failed to read frame from source. Attempt {consecutive_read_failures}/{self.max_read_failures}')
+                    if cap:
+                        cap.release()
+                    cap = None
+                    if consecutive_read_failures >= self.max_read_failures:
+                        capture_logger.error(f'Camera {self.camera_id}: Max read failures reached ({self.max_read_failures}). Waiting longer before retry')
+                        time.sleep(30)
+                        consecutive_read_failures = 0
+                    else:
+                        time.sleep(self.base_retry_delay * consecutive_read_failures)
+            except Exception as e:
+                capture_logger.error(f'Camera {self.camera_id}: An error occurred in frame grabber: {e}', exc_info=True)
+                time.sleep(5)
+
+        if cap:
+            cap.release()
+        self.finished = self.replay_pace is not None
+        self.stop()
+        capture_logger.info(f'Frame grabber for camera {self.camera_id} stopped')
+
+    def get_latest(self, last_seq: int, timeout: float = 1.0):
+        """
+        Возвращает самый свежий кадр новее last_seq.
+        В режиме 'shm' кадр копируется из слота: грабер продолжает писать в кольцо, пока идёт инференс.
+        Если за время копирования слот успели перезаписать, кадр пропускается.
+        :return: Кортеж (seq, frame, timestamp) или None, если за timeout новых (целых) кадров не было.
+        """
+
+        with self._condition:
+            self._condition.wait_for(lambda: self._latest_seq > last_seq or self._stopped, timeout=timeout)
+            if self._latest_seq <= last_seq:
+                return None
+            self._taken_seq = self._latest_seq
+            if self.replay_pace == 'fast':
+                self._condition.notify_all()
+            latest = self._latest
+            frame_ring = self.frame_ring
+
+        if frame_ring is None:
+            return latest
+        seq, frame_view, timestamp = latest
+        if frame_view is None:
+            return None
+        frame = frame_view.copy()
+        if not frame_ring.is_valid(seq):
+            with self._condition:
+                self.frames_dropped += 1
+            capture_logger.debug(f'Camera {self.camera_id}: Frame {seq} was overwritten while being copied for inference. Dropped')
+            return None
+        return seq, frame, timestamp
+
+    def buffer_size_bytes(self) -> int:
+        """Текущий объём памяти, занятый буфером кадров до события."""
+
+        if self.jpeg_buffer is not None:
+            return self.jpeg_buffer.size_bytes
+        if self.frame_ring is not None:
+            return SharedFrameRing.required_bytes(self.frame_ring.slots, self.frame_ring.frame_shape)
+        return 0
+
+    def buffered_frame_count(self) -> int:
+        """Количество кадров, доступных сейчас в буфере кадров до события."""
+
+        if self.jpeg_buffer is not None:
+            return len(self.jpeg_buffer)
+        if self.frame_ring is not None:
+            return self.frame_ring.latest_seq - self.frame_ring.oldest_seq + 1 if self.frame_ring.latest_seq else 0
+        return 0
+
+    def buffer_frames_skipped(self) -> int:
+        """Количество кадров, не попавших в буфер JPEG из-за переполненной очереди кодирования."""
+
+        if self.jpeg_buffer is not None:
+            return self.jpeg_buffer.frames_skipped
+        return 0
+
+    def release_frame_ring(self):
+        """Освобождает буфер кадров (сегмент разделяемой памяти); вызывается после остановки потока."""
+
+        if self.jpeg_buffer is not None:
+            self.jpeg_buffer.stop()
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+            self.frame_ring.unlink()
+            self.frame_ring = None
@@ -0,0 +1,94 @@
+import cv2
+import logging
+
+DECODER_BACKENDS = ('opencv', 'pyav')
+
+decoders_logger = logging.getLogger('VehicleDetectorProcess.decoders')
+
+def detection_size(width: int, height: int, target_width: int) -> tuple:
+    """:return: (width, height) кадра для детекции - тот же расчёт, что и в FrameGrabber."""
+
+    if width > target_width:
+        return target_width, int(height * target_width / width)
+    return width, height
+
+class PyAvCapture:
+    """
+    Декодирование видеопотока через PyAV (FFmpeg) с многопоточным декодером.
+    Кадр переводится в BGR сразу в размере для детекции: libswscale уменьшает его одним проходом
+    вместе с преобразованием цвета, полноразмерный BGR-кадр и отдельный cv2.resize не нужны.
+    Повторяет ту часть интерфейса cv2.VideoCapture, которой пользуется FrameGrabber.
+    """
+
+    def __init__(self, source, target_width: int | None = None, threads: int = 0, rtsp_transport: str = 'tcp', open_timeout_s: float = 10.0):
+        import av
+
+        self._av = av
+        self.target_width = target_width
+        self._container = None
+        self._stream = None
+        self._frames = None
+        self._last_time = 0.0
+
+        options = {'rtsp_transport': rtsp_transport} if str(source).startswith('rtsp') else {}
+        try:
+            self._container = av.open(str(source), options=options, timeout=open_timeout_s)
+            self._stream = self._container.streams.video[0]
+        except (av.FFmpegError, OSError, IndexError) as e:
+            decoders_logger.warning(f'PyAV could not open {source}: {e}')
+            self.release()
+            return
+
+        # 'AUTO' - потоки по кадрам и по слайсам; thread_count=0 - по числу ядер
+        self._stream.thread_type = 'AUTO'
+        self._stream.thread_count = threads
+        self._frames = self._container.decode(self._stream)
+
+    def isOpened(self) -> bool:
+        return self._container is not None
+
+    def read(self) -> tuple:
+        if self._frames is None:
+            return False, None
+        try:
+            frame = next(self._frames)
+        except (StopIteration, self._av.FFmpegError, OSError) as e:
+            if not isinstance(e, StopIteration):
+                decoders_logger.warning(f'PyAV decode error: {e}')
+            return False, None
+
+        if frame.time is not None:
+            self._last_time = frame.time
+        width, height = frame.width, frame.height
+        if self.target_width:
+            width, height = detection_size(width, height, self.target_width)
+        return True, frame.to_ndarray(format='bgr24', width=width, height=height, interpolation='AREA')
+
+    def get(self, prop_id: int) -> float:
+        if self._stream is None:
+            return 0.0
+        if prop_id == cv2.CAP_PROP_POS_MSEC:
+            return self._last_time * 1000
+        if prop_id == cv2.CAP_PROP_FPS:
+            return float(self._stream.average_rate or 0)
+        if prop_id == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self._stream.frames)
+        return 0.0
+
+    def release(self):
+        if self._container is not None:
+            self._container.close()
+        self._container = None
+        self._frames = None
+
+def open_capture(source, backend: str = 'opencv', target_width: int | None = None, threads: int = 0):
+    """
+    Открывает видеопоток выбранным декодером.
+    :return: cv2.VideoCapture или PyAvCapture (кадры уже уменьшены до target_width).
+    """
+
+    if backend == 'pyav':
+        return PyAvCapture(source, target_width, threads)
+    if backend != 'opencv':
+        raise ValueError(f'Unknown decoder backend: {backend}. Expected one of {DECODER_BACKENDS}')
+    return cv2.VideoCapture(source)
@@ -0,0 +1,167 @@
+import os
+import time
+import logging
+import uuid
+import numpy as np
+from multiprocessing import shared_memory
+from .postprocess import BOX_X1, BOX_Y1, BOX_X2, BOX_Y2, BOX_TRACK_ID, BOX_CONF, BOX_CLS, build_api_detections
+
+DETECTION_RECORD_DTYPE = np.dtype([
+    ('camera_index', np.int32),
+    ('class_id', np.int32),
+    ('track_id', np.int64),
+    ('conf', np.float32),
+    ('box', np.float32, (4,))
+])
+
+DEFAULT_SNAPSHOT_CAPACITY = 1024
+
+HEADER_BYTES = 32
+
+snapshot_logger = logging.getLogger('VehicleDetectorProcess.detection_snapshot')
+
+class DetectionSnapshot:
+    """
+    Детекции последнего кадра всех камер в разделяемой памяти (multiprocessing.shared_memory).
+    Детектор публикует их каждый кадр, потоки Flask читают без обращения к процессу Manager и без pickle.
+
+    Раскладка сегмента: [seq: int64][timestamp: float64][count: int64][резерв: int64][записи DETECTION_RECORD_DTYPE * capacity].
+    Согласованность - seqlock: писатель (он один) делает seq нечётным на время записи и чётным после;
+    читатель копирует данные и повторяет чтение, если seq был нечётным или изменился за время копирования.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, camera_ids: list, capacity: int, owner: bool):
+        self._shm = shm
+        self.camera_ids = list(camera_ids)
+        self.capacity = capacity
+        self.owner = owner
+        self._camera_indexes = {camera_id: index for index, camera_id in enumerate(self.camera_ids)}
+        self._truncation_reported = False
+
+        buf = shm.buf
+        self._seq = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=0)
+        self._timestamp = np.ndarray((1,), dtype=np.float64, buffer=buf, offset=8)
+        self._count = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=16)
+        self._records = np.ndarray((capacity,), dtype=DETECTION_RECORD_DTYPE, buffer=buf, offset=HEADER_BYTES)
+
+    @staticmethod
+    def required_bytes(capacity: int) -> int:
+        return HEADER_BYTES + capacity * DETECTION_RECORD_DTYPE.itemsize
+
+    @classmethod
+    def create(cls, camera_ids: list, capacity: int = DEFAULT_SNAPSHOT_CAPACITY, name: str | None = None) -> 'DetectionSnapshot':
+        """Создаёт новый сегмент разделяемой памяти; создатель отвечает за unlink()."""
+
+        name = name or f'alertcam_detections_{uuid.uuid4().hex[:12]}'
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.required_bytes(capacity))
+        snapshot = cls(shm, camera_ids, capacity, owner=True)
+        snapshot._seq[0] = 0
+        snapshot._timestamp[0] = 0.0
+        snapshot._count[0] = 0
+        return snapshot
+
+    @classmethod
+    def attach(cls, descriptor: dict) -> 'DetectionSnapshot':
+        """Подключается к существующему сегменту по его дескриптору (см. descriptor())."""
+
+        shm = shared_memory.SharedMemory(name=descriptor['name'])
+        if os.name == 'posix':
+            # Подключившийся процесс не владеет сегментом: иначе resource_tracker удалит его при выходе процесса
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, descriptor['camera_ids'], descriptor['capacity'], owner=False)
+
+    def descriptor(self) -> dict:
+        """Небольшой picklable-дескриптор для передачи в другие процессы."""
+
+        return {'name': self._shm.name, 'camera_ids': self.camera_ids, 'capacity': self.capacity}
+
+    @property
+    def version(self) -> int:
+        """Номер последней опубликованной версии (0 - ещё ничего не публиковалось)."""
+
+        return int(self._seq[0]) // 2
+
+    def publish(self, camera_boxes: dict, timestamp: float):
+        """
+        Публикует детекции кадра.
+        :param camera_boxes: Словарь {camera_id: массив боксов (N, 7) в раскладке postprocess.BOX_*}.
+        :param timestamp: Метка времени самого свежего кадра.
+        """
+
+        rows = [(self._camera_indexes[camera_id], box_array) for camera_id, box_array in camera_boxes.items() if len(box_array) and camera_id in self._camera_indexes]
+        total = sum(len(box_array) for _, box_array in rows)
+
+        seq = int(self._seq[0])
+        self._seq[0] = seq + 1
+        offset = 0
+        for camera_index, box_array in rows:
+            box_array = box_array[:self.capacity - offset]
+            end = offset + len(box_array)
+            records = self._records[offset:end]
+            records['camera_index'] = camera_index
+            records['class_id'] = box_array[:, BOX_CLS]
+            records['track_id'] = box_array[:, BOX_TRACK_ID]
+            records['conf'] = box_array[:, BOX_CONF]
+            records['box'] = box_array[:, BOX_X1:BOX_Y2 + 1]
+            offset = end
+            if offset == self.capacity:
+                break
+        self._count[0] = offset
+        self._timestamp[0] = timestamp
+        self._seq[0] = seq + 2
+
+        if total > self.capacity and not self._truncation_reported:
+            self._truncation_reported = True
+            snapshot_logger.warning(f'Detection snapshot holds {self.capacity} detections, {total - self.capacity} dropped. Increase DETECTION_SNAPSHOT_CAPACITY')
+
+    def read(self, max_attempts: int = 1000) -> tuple:
+        """
+        Согласованная копия последней публикации.
+        :return: (version, timestamp, записи DETECTION_RECORD_DTYPE).
+        """
+
+        for attempt in range(max_attempts):
+            seq = int(self._seq[0])
+            if not seq & 1:
+                count = int(self._count[0])
+                timestamp = float(self._timestamp[0])
+                records = self._records[:count].copy()
+                if int(self._seq[0]) == seq:
+                    return seq // 2, timestamp, records
+            # Писатель держит seq нечётным микросекунды; уступаем ему GIL/процессор
+            time.sleep(0 if attempt < 10 else 0.0001)
+        raise TimeoutError('Could not read a consistent detection snapshot')
+
+    def camera_box_array(self, records: np.ndarray, camera_id: str) -> np.ndarray:
+        """:return: Массив боксов (N, 7) камеры из записей read() - в той же раскладке, что в детекторе."""
+
+        records = records[records['camera_index'] == self._camera_indexes.get(camera_id, -1)]
+        box_array = np.empty((len(records), 7), dtype=np.float64)
+        box_array[:, BOX_X1:BOX_Y2 + 1] = records['box']
+        box_array[:, BOX_TRACK_ID] = records['track_id']
+        box_array[:, BOX_CONF] = records['conf']
+        box_array[:, BOX_CLS] = records['class_id']
+        return box_array
+
+    def api_detections(self, records: np.ndarray, class_map: dict, camera_id: str | None = None) -> list:
+        """Список словарей детекций для API (как build_api_detections) из записей read(), по всем камерам или одной."""
+
+        camera_ids = [camera_id] if camera_id is not None else self.camera_ids
+        return [vehicle for camera_id in camera_ids for vehicle in build_api_detections(self.camera_box_array(records, camera_id), camera_id, class_map)]
+
+    def has_track(self, records: np.ndarray, camera_id: str, track_id: int) -> bool:
+        camera_index = self._camera_indexes.get(camera_id, -1)
+        return bool(np.any((records['camera_index'] == camera_index) & (records['track_id'] == track_id)))
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def close(self):
+        self._seq = self._timestamp = self._count = self._records = None
+        self._shm.close()
+
+    def unlink(self):
+        if self.owner:
+            self._shm.unlink()
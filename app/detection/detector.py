@@ -3,12 +3,22 @@ import time
 import math
 import logging
 import os
-import uuid
-from collections import deque
-from ultralytics import YOLO
+import threading
+from .backends import load_detection_model
+from .capture import FrameGrabber
+from .tracking import create_tracker, set_tracker_frame_rate, track_batch
+from ..alarm_registry import AlarmTrackIndex
+from ..metrics import MetricsRecorder
+from .track_history import AlarmedTrackStore
+from .motion_gate import MotionGate
+from .roi import CameraRoi
+from .postprocess import BOX_TRACK_ID, VEHICLE_CLASS_MAP, boxes_to_array, box_centroids, build_api_detections, match_alarmed_rows
+from .detection_snapshot import DetectionSnapshot
 
 detector_logger = logging.getLogger('VehicleDetectorProcess')
 
+PENDING_RECORDING_STALL_TIMEOUT_S = 10
+
 def setup_detector_logging(level_str='INFO'):
     """Настраивает логгирование для процесса детектора."""
     level = getattr(logging, level_str.upper(), logging.INFO)
@@ -22,19 +32,296 @@ def setup_detector_logging(level_str='INFO'):
 def distance_calc(p1, p2):
     return math.hypot(p2[0] - p1[0], p2[1] - p1[1])
 
+def build_ring_video_task(frame_ring, event_data: dict, video_filepath: str, fps: int, start_timestamp: float, end_timestamp: float) -> dict:
+    """
+    Формирует задачу для видеописателя, ссылающуюся на кадры в кольцевом буфере разделяемой памяти.
+    Видеописатель сам дочитывает кадры по мере их появления, пока не дойдёт до end_timestamp.
+    """
+
+    return {
+        'video_filepath': video_filepath,
+        'frame_ring': frame_ring.descriptor(),
+        'start_seq': frame_ring.seq_at_or_after(start_timestamp),
+        'end_timestamp': end_timestamp,
+        'frame_size': frame_ring.frame_size,
+        'fps': fps,
+        'event_data': event_data
+    }
+
+def start_event_video(camera, event_data: dict, video_filepath: str, fps: int, start_timestamp: float, end_timestamp: float, video_writer_queue_shared):
+    """
+    Запускает запись видео события из буфера кадров камеры.
+    В режиме 'shm' задача сразу уходит видеописателю; в режиме 'jpeg' запись ждёт кадров
+    после события в pending_video_recordings и отправляется в advance_pending_video_recordings.
+    """
+
+    grabber = camera.grabber
+    if grabber.frame_ring is not None:
+        video_task = build_ring_video_task(grabber.frame_ring, event_data, video_filepath, fps, start_timestamp, end_timestamp)
+        video_writer_queue_shared.put(video_task)
+        detector_logger.info(f'Sent video recording task for {os.path.basename(video_filepath)} (frames from seq {video_task['start_seq']}, shared memory)')
+        return
+
+    if grabber.jpeg_buffer is None:
+        detector_logger.warning(f'Camera {camera.camera_id}: No frames buffered yet, video {os.path.basename(video_filepath)} will not be recorded')
+        return
+
+    # Запись держит только закреплённый диапазон кадров общего буфера, а не свои копии
+    camera.pending_video_recordings[video_filepath] = {
+        'pin_id': grabber.jpeg_buffer.pin(start_timestamp),
+        'end_timestamp': end_timestamp,
+        'frame_size': camera.frame_size,
+        'fps': fps,
+        'event_data': event_data,
+        'latest_timestamp': grabber.jpeg_buffer.latest_timestamp,
+        'progress_at': time.time()
+    }
+    detector_logger.info(f'Pinned JPEG frames from {start_timestamp:.2f} for video {os.path.basename(video_filepath)} ({grabber.jpeg_buffer.pinned_count} pending recording(s))')
+
+def advance_pending_video_recordings(camera, video_writer_queue_shared, flush: bool = False):
+    """
+    Отправляет видеописателю записи режима 'jpeg', для которых уже есть кадры после end_timestamp.
+    Если новые кадры перестали поступать, запись отправляется с тем, что есть; при flush - сразу все записи.
+    """
+
+    jpeg_buffer = camera.grabber.jpeg_buffer
+    latest_timestamp = jpeg_buffer.latest_timestamp
+    for video_filepath in list(camera.pending_video_recordings.keys()):
+        recording = camera.pending_video_recordings[video_filepath]
+        end_timestamp = recording['end_timestamp']
+        # Остановку потока отслеживаем по настенным часам, а не по меткам кадров:
+        # при воспроизведении записи они не совпадают
+        if latest_timestamp != recording['latest_timestamp']:
+            recording['latest_timestamp'] = latest_timestamp
+            recording['progress_at'] = time.time()
+        finished = (
+            flush
+            or (latest_timestamp is not None and latest_timestamp > end_timestamp)
+            or time.time() - recording['progress_at'] > PENDING_RECORDING_STALL_TIMEOUT_S
+        )
+        if not finished:
+            continue
+
+        del camera.pending_video_recordings[video_filepath]
+        encoded_frames = jpeg_buffer.collect(recording['pin_id'], end_timestamp)
+        jpeg_buffer.release(recording['pin_id'])
+        if not encoded_frames:
+            detector_logger.warning(f'No frames captured for video {os.path.basename(video_filepath)}. Skipping')
+            continue
+        video_writer_queue_shared.put({
+            'video_filepath': video_filepath,
+            'encoded_frames': encoded_frames,
+            'frame_encoding': 'jpeg',
+            'frame_size': recording['frame_size'],
+            'fps': recording['fps'],
+            'event_data': recording['event_data']
+        })
+        detector_logger.info(f'Sent JPEG video task for {os.path.basename(video_filepath)} ({len(encoded_frames)} frames) to writer queue')
+
+class CameraContext:
+    """Состояние одной камеры в процессе детектора: захват, трекер и логика событий."""
+
+    def __init__(self, camera_id: str, grabber: FrameGrabber, tracker, alarmed_tracks: AlarmedTrackStore, motion_gate: MotionGate | None = None, roi: CameraRoi | None = None):
+        self.camera_id = camera_id
+        self.roi = roi
+        self.grabber = grabber
+        self.tracker = tracker
+        self.alarmed_tracks = alarmed_tracks
+        self.motion_gate = motion_gate
+
+        self.last_frame_seq = 0
+        self.frame_size = None
+        self.last_box_array = boxes_to_array(None)
+        self.last_track_ids = set()
+        self.last_capture_lag = 0.0
+        self.alarm_ids = set()
+
+        self.pending_video_recordings = {}
+
+        # Частота обновлений трекера - по меткам времени кадров, прошедших инференс (не частота камеры)
+        self.tracker_frame_rate = None
+        self._tracker_updates = 0
+        self._tracker_window_started_at = None
+        self._tracker_updated_at = None
+
+    def note_tracker_update(self, timestamp: float):
+        if self._tracker_window_started_at is None:
+            self._tracker_window_started_at = timestamp
+        else:
+            self._tracker_updates += 1
+        self._tracker_updated_at = timestamp
+
+    def retune_tracker(self, max_frame_rate: float) -> float | None:
+        """
+        Подстраивает буфер потерянных треков трекера под измеренную частоту его обновлений
+        (motion gate и пропуск кадров детектором её снижают).
+        :return: Сглаженная частота обновлений или None, пока замеров недостаточно.
+        """
+
+        span_s = (self._tracker_updated_at or 0.0) - (self._tracker_window_started_at or 0.0)
+        if self._tracker_updates < 2 or span_s <= 0:
+            return self.tracker_frame_rate
+        measured = min(max_frame_rate, self._tracker_updates / span_s)
+        self.tracker_frame_rate = measured if self.tracker_frame_rate is None else 0.7 * self.tracker_frame_rate + 0.3 * measured
+        set_tracker_frame_rate(self.tracker, self.tracker_frame_rate)
+        self._tracker_updates = 0
+        self._tracker_window_started_at = self._tracker_updated_at
+        return self.tracker_frame_rate
+
+class NullStageObserver:
+    """Приёмник замеров этапов конвейера по умолчанию: ничего не делает."""
+
+    def observe(self, stage: str, seconds: float):
+        pass
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+def refresh_camera_alarms(alarm_index: AlarmTrackIndex, cameras: list) -> bool:
+    """
+    Перестраивает индекс сигнализаций, если реестр изменился: удаляет состояния треков, снятых с охраны,
+    и включает инференс на следующем кадре камер, на которых появилась новая сигнализация.
+    :return: True, если индекс был перестроен.
+    """
+
+    if not alarm_index.refresh():
+        return False
+    for camera in cameras:
+        camera_alarms_by_track_id = alarm_index.for_camera(camera.camera_id)
+        evicted_count = camera.alarmed_tracks.evict_missing(camera_alarms_by_track_id)
+        if evicted_count:
+            detector_logger.debug(f'Camera {camera.camera_id}: Evicted state of {evicted_count} track(s) no longer under alarm')
+        alarm_ids = {alarm_info['alarm_db_id'] for alarms_for_track in camera_alarms_by_track_id.values() for alarm_info in alarms_for_track}
+        if camera.motion_gate is not None and alarm_ids - camera.alarm_ids:
+            # Новая тревога должна начать отслеживаться по свежим детекциям, а не по кадру, на котором сцена «не менялась»
+            camera.motion_gate.force()
+            detector_logger.debug(f'Camera {camera.camera_id}: New alarm(s) {sorted(alarm_ids - camera.alarm_ids)}, forcing inference on the next frame')
+        camera.alarm_ids = alarm_ids
+    return True
+
+def mark_alarmed_tracks_seen(camera: CameraContext, camera_alarms_by_track_id: dict, timestamp: float):
+    """Кадр пропущен motion gate: охраняемые машины с прошлого кадра считаются всё ещё на месте."""
+
+    for track_id in camera.last_track_ids:
+        if track_id in camera_alarms_by_track_id:
+            camera.alarmed_tracks.get(track_id, timestamp).last_seen = timestamp
+
+def detect_movements(camera: CameraContext, camera_alarms_by_track_id: dict, box_array, timestamp: float, time_window_s: float, min_distance_px: float) -> list:
+    """
+    Дописывает позиции охраняемых треков кадра в их историю и проверяет смещение за окно time_window_s.
+    :return: Для каждого сдвинувшегося трека - список событий 'movement', по одному на его сигнализацию.
+    """
+
+    camera_id = camera.camera_id
+    centroids = box_centroids(box_array)
+    movements = []
+    for row in match_alarmed_rows(box_array, camera_alarms_by_track_id.keys()).tolist():
+        track_id = int(box_array[row, BOX_TRACK_ID])
+        track_alarms = camera_alarms_by_track_id[track_id]
+        current_x, current_y = centroids[row].tolist()
+        alarmed_track = camera.alarmed_tracks.get(track_id, timestamp)
+
+        alarmed_track.last_seen = timestamp
+        if alarmed_track.disappeared_event_sent:
+            alarmed_track.disappeared_event_sent = False
+            # TODO
+            detector_logger.info(
+                f'Vehicle with Track ID {track_id} on camera {camera_id} (Alarm DB IDs: {[alarm_info['alarm_db_id'] for alarm_info in track_alarms]}) reappeared;\n'
+                f'User IDs: {[alarm_info['user_id'] for alarm_info in track_alarms]}'
+            )
+        # TODO
+        history = alarmed_track.history
+        history.append(timestamp, current_x, current_y)
+        history.prune(timestamp - time_window_s)
+
+        if len(history) > 1:
+            start_ts, start_pos = history.first()
+            end_ts, end_pos = history.last()
+            if end_ts - start_ts >= time_window_s * 0.8:
+                dist = distance_calc(start_pos, end_pos)
+                if dist >= min_distance_px:
+                    movement_events = []
+                    for alarm_info in track_alarms:
+                        detector_logger.info(f'[EVENT] Vehicle Track ID {track_id} on camera {camera_id} (Alarm DB ID: {alarm_info['alarm_db_id']}) MOVED: {dist:.0f}px in {(end_ts - start_ts):.2f}s')
+                        movement_events.append({
+                            'type': 'movement',
+                            'alarm_db_id': alarm_info['alarm_db_id'],
+                            'user_id': alarm_info['user_id'],
+                            'camera_id': camera_id,
+                            'track_id': track_id,
+                            'timestamp': timestamp,
+                            'details': {
+                                'distance_px': round(dist, 2),
+                                'time_seconds': round(end_ts - start_ts, 2),
+                                'start_pos': [round(p, 2) for p in start_pos],
+                                'end_pos': [round(p, 2) for p in end_pos]
+                            }
+                        })
+                    history.reset_to_last()
+                    detector_logger.debug(f'Movement detected for track_id {track_id} on camera {camera_id}. History reset')
+                    movements.append(movement_events)
+    return movements
+
+def detect_disappearances(camera: CameraContext, camera_alarms_by_track_id: dict, detected_track_ids: set, timestamp: float, disappearance_thresh_s: float) -> list:
+    """
+    Проверяет охраняемые треки, которых нет на кадре, дольше disappearance_thresh_s.
+    :return: Для каждого пропавшего трека - список событий 'disappearance', по одному на его сигнализацию.
+    """
+
+    camera_id = camera.camera_id
+    disappearances = []
+    for alarmed_track_id, track_alarms in camera_alarms_by_track_id.items():
+        if alarmed_track_id in detected_track_ids:
+            continue
+        alarmed_track = camera.alarmed_tracks.get(alarmed_track_id, timestamp)
+
+        time_since_last_seen = timestamp - alarmed_track.last_seen
+        if time_since_last_seen > disappearance_thresh_s and not alarmed_track.disappeared_event_sent:
+            disappearance_events = []
+            for alarm_info in track_alarms:
+                detector_logger.info(f'[EVENT] Vehicle Track ID {alarmed_track_id} on camera {camera_id} (Alarm DB ID: {alarm_info['alarm_db_id']}) disappeared. Not seen for {time_since_last_seen:.0f}s')
+                disappearance_events.append({
+                    'type': 'disappearance',
+                    'alarm_db_id': alarm_info['alarm_db_id'],
+                    'user_id': alarm_info['user_id'],
+                    'camera_id': camera_id,
+                    'track_id': alarmed_track_id,
+                    'timestamp': timestamp,
+                    'details': {
+                        'time_seconds': round(time_since_last_seen, 2)
+                    }
+                })
+            alarmed_track.disappeared_event_sent = True
+            alarmed_track.history.clear()
+            detector_logger.debug(f'Disappearance detected for track_id {alarmed_track_id} on camera {camera_id}. History cleared')
+            disappearances.append(disappearance_events)
+    return disappearances
+
 def detect_vehicles(
         running_flag_shared,
         config: dict,
-        last_bboxes_shared,
+        detection_snapshot,
         active_alarms_shared,
         event_queue_shared,
-        video_writer_queue_shared
+        video_writer_queue_shared,
+        detector_stats_shared=None,
+        metrics_shared=None,
+        stage_observer=None
 ):
+    """
+    Цикл детектора. Детекции каждого кадра публикуются в detection_snapshot
+    (DetectionSnapshot или его дескриптор). stage_observer получает длительности этапов обработки (observe)
+    и счётчики кадров (count); по умолчанию это MetricsRecorder, выгружающий их в metrics_shared.
+    """
+
     setup_detector_logging(config.get('log_level', 'INFO'))
     detector_logger.info('Detection process started with event generation logic')
 
     model_path = config.get('yolo_model_path', 'yolo11m.pt')
-    rtsp_source = config.get('rtsp_source')
+    camera_sources = config.get('cameras') or {'main': config.get('rtsp_source')}
+    default_camera_id = config.get('default_camera_id') or next(iter(camera_sources))
+    camera_rois = config.get('camera_rois') or {}
+    tracker_config = config.get('tracker_config', 'botsort.yaml')
     img_height = config.get('img_height')
     img_width = config.get('img_width')
     conf_thresh = config.get('conf_thresh')
@@ -51,281 +338,301 @@ def detect_vehicles(
     camera_fps = config.get('camera_fps')
     seconds_before = config.get('video_seconds_before_event')
     seconds_after = config.get('video_seconds_after_event')
-
+    frame_buffer_mode = config.get('frame_buffer_mode', 'shm')
+    frame_buffer_max_mb = config.get('frame_buffer_max_mb')
+    jpeg_quality = config.get('frame_buffer_jpeg_quality', 80)
+    motion_gate_enabled = config.get('motion_gate_enabled', False)
+    replay_pace = config.get('replay_pace')
+    if stage_observer is None:
+        stage_observer = MetricsRecorder(metrics_shared, 'detector') if metrics_shared is not None else NullStageObserver()
+
+    inference_backend = config.get('inference_backend', 'torch')
     try:
-        detector_logger.info(f'Loading YOLO model from: {model_path}')
-        model = YOLO(model_path)
+        detector_logger.info(f'Loading YOLO model from: {model_path} (backend: {inference_backend}{', INT8' if config.get('inference_int8') else ''})')
+        model, inference_overrides = load_detection_model(
+            model_path,
+            inference_backend,
+            (img_height, img_width),
+            int8=config.get('inference_int8', False),
+            calibration_source=config.get('inference_calibration_source'),
+            calibration_frames=config.get('inference_calibration_frames', 300)
+        )
         detector_logger.info('YOLO model loaded successfully')
     except Exception as e:
         detector_logger.error(f'Failed to load YOLO model: {e}', exc_info=True)
         running_flag_shared.value = False
         return
 
-    cap = None
-    consecutive_read_failures = 0
-    max_read_failures = 5
-    base_retry_delay = 2
-
     target_detection_width = 1280
 
-    class_map = {2: 'car', 3: 'motorcycle', 7: 'truck'}
+    class_map = VEHICLE_CLASS_MAP
     detector_logger.info(f'Using class names: {class_map}')
 
-    frame_buffer_size = camera_fps * (seconds_before + 2)
-    frame_buffer = deque(maxlen=frame_buffer_size)
+    if isinstance(detection_snapshot, dict):
+        detection_snapshot = DetectionSnapshot.attach(detection_snapshot)
 
-    vehicle_position_history = {}
-    alarmed_vehicles_last_seen = {}
-    disappeared_event_sent = set()
+    frame_buffer_size = camera_fps * (seconds_before + 2)
 
-    pending_video_recordings = {}
+    new_frame_event = threading.Event()
+    cameras = []
+    for camera_id, source in camera_sources.items():
+        detector_logger.info(f'Attempting to connect to camera {camera_id}: {source}')
+        grabber = FrameGrabber(
+            source,
+            running_flag_shared,
+            target_detection_width,
+            frame_buffer_size,
+            camera_id=camera_id,
+            new_frame_event=new_frame_event,
+            buffer_mode=frame_buffer_mode,
+            buffer_max_bytes=frame_buffer_max_mb * 2**20 if frame_buffer_max_mb else None,
+            buffer_max_age_s=seconds_before + 2,
+            jpeg_quality=jpeg_quality,
+            replay_pace=replay_pace,
+            decoder_backend=config.get('decoder_backend') or 'opencv',
+            decoder_threads=config.get('decoder_threads') or 0,
+            stage_observer=stage_observer
+        )
+        motion_gate = MotionGate(
+            pixel_delta=config.get('motion_gate_pixel_delta', 25),
+            cell_threshold=config.get('motion_gate_cell_threshold', 0.02),
+            max_skip_s=config.get('motion_gate_max_skip_s', 2.0)
+        ) if motion_gate_enabled else None
+        cameras.append(CameraContext(
+            camera_id,
+            grabber,
+            create_tracker(tracker_config, frame_rate=camera_fps),
+            AlarmedTrackStore(detection_time_window, camera_fps),
+            motion_gate,
+            CameraRoi(camera_rois[camera_id]) if camera_id in camera_rois else None
+        ))
+        if camera_id in camera_rois:
+            detector_logger.info(f'Camera {camera_id}: Inference restricted to {len(camera_rois[camera_id])} ROI polygon(s)')
+        grabber.start()
+
+    alarm_index = AlarmTrackIndex(active_alarms_shared, default_camera_id)
+    detector_logger.info(f'Running batched inference over {len(cameras)} camera(s): {[c.camera_id for c in cameras]}')
+
+    stats_window_started_at = time.time()
+    stats_window_frames = 0
+    stats_window_lag_sum = 0.0
+    stats_window_skipped = 0
+    stats_window_inference_s = 0.0
+    stats_window_cpu_started_at = time.process_time()
+    inference_s_per_frame = 0.0
 
-    detector_logger.info(f'Attempting to connect to RTSP source: {rtsp_source}')
     while running_flag_shared.value:
-        current_frame_for_video_task = None
-
         try:
-            if cap is None or not cap.isOpened():
-                detector_logger.info(f'Opening video capture for {rtsp_source}...')
-                if cap:
-                    cap.release()
-                cap = cv2.VideoCapture(rtsp_source)
-                if not cap.isOpened():
-                    detector_logger.warning('Failed to open video capture. Retrying...')
-                    time.sleep(5)
+            # Проверяем до сбора кадров: последний кадр записи публикуется раньше, чем выставляется finished
+            sources_finished = all(camera.grabber.finished for camera in cameras)
+            wait_started_at = time.perf_counter()
+            new_frame_event.wait(timeout=1.0)
+            new_frame_event.clear()
+            cycle_started_at = time.perf_counter()
+            stage_observer.observe('wait', cycle_started_at - wait_started_at)
+
+            batch_cameras = []
+            batch_frames = []
+            batch_timestamps = []
+            skipped_cameras = []
+            for camera in cameras:
+                latest_frame = camera.grabber.get_latest(camera.last_frame_seq, timeout=0)
+                if latest_frame is None:
                     continue
-                detector_logger.info('Video capture opened successfully')
-                consecutive_read_failures = 0
-
-            ret, frame = cap.read()
-            if ret:
-                consecutive_read_failures = 0
-                current_frame_timestamp = time.time()
-
-                original_height, original_width = frame.shape[:2]
-                if original_width > target_detection_width:
-                    ratio = target_detection_width / original_width
-                    target_detection_height = int(original_height * ratio)
-                    resized_frame = cv2.resize(frame, (target_detection_width, target_detection_height), interpolation=cv2.INTER_AREA)
-                else:
-                    resized_frame = frame
-
-                frame_copy_for_buffer = resized_frame.copy()
-                frame_buffer.append((frame_copy_for_buffer, current_frame_timestamp))
-                current_frame_for_video_task = frame_copy_for_buffer
-
-                results = model.track(
-                    resized_frame,
+                camera.last_frame_seq, camera_frame, camera_frame_timestamp = latest_frame
+                camera.last_capture_lag = time.time() - camera_frame_timestamp
+                if camera.motion_gate is not None:
+                    gate_started_at = time.perf_counter()
+                    should_infer = camera.motion_gate.should_infer(camera_frame, camera_frame_timestamp)
+                    stage_observer.observe('motion_gate', time.perf_counter() - gate_started_at)
+                    if not should_infer:
+                        skipped_cameras.append((camera, camera_frame_timestamp))
+                        continue
+                batch_cameras.append(camera)
+                # Кадр из кольца уже скопирован грабером; в режиме 'jpeg' тот же массив ещё сжимается в буфер
+                batch_frames.append(camera_frame.copy() if draw_frame and camera.grabber.frame_ring is None else camera_frame)
+                batch_timestamps.append(camera_frame_timestamp)
+
+            if not batch_cameras and not skipped_cameras:
+                if sources_finished:
+                    detector_logger.info('All recorded video sources are finished')
+                    break
+                continue
+            stage_observer.observe('grab', time.perf_counter() - cycle_started_at)
+
+            batch_results = []
+            if batch_cameras:
+                inference_started_at = time.perf_counter()
+                batch_results = track_batch(
+                    model,
+                    batch_frames,
+                    [camera.tracker for camera in batch_cameras],
+                    rois=[camera.roi for camera in batch_cameras],
                     imgsz=(img_height, img_width),
                     classes=list(class_map.keys()),
-                    persist=True,
-                    half=True,
+                    **inference_overrides,
                     conf=conf_thresh,
                     iou=iou_thresh,
-                    verbose=verbose,
-                    stream_buffer=True
+                    verbose=verbose
                 )
+                inference_s = time.perf_counter() - inference_started_at
+                stats_window_inference_s += inference_s
+                stage_observer.observe('inference', inference_s)
+
+            refresh_camera_alarms(alarm_index, cameras)
+
+            # Сцена не изменилась: прошлые детекции остаются в силе, охраняемые машины по-прежнему на месте.
+            # Трекер при этом не обновляется, поэтому пропуски не старят его треки
+            for camera, current_frame_timestamp in skipped_cameras:
+                mark_alarmed_tracks_seen(camera, alarm_index.for_camera(camera.camera_id), current_frame_timestamp)
+
+            for camera, resized_frame, current_frame_timestamp, result in zip(batch_cameras, batch_frames, batch_timestamps, batch_results):
+                postprocess_started_at = time.perf_counter()
+                camera_id = camera.camera_id
+                grabber = camera.grabber
+                camera.frame_size = (resized_frame.shape[1], resized_frame.shape[0])
+                camera.note_tracker_update(current_frame_timestamp)
+
+                camera_alarms_by_track_id = alarm_index.for_camera(camera_id)
+
+                box_array = boxes_to_array(result.boxes)
+                detected_track_ids_in_frame = set(box_array[:, BOX_TRACK_ID].astype(int).tolist())
+                camera.last_track_ids = detected_track_ids_in_frame
+
+                for movement_events in detect_movements(camera, camera_alarms_by_track_id, box_array, current_frame_timestamp, detection_time_window, detection_min_distance):
+                    for event_data in movement_events:
+                        put_started_at = time.perf_counter()
+                        event_queue_shared.put(event_data)
+                        stage_observer.observe('event_queue_put', time.perf_counter() - put_started_at)
+
+                    # Одно видео на трек, даже если машину охраняют несколько пользователей
+                    video_filename = f'movement_{camera_id}_{movement_events[0]['alarm_db_id']}_{movement_events[0]['track_id']}_{int(current_frame_timestamp)}.mp4'
+                    full_video_path = os.path.join(video_save_path, video_filename)
+
+                    start_event_video(
+                        camera,
+                        {**movement_events[0], 'alarm_db_ids': [event['alarm_db_id'] for event in movement_events]},
+                        full_video_path,
+                        video_fps,
+                        current_frame_timestamp - seconds_before,
+                        current_frame_timestamp + seconds_after,
+                        video_writer_queue_shared
+                    )
 
-                processed_results_for_api = []
-                detected_track_ids_in_frame = set()
-                current_active_alarms_snapshot = dict(active_alarms_shared)
-
-
-                if results and results[0].boxes.id is not None:
-                    boxes = results[0].boxes
-                    for i in range(len(boxes)):
-                        box = boxes[i]
-                        track_id = int(box.id.item())
-                        detected_track_ids_in_frame.add(track_id)
-                        cls_id = int(box.cls.item())
-                        class_name = class_map.get(cls_id, f'class_{cls_id}')
-                        confidence = float(box.conf.item())
-                        x1, y1, x2, y2 = map(float, box.xyxy[0])
-                        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
-                        current_position = (cx, cy)
-
-                        processed_results_for_api.append({
-                            'name': class_name,
-                            'class_id': cls_id,
-                            'confidence': round(confidence, 3),
-                            'track_id': track_id,
-                            'box': {
-                                'x1': round(x1),
-                                'y1': round(y1),
-                                'x2': round(x2),
-                                'y2': round(y2)
-                            }
-                        })
-
-                        is_on_active_alarm = False
-                        alarm_info_for_this_track_id = None
-
-                        # current_active_alarms_snapshot = dict(active_alarms_shared)
-                        for alarm_db_id, alarm_data in current_active_alarms_snapshot.items():
-                            if alarm_data.get('track_id') == track_id:
-                                is_on_active_alarm = True
-                                alarm_info_for_this_track_id = {**alarm_data, 'alarm_db_id': alarm_db_id}
-                                break
-
-                        if is_on_active_alarm:
-                            alarmed_vehicles_last_seen[track_id] = current_frame_timestamp
-                            if track_id in disappeared_event_sent:
-                                disappeared_event_sent.remove(track_id)
-                                # TODO
-                                detector_logger.info(
-                                    f'Vehicle with Track ID {track_id} (Alarm DB ID: {alarm_info_for_this_track_id['alarm_db_id']} reappeared;\n'
-                                    f'User ID: {alarm_info_for_this_track_id['user_id']}'
-                                )
-                            # TODO
-                            if track_id not in vehicle_position_history:
-                                vehicle_position_history[track_id] = []
-
-                            history = vehicle_position_history[track_id]
-                            history.append((current_frame_timestamp, current_position))
-                            vehicle_position_history[track_id] = [
-                                (ts, pos) for ts, pos in history if current_frame_timestamp - ts <= detection_time_window
-                            ]
-
-                            actual_history = vehicle_position_history[track_id]
-                            if len(actual_history) > 1:
-                                start_ts, start_pos = actual_history[0]
-                                end_ts, end_pos = actual_history[-1]
-                                if end_ts - start_ts >= detection_time_window * 0.8:
-                                    dist = distance_calc(start_pos, end_pos)
-                                    if dist >= detection_min_distance:
-                                        detector_logger.info(f'[EVENT] Vehicle Track ID {track_id} (Alarm DB ID: {alarm_info_for_this_track_id['alarm_db_id']}) MOVED: {dist:.0f}px in {(end_ts - start_ts):.2f}s')
-                                        event_data = {
-                                            'type': 'movement',
-                                            'alarm_db_id': alarm_info_for_this_track_id['alarm_db_id'],
-                                            'user_id': alarm_info_for_this_track_id['user_id'],
-                                            'track_id': track_id,
-                                            'timestamp': current_frame_timestamp,
-                                            'details': {
-                                                'distance_px': round(dist, 2),
-                                                'time_seconds': round(end_ts - start_ts, 2),
-                                                'start_pos': [round(p, 2) for p in start_pos],
-                                                'end_pos': [round(p, 2) for p in end_pos]
-                                            }
-                                        }
-                                        event_queue_shared.put(event_data)
-                                        vehicle_position_history[track_id] = [(end_ts, end_pos)]
-                                        detector_logger.debug(f'Movement event sent to queue. History for track_id {track_id} reset')
-
-                                        temp_event_id_for_video = str(uuid.uuid4())
-                                        video_filename = f'movement_{alarm_info_for_this_track_id['alarm_db_id']}_{track_id}_{int(current_frame_timestamp)}.mp4'
-                                        full_video_path = os.path.join(video_save_path, video_filename)
-
-                                        frames_before_event = list(frame_buffer)
-                                        pending_video_recordings[temp_event_id_for_video] = {
-                                            'frames_to_capture': int(camera_fps * seconds_after),
-                                            'captured_frames': frames_before_event,
-                                            'event_data': event_data,
-                                            'video_filepath': full_video_path,
-                                            'frame_size': (frame_copy_for_buffer.shape[1], frame_copy_for_buffer.shape[0]),
-                                            'fps': video_fps
-                                        }
-                                        detector_logger.info(f'Movement: Queued video recording for {video_filename}. Need {pending_video_recordings[temp_event_id_for_video]['frames_to_capture']} more frames')
-
-                        if draw_frame:
-                            color = (0, 0, 255) if is_on_active_alarm else (0, 255, 0)
-                            cv2.rectangle(resized_frame, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
-                            label_suffix = ' ALARM!' if is_on_active_alarm else ''
-                            label = f"{class_name} #{track_id}{label_suffix} C:{confidence:.2f}"
-                            cv2.putText(resized_frame, label, (int(x1), int(y1) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-
-                last_bboxes_shared[0] = processed_results_for_api
-                last_bboxes_shared[1] = current_frame_timestamp
-
-                for alarm_db_id, alarm_data in current_active_alarms_snapshot.items():
-                    alarmed_track_id = alarm_data['track_id']
-                    if alarmed_track_id not in detected_track_ids_in_frame:
-                        if alarmed_track_id not in alarmed_vehicles_last_seen:
-                            alarmed_vehicles_last_seen[alarmed_track_id] = current_frame_timestamp
-
-                        time_since_last_seen = current_frame_timestamp - alarmed_vehicles_last_seen.get(alarmed_track_id, current_frame_timestamp)
-                        if time_since_last_seen > disappearance_thresh_s:
-                            if alarmed_track_id not in disappeared_event_sent:
-                                detector_logger.info(f'[EVENT] Vehicle Track ID {alarmed_track_id} (Alarm DB ID: {alarm_db_id}) disappeared. Not seen for {time_since_last_seen:.0f}s')
-
-                                event_data = {
-                                    'type': 'disappearance',
-                                    'alarm_db_id': alarm_db_id,
-                                    'user_id': alarm_data['user_id'],
-                                    'track_id': alarmed_track_id,
-                                    'timestamp': current_frame_timestamp,
-                                    'details': {
-                                        'time_seconds': round(time_since_last_seen, 2)
-                                    }
-                                }
-                                event_queue_shared.put(event_data)
-                                disappeared_event_sent.add(alarmed_track_id)
-                                detector_logger.debug(f'Disappearance event sent to queue for track_id {alarmed_track_id}')
-                                if alarmed_track_id in vehicle_position_history:
-                                    del vehicle_position_history[alarmed_track_id]
-
-                                temp_event_id_for_video = str(uuid.uuid4())
-                                video_filename = f'disappearance_{alarm_db_id}_{alarmed_track_id}_{int(current_frame_timestamp)}.mp4'
-                                full_video_path = os.path.join(video_save_path, video_filename)
-
-                                frames_for_disappearance_video = list(frame_buffer)
-
-                                if frames_for_disappearance_video:
-                                    video_task = {
-                                        'video_filepath': full_video_path,
-                                        'frames_data': [(f.copy(), ts) for f, ts in frames_for_disappearance_video],
-                                        'frame_size': (frames_for_disappearance_video[0][0].shape[1], frames_for_disappearance_video[0][0].shape[0]),
-                                        'fps': video_fps,
-                                        'event_data': event_data
-                                    }
-                                    video_writer_queue_shared.put(video_task)
-                                    detector_logger.info(f'Disappearance: Sent video recording task for {video_filename}')
-
-                if current_frame_for_video_task is not None:
-                    for event_placeholder_id in list(pending_video_recordings.keys()):
-                        task = pending_video_recordings[event_placeholder_id]
-                        if task['frames_to_capture'] > 0:
-                            task['captured_frames'].append((current_frame_for_video_task.copy(), current_frame_timestamp))
-                            task['frames_to_capture'] -= 1
-                        if task['frames_to_capture'] <= 0:
-                            detector_logger.info(f'Finished capturing frames for video: {task['video_filepath']}')
-                            video_writer_task = {
-                                'video_filepath': task['video_filepath'],
-                                'frames_data': task['captured_frames'],
-                                'frame_size': task['frame_size'],
-                                'fps': task['fps'],
-                                'event_data': task['event_data']
-                            }
-                            video_writer_queue_shared.put(video_writer_task)
-                            detector_logger.info(f'Sent video task for {task['video_filepath']} to writer queue')
-                            del pending_video_recordings[event_placeholder_id]
+                if draw_frame:
+                    alarmed_row_set = set(match_alarmed_rows(box_array, camera_alarms_by_track_id.keys()).tolist())
+                    for row, detection in enumerate(build_api_detections(box_array, camera_id, class_map)):
+                        is_on_active_alarm = row in alarmed_row_set
+                        box = detection['box']
+                        color = (0, 0, 255) if is_on_active_alarm else (0, 255, 0)
+                        cv2.rectangle(resized_frame, (box['x1'], box['y1']), (box['x2'], box['y2']), color, 2)
+                        label_suffix = ' ALARM!' if is_on_active_alarm else ''
+                        label = f"{detection['name']} #{detection['track_id']}{label_suffix} C:{detection['confidence']:.2f}"
+                        cv2.putText(resized_frame, label, (box['x1'], box['y1'] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+                camera.last_box_array = box_array
+
+                for disappearance_events in detect_disappearances(camera, camera_alarms_by_track_id, detected_track_ids_in_frame, current_frame_timestamp, disappearance_thresh_s):
+                    for event_data in disappearance_events:
+                        put_started_at = time.perf_counter()
+                        event_queue_shared.put(event_data)
+                        stage_observer.observe('event_queue_put', time.perf_counter() - put_started_at)
+
+                    video_filename = f'disappearance_{camera_id}_{disappearance_events[0]['alarm_db_id']}_{disappearance_events[0]['track_id']}_{int(current_frame_timestamp)}.mp4'
+                    full_video_path = os.path.join(video_save_path, video_filename)
+
+                    start_event_video(
+                        camera,
+                        {**disappearance_events[0], 'alarm_db_ids': [event['alarm_db_id'] for event in disappearance_events]},
+                        full_video_path,
+                        video_fps,
+                        current_frame_timestamp - seconds_before - 2,
+                        current_frame_timestamp,
+                        video_writer_queue_shared
+                    )
 
                 if draw_frame:
-                    cv2.imshow('Detection Debug View', resized_frame)
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        detector_logger.info('Quit signal received from debug view')
-                        running_flag_shared.value = False
-                        break
-                else:
-                    pass
-            else:
-                consecutive_read_failures += 1
-                detector_logger.warning(f'Failed to read frame from source. Attempt {consecutive_read_failures}/{max_read_failures}')
-                if cap:
-                    cap.release()
-                cap = None
-                if consecutive_read_failures >= max_read_failures:
-                    detector_logger.error(f'Max read failures reached ({max_read_failures}). Waiting longer before retry')
-                    time.sleep(30)
-                    consecutive_read_failures = 0
-                else:
-                    time.sleep(base_retry_delay * consecutive_read_failures)
-                continue
+                    if camera.roi is not None:
+                        camera.roi.draw(resized_frame)
+                    cv2.imshow(f'Detection Debug View ({camera_id})', resized_frame)
+                stage_observer.observe('postprocess', time.perf_counter() - postprocess_started_at)
+
+            publish_started_at = time.perf_counter()
+            detection_snapshot.publish(
+                {camera.camera_id: camera.last_box_array for camera in cameras},
+                max(batch_timestamps + [timestamp for _, timestamp in skipped_cameras])
+            )
+            stage_observer.observe('publish', time.perf_counter() - publish_started_at)
+
+            recordings_started_at = time.perf_counter()
+            for camera in cameras:
+                if camera.pending_video_recordings:
+                    advance_pending_video_recordings(camera, video_writer_queue_shared)
+            finished_at = time.perf_counter()
+            stage_observer.observe('recordings', finished_at - recordings_started_at)
+            stage_observer.observe('cycle', finished_at - cycle_started_at)
+            stage_observer.count('frames_inferred', len(batch_cameras))
+            stage_observer.count('frames_skipped', len(skipped_cameras))
+
+            stats_window_frames += len(batch_cameras)
+            stats_window_skipped += len(skipped_cameras)
+            stats_window_lag_sum += sum(camera.last_capture_lag for camera in batch_cameras)
+            stats_window_elapsed = time.time() - stats_window_started_at
+            if stats_window_elapsed >= 1.0:
+                if stats_window_frames:
+                    inference_s_per_frame = stats_window_inference_s / stats_window_frames
+                # Оценка: пропущенные кадры стоили бы столько же, сколько в среднем стоит кадр инференса
+                inference_saved_s = stats_window_skipped * inference_s_per_frame
+                process_cpu_s = time.process_time() - stats_window_cpu_started_at
+                tracker_frame_rates = {camera.camera_id: camera.retune_tracker(camera_fps) for camera in cameras}
+                if detector_stats_shared is not None:
+                    detector_stats_shared.update({
+                        'capture_lag_ms': {camera.camera_id: round(camera.last_capture_lag * 1000, 1) for camera in cameras},
+                        'capture_lag_avg_ms': round(stats_window_lag_sum / stats_window_frames * 1000, 1) if stats_window_frames else None,
+                        'inference_fps': round(stats_window_frames / stats_window_elapsed, 2),
+                        'inference_ms_per_frame': round(inference_s_per_frame * 1000, 1),
+                        'motion_gate_enabled': motion_gate_enabled,
+                        'motion_gate_skip_ratio': round(stats_window_skipped / (stats_window_skipped + stats_window_frames), 3) if stats_window_skipped + stats_window_frames else 0.0,
+                        'motion_gate_skip_ratio_total': {camera.camera_id: round(camera.motion_gate.skip_ratio, 3) for camera in cameras if camera.motion_gate is not None},
+                        'inference_cpu_saved_pct': round(inference_saved_s / (inference_saved_s + stats_window_inference_s) * 100, 1) if inference_saved_s + stats_window_inference_s else 0.0,
+                        'process_cpu_pct': round(process_cpu_s / stats_window_elapsed * 100, 1),
+                        'frames_captured': {camera.camera_id: camera.grabber.frames_captured for camera in cameras},
+                        'frames_dropped': {camera.camera_id: camera.grabber.frames_dropped for camera in cameras},
+                        'frame_buffer_bytes': {camera.camera_id: camera.grabber.buffer_size_bytes() for camera in cameras},
+                        'frame_buffer_frames': {camera.camera_id: camera.grabber.buffered_frame_count() for camera in cameras},
+                        'frame_buffer_skipped': {camera.camera_id: camera.grabber.buffer_frames_skipped() for camera in cameras},
+                        'pending_recordings': {camera.camera_id: len(camera.pending_video_recordings) for camera in cameras},
+                        'tracker_fps': {camera_id: round(frame_rate, 2) if frame_rate is not None else None for camera_id, frame_rate in tracker_frame_rates.items()},
+                        'updated_at': time.time()
+                    })
+                detector_logger.debug(f'Capture-to-inference lag: {(stats_window_lag_sum / max(stats_window_frames, 1) * 1000):.0f}ms (avg), {(stats_window_frames / stats_window_elapsed):.1f} frames/s over {len(cameras)} camera(s), {stats_window_skipped} frame(s) skipped by motion gate')
+                stats_window_started_at = time.time()
+                stats_window_frames = 0
+                stats_window_lag_sum = 0.0
+                stats_window_skipped = 0
+                stats_window_inference_s = 0.0
+                stats_window_cpu_started_at = time.process_time()
+
+            if draw_frame:
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    detector_logger.info('Quit signal received from debug view')
+                    running_flag_shared.value = False
+                    break
         except Exception as e:
             detector_logger.error(f'An error occurred in detection loop: {e}', exc_info=True)
             time.sleep(5)
 
-    if cap:
-        cap.release()
+    for camera in cameras:
+        if camera.pending_video_recordings and camera.grabber.finished:
+            # Запись кончилась раньше, чем набрались кадры после события
+            advance_pending_video_recordings(camera, video_writer_queue_shared, flush=True)
+        camera.grabber.stop()
+        camera.grabber.join(timeout=5)
+        camera.grabber.release_frame_ring()
+    if isinstance(stage_observer, MetricsRecorder):
+        stage_observer.flush(force=True)
+    if not detection_snapshot.owner:
+        detection_snapshot.close()
     if draw_frame:
         cv2.destroyAllWindows()
     detector_logger.info('Detection process stopped')
@@ -0,0 +1,130 @@
+import os
+import uuid
+import cv2
+import numpy as np
+from multiprocessing import shared_memory
+
+class SharedFrameRing:
+    """
+    Кольцевой буфер кадров в разделяемой памяти (multiprocessing.shared_memory).
+    Слоты фиксированного размера адресуются порядковым номером кадра (seq);
+    детектор пишет кадры, видеописатель читает их по seq без копирования через очередь.
+
+    Раскладка сегмента: [head seq: int64][seq слотов: int64 * slots][timestamp слотов: float64 * slots][кадры].
+    Во время записи seq слота равен -1, поэтому читатель может проверить, что кадр не перезаписан.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, slots: int, frame_shape: tuple, owner: bool):
+        self._shm = shm
+        self.slots = slots
+        self.frame_shape = tuple(frame_shape)
+        self.owner = owner
+
+        header_bytes = 8 + slots * 16
+        buf = shm.buf
+        self._head = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=0)
+        self._seqs = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=8)
+        self._timestamps = np.ndarray((slots,), dtype=np.float64, buffer=buf, offset=8 + slots * 8)
+        self._frames = np.ndarray((slots, *self.frame_shape), dtype=np.uint8, buffer=buf, offset=header_bytes)
+
+    @staticmethod
+    def required_bytes(slots: int, frame_shape: tuple) -> int:
+        return 8 + slots * 16 + slots * int(np.prod(frame_shape))
+
+    @classmethod
+    def create(cls, slots: int, frame_shape: tuple, name: str | None = None) -> 'SharedFrameRing':
+        """Создаёт новый сегмент разделяемой памяти; создатель отвечает за unlink()."""
+
+        name = name or f'alertcam_frames_{uuid.uuid4().hex[:12]}'
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.required_bytes(slots, frame_shape))
+        ring = cls(shm, slots, frame_shape, owner=True)
+        ring._head[0] = 0
+        ring._seqs[:] = -1
+        ring._timestamps[:] = 0.0
+        return ring
+
+    @classmethod
+    def attach(cls, descriptor: dict) -> 'SharedFrameRing':
+        """Подключается к существующему буферу по его дескриптору (см. descriptor())."""
+
+        shm = shared_memory.SharedMemory(name=descriptor['name'])
+        if os.name == 'posix':
+            # Подключившийся процесс не владеет сегментом: иначе resource_tracker удалит его при выходе процесса
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, descriptor['slots'], descriptor['frame_shape'], owner=False)
+
+    def descriptor(self) -> dict:
+        """Небольшой picklable-дескриптор для передачи в другие процессы."""
+
+        return {'name': self._shm.name, 'slots': self.slots, 'frame_shape': self.frame_shape}
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def frame_size(self) -> tuple:
+        return (self.frame_shape[1], self.frame_shape[0])
+
+    @property
+    def latest_seq(self) -> int:
+        return int(self._head[0])
+
+    @property
+    def oldest_seq(self) -> int:
+        # Самый старый слот может уже переписываться, поэтому он не считается доступным
+        return max(1, self.latest_seq - self.slots + 2)
+
+    def write(self, frame, timestamp: float) -> int:
+        """
+        Записывает кадр в следующий слот. Кадр другого размера масштабируется прямо в слот.
+        :return: Порядковый номер записанного кадра.
+        """
+
+        seq = self.latest_seq + 1
+        slot = seq % self.slots
+        self._seqs[slot] = -1
+        if frame.shape == self.frame_shape:
+            np.copyto(self._frames[slot], frame)
+        else:
+            cv2.resize(frame, self.frame_size, dst=self._frames[slot], interpolation=cv2.INTER_AREA)
+        self._timestamps[slot] = timestamp
+        self._seqs[slot] = seq
+        self._head[0] = seq
+        return seq
+
+    def slot_view(self, seq: int):
+        """Возвращает кадр seq без копирования или None, если слот уже перезаписан."""
+
+        slot = seq % self.slots
+        if self._seqs[slot] != seq:
+            return None
+        return self._frames[slot]
+
+    def timestamp(self, seq: int) -> float | None:
+        slot = seq % self.slots
+        if self._seqs[slot] != seq:
+            return None
+        return float(self._timestamps[slot])
+
+    def is_valid(self, seq: int) -> bool:
+        return self._seqs[seq % self.slots] == seq
+
+    def seq_at_or_after(self, timestamp: float) -> int:
+        """Возвращает номер самого старого доступного кадра, снятого не раньше timestamp."""
+
+        latest_seq = self.latest_seq
+        for seq in range(self.oldest_seq, latest_seq + 1):
+            frame_timestamp = self.timestamp(seq)
+            if frame_timestamp is not None and frame_timestamp >= timestamp:
+                return seq
+        return latest_seq
+
+    def close(self):
+        self._head = self._seqs = self._timestamps = self._frames = None
+        self._shm.close()
+
+    def unlink(self):
+        if self.owner:
+            self._shm.unlink()
@@ -0,0 +1,127 @@
+import cv2
+import queue
+import logging
+import threading
+from collections import deque
+
+jpeg_buffer_logger = logging.getLogger('VehicleDetectorProcess.jpeg_buffer')
+
+class JpegFrameBuffer:
+    """
+    Буфер кадров до события в сжатом виде.
+    Кадры кодируются в JPEG в отдельном потоке; буфер ограничен по возрасту кадров и по объёму памяти.
+
+    Каждый кадр хранится в одном экземпляре. Ожидающие записи закрепляют (pin) диапазон кадров
+    начиная с нужного seq, и такие кадры не вытесняются, пока их не освободят (release).
+    """
+
+    def __init__(self, camera_id: str, max_age_s: float, max_bytes: int, quality: int = 80, encode_queue_size: int = 50):
+        self.camera_id = camera_id
+        self.max_age_s = max_age_s
+        self.max_bytes = max_bytes
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+
+        self._lock = threading.Lock()
+        self._frames = deque()
+        self._size_bytes = 0
+        self._encode_queue = queue.Queue(maxsize=encode_queue_size)
+        self._stopped = False
+        self._pins = {}
+        self._next_pin_id = 1
+
+        self.frames_encoded = 0
+        self.frames_skipped = 0
+
+        self._thread = threading.Thread(target=self._encode_loop, name=f'JpegEncoderThread-{camera_id}', daemon=True)
+        self._thread.start()
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    @property
+    def pinned_count(self) -> int:
+        return len(self._pins)
+
+    @property
+    def latest_timestamp(self) -> float | None:
+        with self._lock:
+            return self._frames[-1][2] if self._frames else None
+
+    def submit(self, seq: int, frame, timestamp: float):
+        """Ставит кадр в очередь на кодирование. Кадр не должен изменяться после передачи."""
+
+        try:
+            self._encode_queue.put_nowait((seq, frame, timestamp))
+        except queue.Full:
+            self.frames_skipped += 1
+
+    def stop(self):
+        self._stopped = True
+        self._thread.join(timeout=5)
+
+    def _encode_loop(self):
+        while not self._stopped:
+            try:
+                seq, frame, timestamp = self._encode_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            try:
+                ok, encoded = cv2.imencode('.jpg', frame, self.encode_params)
+                if not ok:
+                    jpeg_buffer_logger.warning(f'Camera {self.camera_id}: Failed to encode frame {seq} to JPEG')
+                    continue
+                jpeg_bytes = encoded.tobytes()
+            except Exception as e:
+                jpeg_buffer_logger.error(f'Camera {self.camera_id}: Error encoding frame {seq}: {e}', exc_info=True)
+                continue
+
+            with self._lock:
+                self._frames.append((seq, jpeg_bytes, timestamp))
+                self._size_bytes += len(jpeg_bytes)
+                self.frames_encoded += 1
+                self._evict(timestamp)
+
+    def _evict(self, newest_timestamp: float):
+        min_pinned_seq = min(self._pins.values()) if self._pins else None
+        while self._frames and (
+                self._size_bytes > self.max_bytes or
+                newest_timestamp - self._frames[0][2] > self.max_age_s
+        ):
+            if min_pinned_seq is not None and self._frames[0][0] >= min_pinned_seq:
+                # Кадр ещё нужен ожидающей записи; бюджет может быть временно превышен
+                break
+            _, jpeg_bytes, _ = self._frames.popleft()
+            self._size_bytes -= len(jpeg_bytes)
+
+    def pin(self, from_timestamp: float) -> int:
+        """
+        Закрепляет кадры, снятые не раньше from_timestamp, и все последующие.
+        :return: Идентификатор закрепления для collect()/release().
+        """
+
+        with self._lock:
+            start_seq = next((seq for seq, _, ts in self._frames if ts >= from_timestamp), None)
+            if start_seq is None:
+                start_seq = self._frames[-1][0] + 1 if self._frames else 0
+            pin_id = self._next_pin_id
+            self._next_pin_id += 1
+            self._pins[pin_id] = start_seq
+            return pin_id
+
+    def collect(self, pin_id: int, end_timestamp: float) -> list:
+        """Возвращает закреплённые кадры не позже end_timestamp в виде списка (jpeg_bytes, timestamp), без копирования."""
+
+        with self._lock:
+            start_seq = self._pins[pin_id]
+            return [(jpeg_bytes, ts) for seq, jpeg_bytes, ts in self._frames if seq >= start_seq and ts <= end_timestamp]
+
+    def release(self, pin_id: int):
+        with self._lock:
+            self._pins.pop(pin_id, None)
+            if self._frames:
+                self._evict(self._frames[-1][2])
@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+class MotionGate:
+    """
+    Дешёвый фильтр перед инференсом: сравнивает уменьшенный серый кадр с кадром,
+    на котором последний раз запускалась модель, и пропускает инференс, если сцена не изменилась.
+
+    Кадр делится на сетку ячеек; изменение хотя бы в одной ячейке (а не в среднем по кадру)
+    сразу включает полный инференс. Не реже чем раз в max_skip_s инференс выполняется принудительно,
+    чтобы трекер и таймеры исчезновения не расходились с реальностью.
+    """
+
+    def __init__(
+            self,
+            width: int = 160,
+            grid: tuple = (8, 6),
+            pixel_delta: int = 25,
+            cell_threshold: float = 0.02,
+            max_skip_s: float = 2.0
+    ):
+        self.width = width
+        self.grid = grid
+        self.pixel_delta = pixel_delta
+        self.cell_threshold = cell_threshold
+        self.max_skip_s = max_skip_s
+
+        self._reference = None
+        self._reference_timestamp = 0.0
+
+        self.frames_inferred = 0
+        self.frames_skipped = 0
+
+    def _prepare(self, frame) -> np.ndarray:
+        height = max(self.grid[1], round(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def _changed(self, prepared: np.ndarray) -> bool:
+        if self._reference is None or self._reference.shape != prepared.shape:
+            return True
+        changed_mask = (cv2.absdiff(prepared, self._reference) > self.pixel_delta).astype(np.float32)
+        # INTER_AREA усредняет маску по ячейкам сетки: получаем долю изменившихся пикселей в каждой
+        changed_per_cell = cv2.resize(changed_mask, self.grid, interpolation=cv2.INTER_AREA)
+        return float(changed_per_cell.max()) >= self.cell_threshold
+
+    def should_infer(self, frame, timestamp: float) -> bool:
+        """:return: True, если по кадру нужно запустить модель; тогда он становится новым опорным."""
+
+        prepared = self._prepare(frame)
+        if timestamp - self._reference_timestamp >= self.max_skip_s or self._changed(prepared):
+            self._reference = prepared
+            self._reference_timestamp = timestamp
+            self.frames_inferred += 1
+            return True
+        self.frames_skipped += 1
+        return False
+
+    def force(self):
+        """Гарантирует инференс на следующем кадре."""
+
+        self._reference = None
+
+    @property
+    def skip_ratio(self) -> float:
+        total = self.frames_inferred + self.frames_skipped
+        return self.frames_skipped / total if total else 0.0
@@ -0,0 +1,59 @@
+import numpy as np
+
+# Столбцы массива боксов с трекингом (Boxes.data после трекера)
+BOX_X1, BOX_Y1, BOX_X2, BOX_Y2, BOX_TRACK_ID, BOX_CONF, BOX_CLS = range(7)
+
+# Классы COCO, которые детектор отслеживает, и их имена в API
+VEHICLE_CLASS_MAP = {2: 'car', 3: 'motorcycle', 7: 'truck'}
+
+def boxes_to_array(boxes) -> np.ndarray:
+    """
+    Переносит боксы кадра на хост одним вызовом.
+    :return: Массив (N, 7): x1, y1, x2, y2, track_id, conf, cls; пустой, если у боксов нет track id.
+    """
+
+    if boxes is None or boxes.id is None or len(boxes) == 0:
+        return np.empty((0, 7), dtype=np.float64)
+    data = boxes.data
+    if hasattr(data, 'cpu'):
+        data = data.cpu().numpy()
+    return np.asarray(data, dtype=np.float64)
+
+def box_centroids(box_array: np.ndarray) -> np.ndarray:
+    """Центры боксов, массив (N, 2)."""
+
+    return (box_array[:, [BOX_X1, BOX_Y1]] + box_array[:, [BOX_X2, BOX_Y2]]) / 2
+
+def build_api_detections(box_array: np.ndarray, camera_id: str, class_map: dict) -> list:
+    """Формирует список словарей детекций для API по всему кадру сразу (округление и имена классов векторно)."""
+
+    if len(box_array) == 0:
+        return []
+
+    class_ids = box_array[:, BOX_CLS].astype(np.int64)
+    unique_class_ids, class_index = np.unique(class_ids, return_inverse=True)
+    class_names = np.array([class_map.get(int(cls_id), f'class_{cls_id}') for cls_id in unique_class_ids], dtype=object)[class_index]
+    coords = np.rint(box_array[:, BOX_X1:BOX_Y2 + 1]).astype(np.int64).tolist()
+    confidences = np.round(box_array[:, BOX_CONF], 3).tolist()
+    track_ids = box_array[:, BOX_TRACK_ID].astype(np.int64).tolist()
+
+    return [
+        {
+            'camera_id': camera_id,
+            'name': name,
+            'class_id': cls_id,
+            'confidence': confidence,
+            'track_id': track_id,
+            'box': {'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2}
+        }
+        for name, cls_id, confidence, track_id, (x1, y1, x2, y2)
+        in zip(class_names.tolist(), class_ids.tolist(), confidences, track_ids, coords)
+    ]
+
+def match_alarmed_rows(box_array: np.ndarray, alarmed_track_ids) -> np.ndarray:
+    """Индексы строк box_array, чьи track id стоят на охране."""
+
+    if len(box_array) == 0 or not alarmed_track_ids:
+        return np.empty(0, dtype=np.int64)
+    track_ids = box_array[:, BOX_TRACK_ID].astype(np.int64)
+    return np.flatnonzero(np.isin(track_ids, np.fromiter((track_id for track_id in alarmed_track_ids if track_id is not None), dtype=np.int64)))
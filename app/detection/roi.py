@@ -0,0 +1,114 @@
+import math
+import cv2
+import numpy as np
+
+class CameraRoi:
+    """
+    Области интереса камеры: полигоны в нормированных координатах (0..1).
+    Для инференса кадр обрезается до ограничивающих прямоугольников полигонов,
+    а детекции с центром вне полигонов отбрасываются.
+    """
+
+    def __init__(self, polygons: list, padding_px: int = 16):
+        self.polygons = [np.asarray(polygon, dtype=np.float64) for polygon in polygons]
+        self.padding_px = padding_px
+        self._frame_shape = None
+        self._mask = None
+        self._rects = []
+
+    def _prepare(self, frame_shape: tuple):
+        if self._frame_shape == frame_shape[:2]:
+            return
+        height, width = frame_shape[:2]
+        pixel_polygons = [np.round(polygon * (width, height)).astype(np.int32) for polygon in self.polygons]
+
+        self._mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.fillPoly(self._mask, pixel_polygons, 1)
+
+        rects = []
+        for polygon in pixel_polygons:
+            x, y, w, h = cv2.boundingRect(polygon)
+            rects.append([
+                max(0, x - self.padding_px),
+                max(0, y - self.padding_px),
+                min(width, x + w + self.padding_px),
+                min(height, y + h + self.padding_px)
+            ])
+        self._rects = merge_overlapping_rects(rects)
+        self._frame_shape = frame_shape[:2]
+
+    def crop_rects(self, frame_shape: tuple) -> list:
+        """:return: Список прямоугольников (x1, y1, x2, y2) для инференса в координатах кадра."""
+
+        self._prepare(frame_shape)
+        return self._rects
+
+    def contains_centers(self, xyxy: np.ndarray) -> np.ndarray:
+        """:return: Булев массив: лежит ли центр каждого бокса внутри полигонов."""
+
+        height, width = self._mask.shape
+        cx = np.clip(((xyxy[:, 0] + xyxy[:, 2]) / 2).astype(np.int64), 0, width - 1)
+        cy = np.clip(((xyxy[:, 1] + xyxy[:, 3]) / 2).astype(np.int64), 0, height - 1)
+        return self._mask[cy, cx].astype(bool)
+
+    def merge_crop_detections(self, crop_detections: list, iou_thresh: float) -> np.ndarray:
+        """
+        Переводит детекции из координат кропов в координаты кадра, отбрасывает детекции вне ROI
+        и убирает дубли на стыках пересекающихся кропов.
+        :param crop_detections: Список пар (rect, массив (N, 6): x1, y1, x2, y2, conf, cls).
+        :return: Массив (M, 6) в координатах кадра.
+        """
+
+        shifted = []
+        for (x1, y1, _, _), detections in crop_detections:
+            if len(detections):
+                detections = detections.copy()
+                detections[:, [0, 2]] += x1
+                detections[:, [1, 3]] += y1
+                shifted.append(detections)
+        if not shifted:
+            return np.empty((0, 6), dtype=np.float32)
+
+        detections = np.concatenate(shifted)
+        detections = detections[self.contains_centers(detections[:, :4])]
+        if len(crop_detections) > 1 and len(detections) > 1:
+            xywh = np.column_stack([detections[:, :2], detections[:, 2:4] - detections[:, :2]])
+            keep = cv2.dnn.NMSBoxes(xywh.tolist(), detections[:, 4].tolist(), 0.0, iou_thresh)
+            detections = detections[np.asarray(keep, dtype=np.int64).reshape(-1)]
+        return detections
+
+    def draw(self, frame, color=(255, 200, 0)):
+        height, width = frame.shape[:2]
+        for polygon in self.polygons:
+            cv2.polylines(frame, [np.round(polygon * (width, height)).astype(np.int32)], True, color, 2)
+
+def merge_overlapping_rects(rects: list) -> list:
+    """Объединяет пересекающиеся прямоугольники, чтобы один и тот же участок кадра не обрабатывался дважды."""
+
+    rects = [list(rect) for rect in rects]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(rect) for rect in rects]
+
+def scaled_imgsz(crop_shape: tuple, frame_shape: tuple, imgsz: tuple, stride: int = 32) -> tuple:
+    """
+    Размер входа модели для кропа с тем же масштабом, с каким в imgsz попал бы весь кадр.
+    :return: (height, width), кратные stride.
+    """
+
+    scale = min(imgsz[0] / frame_shape[0], imgsz[1] / frame_shape[1])
+    return (
+        max(stride, math.ceil(crop_shape[0] * scale / stride) * stride),
+        max(stride, math.ceil(crop_shape[1] * scale / stride) * stride)
+    )
@@ -0,0 +1,104 @@
+import math
+import numpy as np
+
+class TrackHistory:
+    """
+    История позиций трека фиксированной ёмкости: кольцо (ts, x, y) в массиве numpy.
+    Устаревшие точки отбрасываются сдвигом начала кольца, без пересоздания списка.
+    """
+
+    __slots__ = ('_data', '_start', '_count')
+
+    def __init__(self, capacity: int):
+        self._data = np.zeros((capacity, 3), dtype=np.float64)
+        self._start = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, x: float, y: float):
+        capacity = len(self._data)
+        if self._count == capacity:
+            # Кольцо заполнено: перезаписываем самую старую точку
+            self._start = (self._start + 1) % capacity
+            self._count -= 1
+        self._data[(self._start + self._count) % capacity] = (timestamp, x, y)
+        self._count += 1
+
+    def prune(self, min_timestamp: float):
+        """Отбрасывает точки старше min_timestamp."""
+
+        capacity = len(self._data)
+        while self._count and self._data[self._start, 0] < min_timestamp:
+            self._start = (self._start + 1) % capacity
+            self._count -= 1
+
+    def first(self) -> tuple:
+        """:return: (timestamp, (x, y)) самой старой точки."""
+
+        timestamp, x, y = self._data[self._start].tolist()
+        return timestamp, (x, y)
+
+    def last(self) -> tuple:
+        """:return: (timestamp, (x, y)) самой новой точки."""
+
+        timestamp, x, y = self._data[(self._start + self._count - 1) % len(self._data)].tolist()
+        return timestamp, (x, y)
+
+    def clear(self):
+        self._start = 0
+        self._count = 0
+
+    def reset_to_last(self):
+        """Оставляет в истории только последнюю точку."""
+
+        if self._count:
+            self._start = (self._start + self._count - 1) % len(self._data)
+            self._count = 1
+
+class AlarmedTrack:
+    """Состояние одного трека под охраной: история позиций, время последнего появления и флаг исчезновения."""
+
+    __slots__ = ('history', 'last_seen', 'disappeared_event_sent')
+
+    def __init__(self, capacity: int, last_seen: float):
+        self.history = TrackHistory(capacity)
+        self.last_seen = last_seen
+        self.disappeared_event_sent = False
+
+class AlarmedTrackStore:
+    """
+    Состояния треков под охраной одной камеры.
+    Записи живут, пока трек есть в реестре сигнализаций (см. evict_missing).
+    """
+
+    def __init__(self, time_window_s: float, max_fps: float):
+        # Запас в пару точек на неравномерный шаг кадров
+        self.capacity = max(2, math.ceil(time_window_s * max_fps) + 2)
+        self._tracks = {}
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def __contains__(self, track_id: int) -> bool:
+        return track_id in self._tracks
+
+    def get(self, track_id: int, timestamp: float) -> AlarmedTrack:
+        """Возвращает состояние трека, создавая его с last_seen=timestamp при первом обращении."""
+
+        track = self._tracks.get(track_id)
+        if track is None:
+            track = self._tracks[track_id] = AlarmedTrack(self.capacity, timestamp)
+        return track
+
+    def evict_missing(self, alarmed_track_ids) -> int:
+        """
+        Удаляет состояния треков, которых больше нет среди alarmed_track_ids.
+        :return: Количество удалённых записей.
+        """
+
+        stale_track_ids = [track_id for track_id in self._tracks if track_id not in alarmed_track_ids]
+        for track_id in stale_track_ids:
+            del self._tracks[track_id]
+        return len(stale_track_ids)
@@ -0,0 +1,86 @@
+import torch
+from ultralytics.engine.results import Results
+from ultralytics.trackers.track import TRACKER_MAP
+from ultralytics.utils import IterableSimpleNamespace, yaml_load
+from ultralytics.utils.checks import check_yaml
+from .roi import scaled_imgsz
+
+def create_tracker(tracker_config_path: str, frame_rate: int = 30):
+    """
+    Создаёт отдельный экземпляр трекера (BoT-SORT/ByteTrack) для одной камеры.
+    :param tracker_config_path: Путь к YAML-конфигурации трекера.
+    :param frame_rate: Частота кадров, на которую рассчитан буфер потерянных треков.
+    """
+
+    tracker_cfg = IterableSimpleNamespace(**yaml_load(check_yaml(tracker_config_path)))
+    if tracker_cfg.tracker_type not in TRACKER_MAP:
+        raise ValueError(f'Unsupported tracker type: {tracker_cfg.tracker_type}')
+    return TRACKER_MAP[tracker_cfg.tracker_type](args=tracker_cfg, frame_rate=frame_rate)
+
+def set_tracker_frame_rate(tracker, frame_rate: float):
+    """
+    Пересчитывает буфер потерянных треков под частоту, с которой трекер на самом деле обновляется.
+    track_buffer в конфигурации задан в кадрах при 30 к/с, так что трек теряется через одно и то же время.
+    """
+
+    tracker.max_time_lost = max(1, int(frame_rate / 30.0 * tracker.args.track_buffer))
+
+def predict_with_rois(model, frames: list, rois: list, **predict_kwargs) -> list:
+    """
+    Инференс по кадрам нескольких камер; для камер с ROI модель видит только кропы областей интереса.
+    Входы с одинаковым размером собираются в один батч; кропы получают imgsz пропорционально своему размеру.
+    :return: Список Results в координатах полных кадров, в порядке frames.
+    """
+
+    imgsz = predict_kwargs.pop('imgsz')
+    groups = {}
+    for i, (frame, roi) in enumerate(zip(frames, rois)):
+        if roi is None:
+            groups.setdefault(tuple(imgsz), []).append((i, None, frame))
+            continue
+        for rect in roi.crop_rects(frame.shape):
+            x1, y1, x2, y2 = rect
+            crop = frame[y1:y2, x1:x2]
+            groups.setdefault(scaled_imgsz(crop.shape, frame.shape, imgsz), []).append((i, rect, crop))
+
+    results = [None] * len(frames)
+    crop_detections = [[] for _ in frames]
+    for group_imgsz, inputs in groups.items():
+        predictions = model.predict([image for _, _, image in inputs], imgsz=group_imgsz, **predict_kwargs)
+        for (i, rect, _), prediction in zip(inputs, predictions):
+            if rect is None:
+                results[i] = prediction
+            else:
+                crop_detections[i].append((rect, prediction.boxes.data.cpu().numpy()))
+
+    for i, roi in enumerate(rois):
+        if roi is not None:
+            detections = roi.merge_crop_detections(crop_detections[i], predict_kwargs.get('iou', 0.7))
+            results[i] = Results(frames[i], path='', names=model.names, boxes=torch.as_tensor(detections))
+    return results
+
+def track_batch(model, frames: list, trackers: list, rois: list | None = None, **predict_kwargs) -> list:
+    """
+    Выполняет один батчевый инференс по кадрам нескольких камер и обновляет
+    трекер каждой камеры отдельно (как model.track(persist=True), но без общего трекера).
+    :param rois: CameraRoi (или None) для каждого кадра; детекции вне ROI до трекера не доходят.
+    :return: Список Results в порядке frames; у отслеживаемых боксов заполнен id.
+    """
+
+    if rois and any(roi is not None for roi in rois):
+        results = predict_with_rois(model, frames, rois, **predict_kwargs)
+    else:
+        results = model.predict(frames, **predict_kwargs)
+    for i, result in enumerate(results):
+        detections = result.boxes.cpu().numpy()
+        if len(detections) == 0:
+            continue
+
+        tracks = trackers[i].update(detections, frames[i])
+        if len(tracks) == 0:
+            continue
+
+        idx = tracks[:, -1].astype(int)
+        results[i] = result[idx]
+        results[i].update(boxes=torch.as_tensor(tracks[:, :-1]))
+    return results
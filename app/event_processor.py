@@ -2,148 +2,322 @@ import time
 import queue
 import json
 from datetime import datetime, timezone
+from sqlalchemy import insert, update
 from . import db
 from .models import Alarm, AlarmEvent, User
 from .notifications import send_telegram_message
+from .metrics import MetricsRecorder
 
-def event_processor_worker(
-        flask_app,
-        event_queue_shared,
-        active_alarms_shared,
-        running_flag_shared
-):
-    worker_logger = flask_app.logger
-    worker_logger.info('Event Processor Worker started')
+def drain_event_batch(event_queue_shared, max_size: int, max_wait_s: float) -> list:
+    """
+    Ждёт первое событие до секунды, затем добирает очередь, пока не наберётся max_size событий
+    или не пройдёт max_wait_s с первого.
+    :return: Список событий; пустой, если за секунду ничего не пришло.
+    """
 
-    while running_flag_shared.value:
+    try:
+        batch = [event_queue_shared.get(timeout=1)]
+    except queue.Empty:
+        return []
+
+    deadline = time.monotonic() + max_wait_s
+    while len(batch) < max_size:
+        try:
+            batch.append(event_queue_shared.get_nowait())
+            continue
+        except queue.Empty:
+            pass
+        remaining_s = deadline - time.monotonic()
+        if remaining_s <= 0:
+            break
         try:
-            event_data = event_queue_shared.get(timeout=1)
-            worker_logger.info(f'Event Processor received event: {event_data}')
+            batch.append(event_queue_shared.get(timeout=remaining_s))
+        except queue.Empty:
+            break
+    return batch
 
-            with flask_app.app_context():
-                alarm_db_id = event_data.get('alarm_db_id')
-                event_type = event_data.get('type')
-                user_id = event_data.get('user_id')
-                track_id = event_data.get('track_id', 'N/A')
-                timestamp_from_event = event_data.get('timestamp')
-                details = event_data.get('details', {})
-
-                if not all([alarm_db_id, event_type, user_id, track_id]):
-                    worker_logger.error(f'Received incomplete event data: {event_data}')
-                    continue
+def _as_aware(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is None or timestamp.tzinfo.utcoffset(timestamp) is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
 
-                alarm_instance = db.session.get(Alarm, alarm_db_id)
+def _build_notification(flask_app, event_data: dict, alarm_instance: Alarm, user_to_notify: User | None) -> dict | None:
+    """:return: Аргументы TelegramNotificationDispatcher.enqueue или None, если уведомлять не нужно."""
 
-                if not alarm_instance:
-                    worker_logger.warning(f'Alarm ID {alarm_db_id} not found in DB for event: {event_type}. Skipping')
-                    continue
+    worker_logger = flask_app.logger
+    NOTIFICATION_COOLDOWN_SECONDS = flask_app.config.get('NOTIFICATION_COOLDOWN_SECONDS')
+    alarm_db_id = alarm_instance.id
+    event_type = event_data['type']
+    track_id = event_data.get('track_id', 'N/A')
+    camera_id = event_data.get('camera_id', flask_app.config.get('DEFAULT_CAMERA_ID'))
+    details = event_data.get('details') or {}
 
-                if alarm_instance.user_id != user_id:
-                    worker_logger.error(f'User ID mismatch for event! Event UserID: {user_id}. Alarm Owner UserID: {alarm_instance.user_id}. Alarm ID: {alarm_db_id}. Skipping')
-                    continue
+    if not user_to_notify:
+        worker_logger.warning(f'User for Alarm ID {alarm_db_id} was not found in DB (User ID: {alarm_instance.user_id})')
+        return None
+    elif not user_to_notify.telegram_chat_id:
+        worker_logger.info(f'User ID {user_to_notify.id} does not have linked telegram_chat_id for Alarm ID {alarm_db_id}')
+        return None
 
-                if not alarm_instance.is_active and event_type != 'disappearance':
-                    worker_logger.info(f'Alarm ID {alarm_db_id} is already inactive in DB. Skipping event: {event_type} (unless it\'s disappearance)')
-                    continue
+    message = ''
+    summary = ''
+    vehicle_identifier = f'Машина (камера: {camera_id}, трек ID: {track_id}, ID сигнализации: {alarm_db_id})'
 
-                new_alarm_event = AlarmEvent(
-                    alarm_id=alarm_db_id,
-                    event_type=event_type,
-                    timestamp=datetime.fromtimestamp(timestamp_from_event, tz=timezone.utc) if timestamp_from_event else datetime.now(timezone.utc),
-                    details_json=json.dumps(details) if details else None
-                )
-                db.session.add(new_alarm_event)
-                worker_logger.info(f'Created AlarmEvent for Alarm ID {alarm_db_id}, Type: {event_type}')
+    if event_type == 'movement':
+        if user_to_notify.notify_telegram_movement:
+            last_notification_at = _as_aware(alarm_instance.last_notification_at) if alarm_instance.last_notification_at else None
+            if last_notification_at and (datetime.now(timezone.utc) - last_notification_at).total_seconds() < NOTIFICATION_COOLDOWN_SECONDS:
+                worker_logger.info(f'Movement notification for Alarm ID {alarm_db_id} (type: {event_type}) throttled due to cooldown')
+            else:
+                dist = details.get('distance_px', 'N/A')
+                time_s = details.get('time_seconds', 'N/A')
+                message = f'↔️ ОБНАРУЖЕНО ДВИЖЕНИЕ ↔️\n{vehicle_identifier} начала движение.\nСмещение: {dist}px за {time_s}с.'
+                summary = f'{vehicle_identifier} начала движение ({dist}px за {time_s}с)'
+        else:
+            worker_logger.info(f'User ID {user_to_notify.id} disabled Telegram movement notifications')
+    elif event_type == 'disappearance':
+        if user_to_notify.notify_telegram_disappearance:
+            time_not_seen = details.get('time_seconds', 'N/A')
+            message = f'⚠️ МАШИНА ПРОПАЛА ⚠️\n{vehicle_identifier} пропала из виду.\nНе видна в течение: {time_not_seen}с.'
+            summary = f'{vehicle_identifier} пропала из виду (не видна {time_not_seen}с)'
+        else:
+            worker_logger.info(f'User ID {user_to_notify.id} disabled Telegram disappearance notifications')
 
-                NOTIFICATION_COOLDOWN_SECONDS = flask_app.config.get('NOTIFICATION_COOLDOWN_SECONDS')
-                notification_sent_this_cycle = False
-                user_to_notify = db.session.get(User, alarm_instance.user_id)
+    if not message:
+        return None
+    return {
+        'chat_id': user_to_notify.telegram_chat_id,
+        'text': message,
+        'alarm_id': alarm_db_id,
+        'event_timestamp': event_data.get('timestamp'),
+        'event_type': event_type,
+        'summary': summary
+    }
 
-                if event_type == 'disappearance':
-                    if alarm_instance.is_active:
-                        alarm_instance.is_active = False
-                        alarm_instance.unset_at = datetime.now(timezone.utc)
-                        worker_logger.info(f'Deactivating Alarm ID {alarm_db_id} in DB due to disappearance')
+def _apply_event(flask_app, event_data: dict, alarms: dict, users: dict) -> tuple | None:
+    """
+    Применяет одно событие пачки к загруженной тревоге. Всё, что может упасть на плохих данных события,
+    выполняется до изменения тревоги, поэтому упавшее событие не оставляет следов в сессии.
+    :return: (строка AlarmEvent, уведомление или None, снята ли тревога) или None, если событие пропущено.
+    """
 
-                        if active_alarms_shared is not None:
-                            if alarm_db_id in active_alarms_shared:
-                                try:
-                                    del active_alarms_shared[alarm_db_id]
-                                    worker_logger.info(f'Removed Alarm ID {alarm_db_id} from shared active_alarms dict.')
-                                except KeyError:
-                                    worker_logger.warning(f'KeyError when trying to remove Alarm ID {alarm_db_id} from shared dict (already removed?)')
-                            else:
-                                worker_logger.warning(f'Alarm ID {alarm_db_id} (disappeared) not found in shared active_alarms dict to remove')
-                    else:
-                        worker_logger.info(f'Received disappearance for already inactive Alarm ID {alarm_db_id}. Event logged')
+    worker_logger = flask_app.logger
+    alarm_db_id = event_data['alarm_db_id']
+    event_type = event_data['type']
+    user_id = event_data['user_id']
+    timestamp_from_event = event_data.get('timestamp')
+    details = event_data.get('details', {})
 
-                if not user_to_notify:
-                    worker_logger.warning(f'User for Alarm ID {alarm_db_id} was not found in DB (User ID: {alarm_instance.user_id})')
-                    db.session.commit()
-                    continue
-                elif not user_to_notify.telegram_chat_id:
-                    worker_logger.info(f'User ID {user_to_notify.id} does not have linked telegram_chat_id for Alarm ID {alarm_db_id}')
-                    db.session.commit()
+    alarm_instance = alarms.get(alarm_db_id)
+
+    if not alarm_instance:
+        worker_logger.warning(f'Alarm ID {alarm_db_id} not found in DB for event: {event_type}. Skipping')
+        return None
+
+    if alarm_instance.user_id != user_id:
+        worker_logger.error(f'User ID mismatch for event! Event UserID: {user_id}. Alarm Owner UserID: {alarm_instance.user_id}. Alarm ID: {alarm_db_id}. Skipping')
+        return None
+
+    if not alarm_instance.is_active and event_type != 'disappearance':
+        worker_logger.info(f'Alarm ID {alarm_db_id} is already inactive in DB. Skipping event: {event_type} (unless it\'s disappearance)')
+        return None
+
+    event_row = {
+        'alarm_id': alarm_db_id,
+        'event_type': event_type,
+        'timestamp': datetime.fromtimestamp(timestamp_from_event, tz=timezone.utc) if timestamp_from_event else datetime.now(timezone.utc),
+        'details_json': json.dumps(details) if details else None
+    }
+    deactivate = event_type == 'disappearance' and alarm_instance.is_active
+    notification = _build_notification(flask_app, event_data, alarm_instance, users.get(alarm_instance.user_id))
+
+    worker_logger.debug(f'Queued AlarmEvent for Alarm ID {alarm_db_id}, Type: {event_type}')
+    if deactivate:
+        alarm_instance.is_active = False
+        alarm_instance.unset_at = datetime.now(timezone.utc)
+        worker_logger.info(f'Deactivating Alarm ID {alarm_db_id} in DB due to disappearance')
+    elif event_type == 'disappearance':
+        worker_logger.info(f'Received disappearance for already inactive Alarm ID {alarm_db_id}. Event logged')
+    if notification is not None:
+        # Прежнее значение нужно, чтобы вернуть кулдаун, если уведомление так и не уйдёт (release_notification_cooldowns)
+        notification['previous_notification_at'] = alarm_instance.last_notification_at
+        notification['notified_at'] = alarm_instance.last_notification_at = datetime.now(timezone.utc)
+    return event_row, notification, deactivate
+
+def process_event_batch(flask_app, events: list) -> tuple:
+    """
+    Применяет пачку событий в текущей сессии, не фиксируя её: добавляет строки AlarmEvent одним INSERT,
+    снимает тревоги при пропаже машины и решает, кому отправить уведомление.
+    События обрабатываются по порядку, как если бы приходили по одному; событие, которое не удалось разобрать,
+    пропускается с ошибкой в логе. Кулдаун уведомлений отсчитывается с момента постановки уведомления
+    в очередь (last_notification_at фиксируется вместе с пачкой) и откатывается, если отправить его не удалось.
+    :return: (уведомления - словари аргументов TelegramNotificationDispatcher.enqueue, id снятых тревог, число записанных событий).
+    """
+
+    worker_logger = flask_app.logger
+
+    valid_events = []
+    for event_data in events:
+        if not isinstance(event_data, dict) or not all([event_data.get('alarm_db_id'), event_data.get('type'), event_data.get('user_id'), event_data.get('track_id', 'N/A')]):
+            worker_logger.error(f'Received incomplete event data: {event_data}')
+            continue
+        valid_events.append(event_data)
+    if not valid_events:
+        return [], [], 0
+
+    alarm_ids = {event_data['alarm_db_id'] for event_data in valid_events}
+    alarms = {alarm.id: alarm for alarm in Alarm.query.filter(Alarm.id.in_(alarm_ids)).all()}
+    user_ids = {alarm.user_id for alarm in alarms.values()}
+    users = {user.id: user for user in User.query.filter(User.id.in_(user_ids)).all()} if user_ids else {}
+
+    event_rows = []
+    notifications = []
+    deactivated_alarm_ids = []
+
+    for event_data in valid_events:
+        try:
+            result = _apply_event(flask_app, event_data, alarms, users)
+        except Exception as e:
+            worker_logger.error(f'Unable to process event {event_data}: {e}. Skipping', exc_info=True)
+            continue
+        if result is None:
+            continue
+        event_row, notification, deactivated = result
+        event_rows.append(event_row)
+        if notification is not None:
+            notifications.append(notification)
+        if deactivated:
+            deactivated_alarm_ids.append(event_row['alarm_id'])
+
+    if event_rows:
+        db.session.execute(insert(AlarmEvent), event_rows)
+    return notifications, deactivated_alarm_ids, len(event_rows)
+
+def release_notification_cooldowns(flask_app, notifications: list):
+    """
+    Возвращает last_notification_at тревог, уведомления по которым отброшены или не отправлены,
+    чтобы кулдаун не заглушил следующее уведомление. Тревогу, которую уже отметило более новое уведомление, не трогает.
+    """
+
+    with flask_app.app_context():
+        try:
+            for notification in notifications:
+                if notification.get('notified_at') is None:
                     continue
+                db.session.execute(
+                    update(Alarm)
+                    .where(Alarm.id == notification['alarm_id'], Alarm.last_notification_at == notification['notified_at'])
+                    .values(last_notification_at=notification['previous_notification_at'])
+                )
+            db.session.commit()
+            flask_app.logger.info(f'Released notification cooldown for Alarm ID(s) {', '.join(str(notification['alarm_id']) for notification in notifications)}')
+        except Exception as e:
+            db.session.rollback()
+            flask_app.logger.error(f'Unable to release notification cooldown: {e}', exc_info=True)
 
-                send_notification = False
-                message = ''
-                inline_keyboard_buttons = []
-                vehicle_identifier = f'Машина (трек ID: {track_id}, ID сигнализации: {alarm_db_id})'
-
-                if event_type == 'movement':
-                    if user_to_notify.notify_telegram_movement:
-                        can_send_notification_now = True
-                        if alarm_instance.last_notification_at:
-                            last_notification_at_db = alarm_instance.last_notification_at
-                            if last_notification_at_db.tzinfo is None or last_notification_at_db.tzinfo.utcoffset(last_notification_at_db) is None:
-                                last_notification_at_aware = last_notification_at_db.replace(tzinfo=timezone.utc)
-                            else:
-                                last_notification_at_aware = last_notification_at_db
-                            time_since_last = (datetime.now(timezone.utc) - last_notification_at_aware).total_seconds()
-                            if time_since_last < NOTIFICATION_COOLDOWN_SECONDS:
-                                worker_logger.info(f'Movement notification for Alarm ID {alarm_db_id} (type: {event_type}) throttled due to cooldown')
-                                can_send_notification_now = False
-
-                        if can_send_notification_now:
-                            send_notification = True
-                            dist = details.get('distance_px', 'N/A')
-                            time_s = details.get('time_seconds', 'N/A')
-                            message = f'↔️ ОБНАРУЖЕНО ДВИЖЕНИЕ ↔️\n{vehicle_identifier} начала движение.\nСмещение: {dist}px за {time_s}с.'
-                            # inline_keyboard_buttons.append(
-                            #     [InlineKeyboardButton('Детали события', callback_data=f'event_details:movement:{new_alarm_event.id}')]
-                            # )
-                            # inline_keyboard_buttons.append(
-                            #     [InlineKeyboardButton('Снять с сигнализации', callback_data=f'unarm_alarm:{alarm_db_id}')]
-                            # )
-                    else:
-                        worker_logger.info(f'User ID {user_to_notify.id} disabled Telegram movement notifications')
-                elif event_type == 'disappearance':
-                    if user_to_notify.notify_telegram_disappearance:
-                        send_notification = True
-                        time_not_seen = details.get('time_seconds', 'N/A')
-                        message = f'⚠️ МАШИНА ПРОПАЛА ⚠️\n{vehicle_identifier} пропала из виду.\nНе видна в течение: {time_not_seen}с.'
-                        # inline_keyboard_buttons.append(
-                        #     [InlineKeyboardButton('Детали события', callback_data=f'event_details:disappearance:{new_alarm_event.id}')]
-                        # )
-                    else:
-                        worker_logger.info(f'User ID {user_to_notify.id} disabled Telegram disappearance notifications')
-
-                if send_notification and message:
-                    if send_telegram_message(user_to_notify.telegram_chat_id, message, inline_keyboard_buttons if inline_keyboard_buttons else None):
-                        alarm_instance.last_notification_at = datetime.now(timezone.utc)
-                        notification_sent_this_cycle = True
-                    else:
-                        worker_logger.error(f'Unable to send Telegram notification for Alarm ID {alarm_db_id}')
+def store_event_batch(flask_app, events: list, metrics: MetricsRecorder) -> tuple:
+    """
+    Обрабатывает и фиксирует пачку одной транзакцией. Если она не прошла (например, ошибка целостности
+    в массовом INSERT), пачка откатывается и повторяется по одному событию, чтобы потерять только сбойное.
+    :return: То же, что process_event_batch, по всем зафиксированным событиям.
+    """
+
+    worker_logger = flask_app.logger
+    try:
+        result = process_event_batch(flask_app, events)
+        with metrics.timed('db_commit'):
+            db.session.commit()
+        return result
+    except Exception as e:
+        db.session.rollback()
+        if len(events) == 1:
+            worker_logger.error(f'Unable to store event {events[0]}: {e}', exc_info=True)
+            metrics.count('events_failed')
+            return [], [], 0
+        worker_logger.warning(f'Batch of {len(events)} events failed ({e}). Retrying one event at a time')
 
+    notifications = []
+    deactivated_alarm_ids = []
+    stored_events = 0
+    for event_data in events:
+        try:
+            event_notifications, event_deactivated_alarm_ids, event_stored = process_event_batch(flask_app, [event_data])
+            with metrics.timed('db_commit'):
                 db.session.commit()
-                worker_logger.info(f'Commited DB changes for event related to Alarm ID {alarm_db_id}')
+        except Exception as e:
+            db.session.rollback()
+            worker_logger.error(f'Unable to store event {event_data}: {e}', exc_info=True)
+            metrics.count('events_failed')
+            continue
+        notifications.extend(event_notifications)
+        deactivated_alarm_ids.extend(event_deactivated_alarm_ids)
+        stored_events += event_stored
+    return notifications, deactivated_alarm_ids, stored_events
 
-                if notification_sent_this_cycle:
-                    worker_logger.info(f'Notification successfully processed for Alarm ID {alarm_db_id}')
+def event_processor_worker(
+        flask_app,
+        event_queue_shared,
+        active_alarms_shared,
+        running_flag_shared,
+        metrics_shared=None,
+        alarm_read_model=None,
+        notification_dispatcher=None
+):
+    worker_logger = flask_app.logger
+    batch_max_size = max(1, flask_app.config.get('EVENT_BATCH_MAX_SIZE', 100))
+    batch_max_wait_s = flask_app.config.get('EVENT_BATCH_MAX_WAIT_S', 0.05)
+    worker_logger.info(f'Event Processor Worker started (batches of up to {batch_max_size} events, {batch_max_wait_s * 1000:.0f} ms)')
+    metrics = MetricsRecorder(metrics_shared, 'event_processor')
+
+    while running_flag_shared.value:
+        try:
+            events = drain_event_batch(event_queue_shared, batch_max_size, batch_max_wait_s)
+            if not events:
+                metrics.flush()
+                continue
+            metrics.count('events_received', len(events))
+            metrics.count('event_batches')
+            worker_logger.debug(f'Event Processor received {len(events)} event(s): {events}')
+            batch_started_at = time.perf_counter()
+
+            with metrics.timed('event_processing'), flask_app.app_context():
+                notifications, deactivated_alarm_ids, stored_events = store_event_batch(flask_app, events, metrics)
+                metrics.count('events_stored', stored_events)
+
+                # Пачка уже зафиксирована: сбой одного побочного действия не должен отменять остальные
+                for alarm_db_id in deactivated_alarm_ids:
+                    try:
+                        if active_alarms_shared is not None:
+                            if active_alarms_shared.remove(alarm_db_id):
+                                worker_logger.info(f'Removed Alarm ID {alarm_db_id} from shared alarm registry')
+                            else:
+                                worker_logger.warning(f'Alarm ID {alarm_db_id} (disappeared) not found in shared alarm registry to remove')
+                        if alarm_read_model is not None:
+                            alarm_read_model.remove(alarm_db_id)
+                    except Exception as e:
+                        worker_logger.error(f'Error removing deactivated Alarm ID {alarm_db_id} from registry/read model: {e}', exc_info=True)
+
+                failed_notifications = []
+                for notification in notifications:
+                    try:
+                        if notification_dispatcher is not None:
+                            if not notification_dispatcher.enqueue(**notification):
+                                failed_notifications.append(notification)
+                        else:
+                            # Без диспетчера (скрипты, бенчмарки) - синхронная отправка
+                            with metrics.timed('telegram_send'):
+                                if not send_telegram_message(notification['chat_id'], notification['text']):
+                                    worker_logger.error(f'Unable to send Telegram notification for Alarm ID {notification['alarm_id']}')
+                                    failed_notifications.append(notification)
+                    except Exception as e:
+                        worker_logger.error(f'Error dispatching notification for Alarm ID {notification['alarm_id']}: {e}', exc_info=True)
+                        failed_notifications.append(notification)
+                if failed_notifications:
+                    release_notification_cooldowns(flask_app, failed_notifications)
+
+            batch_elapsed_s = time.perf_counter() - batch_started_at
+            worker_logger.info(f'Processed batch of {len(events)} event(s) ({stored_events} stored, {len(notifications)} notification(s)) in {batch_elapsed_s * 1000:.1f} ms, {len(events) / batch_elapsed_s:.0f} events/s')
 
-        except queue.Empty:
-            continue
         except Exception as e:
             worker_logger.error(f'Error in Event Processor Worker: {e}', exc_info=True)
             with flask_app.app_context():
@@ -154,4 +328,5 @@ def event_processor_worker(
                     worker_logger.error(f'Error during rollback: {rb_exc}', exc_info=True)
             time.sleep(1)
 
+    metrics.flush(force=True)
     worker_logger.info('Event Processor Worker stopped')
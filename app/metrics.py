@@ -0,0 +1,131 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+LATENCY_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_PREFIX = 'alertcam'
+
+class MetricsRecorder:
+    """
+    Гистограммы длительностей этапов и счётчики одного процесса.
+    Значения копятся локально, а в общий словарь Manager (под именем процесса) выгружаются
+    не чаще раза в flush_interval_s, поэтому замер на горячем пути - это пара операций под локальной блокировкой.
+    Интерфейс observe/count совпадает со stage_observer детектора.
+    """
+
+    def __init__(self, metrics_shared, process_name: str, flush_interval_s: float = 1.0):
+        self.metrics_shared = metrics_shared
+        self.process_name = process_name
+        self.flush_interval_s = flush_interval_s
+
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._next_flush_at = 0.0
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = {'buckets': [0] * (len(LATENCY_BUCKETS_S) + 1), 'sum': 0.0, 'count': 0}
+            histogram['buckets'][bisect.bisect_left(LATENCY_BUCKETS_S, seconds)] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+        self.flush()
+
+    def count(self, name: str, value: int = 1):
+        if not value:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        self.flush()
+
+    @contextmanager
+    def timed(self, stage: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started_at)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'histograms': {stage: {**histogram, 'buckets': list(histogram['buckets'])} for stage, histogram in self._histograms.items()},
+                'counters': dict(self._counters)
+            }
+
+    def flush(self, force: bool = False):
+        """Выгружает накопленные значения в общий словарь, если подошло время (или сразу при force)."""
+
+        with self._lock:
+            now = time.monotonic()
+            if not force and now < self._next_flush_at:
+                return
+            self._next_flush_at = now + self.flush_interval_s
+        if self.metrics_shared is None:
+            return
+        try:
+            self.metrics_shared[self.process_name] = self.snapshot()
+        except Exception:
+            # Метрики не должны ронять рабочий цикл (например, Manager уже остановлен при выходе)
+            pass
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (f'{key}="{str(value).replace('\\', '\\\\').replace('"', '\\"')}"' for key, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+def render_prometheus(process_metrics: dict, gauges: list | None = None) -> str:
+    """
+    Формирует текст в формате Prometheus.
+    :param process_metrics: Словарь {имя процесса: MetricsRecorder.snapshot()}.
+    :param gauges: Список (имя, тип, описание, [(labels, value), ...]) для значений, посчитанных при запросе.
+    :return: Текст для ответа /metrics.
+    """
+
+    lines = []
+    histogram_name = f'{METRICS_PREFIX}_stage_duration_seconds'
+    lines.append(f'# HELP {histogram_name} Duration of pipeline stages.')
+    lines.append(f'# TYPE {histogram_name} histogram')
+    for process_name, snapshot in sorted(process_metrics.items()):
+        for stage, histogram in sorted(snapshot.get('histograms', {}).items()):
+            labels = {'process': process_name, 'stage': stage}
+            cumulative = 0
+            for upper_bound, bucket_count in zip(LATENCY_BUCKETS_S + (float('inf'),), histogram['buckets']):
+                cumulative += bucket_count
+                le = '+Inf' if upper_bound == float('inf') else repr(upper_bound)
+                lines.append(f'{histogram_name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}')
+            lines.append(f'{histogram_name}_sum{_format_labels(labels)} {_format_value(histogram['sum'])}')
+            lines.append(f'{histogram_name}_count{_format_labels(labels)} {histogram['count']}')
+
+    counters = {}
+    for process_name, snapshot in process_metrics.items():
+        for name, value in snapshot.get('counters', {}).items():
+            counters.setdefault(name, []).append(({'process': process_name}, value))
+    for name, samples in sorted(counters.items()):
+        metric_name = f'{METRICS_PREFIX}_{name}_total'
+        lines.append(f'# TYPE {metric_name} counter')
+        for labels, value in sorted(samples, key=lambda sample: sample[0]['process']):
+            lines.append(f'{metric_name}{_format_labels(labels)} {_format_value(value)}')
+
+    for name, metric_type, help_text, samples in gauges or []:
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            continue
+        metric_name = f'{METRICS_PREFIX}_{name}'
+        lines.append(f'# HELP {metric_name} {help_text}')
+        lines.append(f'# TYPE {metric_name} {metric_type}')
+        for labels, value in samples:
+            lines.append(f'{metric_name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
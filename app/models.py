@@ -1,9 +1,20 @@
+import json
 from datetime import datetime, timezone, timedelta
 from secrets import token_hex
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import text
 from . import db
 
+def parse_event_details(details_json: str | None):
+    """:return: Разобранный details_json события; строка как есть, если это не JSON."""
+
+    if not details_json:
+        return None
+    try:
+        return json.loads(details_json)
+    except (TypeError, ValueError):
+        return details_json
+
 class User(db.Model):
     __tablename__ = 'users'
 
@@ -32,10 +43,17 @@ class User(db.Model):
 
 class Alarm(db.Model):
     __tablename__ = 'alarms'
+    __table_args__ = (
+        # Активные тревоги пользователя и поиск активной тревоги на машину (set_alarm)
+        db.Index('ix_alarms_user_id_is_active_track', 'user_id', 'is_active', 'vehicle_track_id', 'camera_id'),
+        # Keyset-пагинация истории тревог
+        db.Index('ix_alarms_user_id_set_at', 'user_id', 'set_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     vehicle_track_id = db.Column(db.Integer, nullable=False, index=True)
+    camera_id = db.Column(db.String(64), nullable=False, index=True, server_default='main')
 
     set_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     unset_at = db.Column(db.DateTime, nullable=True)
@@ -46,13 +64,19 @@ class Alarm(db.Model):
 
     def __repr__(self):
         status = 'active' if self.is_active else 'inactive'
-        return f'<Alarm id={self.id} user_id={self.user_id} vehicle_track_id={self.vehicle_track_id} status={status}'
+        return f'<Alarm id={self.id} user_id={self.user_id} camera_id={self.camera_id} vehicle_track_id={self.vehicle_track_id} status={status}'
 
 class AlarmEvent(db.Model):
     __tablename__ = 'alarm_events'
+    __table_args__ = (
+        # События тревог страницы истории по времени
+        db.Index('ix_alarm_events_alarm_id_timestamp', 'alarm_id', 'timestamp'),
+        # Привязка видео к событию в video_writer_worker
+        db.Index('ix_alarm_events_alarm_id_event_type_timestamp', 'alarm_id', 'event_type', 'timestamp'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    alarm_id = db.Column(db.Integer, db.ForeignKey('alarms.id'), nullable=False, index=True)
+    alarm_id = db.Column(db.Integer, db.ForeignKey('alarms.id'), nullable=False)
     event_type = db.Column(db.String(64), nullable=False, index=True)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     details_json = db.Column(db.Text, nullable=True)
@@ -0,0 +1,346 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from datetime import datetime
+import httpx
+from .notifications import telegram_method_url, build_message_payload
+from .metrics import MetricsRecorder
+
+DIGEST_MAX_LINES = 20
+
+class TokenBucket:
+    """Ведро токенов: rate_per_s токенов в секунду, не больше capacity. При rate_per_s <= 0 ограничения нет."""
+
+    def __init__(self, rate_per_s: float, capacity: float, now: float):
+        self.rate_per_s = rate_per_s
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_s)
+        self.updated_at = now
+
+    def wait_s(self, now: float) -> float:
+        """:return: Через сколько секунд будет доступен токен (0 - уже доступен)."""
+
+        if self.rate_per_s <= 0:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate_per_s
+
+    def take(self, now: float):
+        if self.rate_per_s <= 0:
+            return
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        if self.rate_per_s <= 0:
+            return True
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+def _plural(count: int, forms: tuple) -> str:
+    if count % 10 == 1 and count % 100 != 11:
+        return forms[0]
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return forms[1]
+    return forms[2]
+
+def build_digest_text(notifications: list) -> str:
+    """
+    Одно сообщение вместо нескольких уведомлений чата, например «3 машины начали движение, 1 машина пропала из виду».
+    :param notifications: Уведомления в порядке постановки (с event_type и summary).
+    """
+
+    moved = sum(1 for notification in notifications if notification['event_type'] == 'movement')
+    disappeared = sum(1 for notification in notifications if notification['event_type'] == 'disappearance')
+    other = len(notifications) - moved - disappeared
+
+    totals = []
+    if moved:
+        totals.append(f'{moved} {_plural(moved, ('машина начала', 'машины начали', 'машин начали'))} движение')
+    if disappeared:
+        totals.append(f'{disappeared} {_plural(disappeared, ('машина пропала', 'машины пропали', 'машин пропали'))} из виду')
+    if other:
+        totals.append(f'{other} {_plural(other, ('другое событие', 'других события', 'других событий'))}')
+
+    lines = ['🚨 СВОДКА ПО СИГНАЛИЗАЦИЯМ 🚨', ', '.join(totals) + '.']
+    for notification in notifications[:DIGEST_MAX_LINES]:
+        icon = {'movement': '↔️', 'disappearance': '⚠️'}.get(notification['event_type'], '•')
+        lines.append(f'{icon} {notification['summary'] or notification['text'].splitlines()[0]}')
+    if len(notifications) > DIGEST_MAX_LINES:
+        lines.append(f'…и ещё {len(notifications) - DIGEST_MAX_LINES}')
+    return '\n'.join(lines)
+
+class TelegramNotificationDispatcher:
+    """
+    Отправляет уведомления Telegram из отдельного потока с циклом asyncio и общим пулом соединений httpx,
+    чтобы медленный ответ Telegram не задерживал запись событий. Обработчик событий только вызывает enqueue.
+    Уведомления одного чата уходят по порядку и по одному: в очереди отправителей стоят чаты, а не сообщения,
+    поэтому медленный ответ или retry_after одного чата не задерживает остальные.
+    Частоту отправки ограничивают ведра токенов: на каждый чат (TELEGRAM_CHAT_RATE_PER_S) и общее (TELEGRAM_GLOBAL_RATE_PER_S).
+    Всё, что накопилось в чате, пока он ждал токен или отправку, уходит одной сводкой (build_digest_text).
+    Ошибки сети и 5xx повторяются с экспоненциальной задержкой, на 429 ждём retry_after из ответа.
+    """
+
+    def __init__(self, flask_app, metrics_shared=None, on_failure=None):
+        """:param on_failure: Вызывается (в пуле потоков) со списком уведомлений, которые не удалось отправить."""
+
+        config = flask_app.config
+        self.logger = flask_app.logger
+        self.token = config.get('TELEGRAM_BOT_TOKEN')
+        self.api_base_url = config.get('TELEGRAM_API_BASE_URL')
+        self.request_timeout_s = config.get('TELEGRAM_REQUEST_TIMEOUT_S')
+        self.max_queue_size = config.get('NOTIFICATION_QUEUE_MAX_SIZE')
+        self.concurrency = max(1, config.get('NOTIFICATION_SEND_CONCURRENCY'))
+        self.max_attempts = max(1, config.get('NOTIFICATION_MAX_ATTEMPTS'))
+        self.retry_backoff_s = config.get('NOTIFICATION_RETRY_BACKOFF_S')
+        self.chat_rate_per_s = config.get('TELEGRAM_CHAT_RATE_PER_S')
+        self.global_rate_per_s = config.get('TELEGRAM_GLOBAL_RATE_PER_S')
+        self.metrics = MetricsRecorder(metrics_shared, 'notification_dispatcher')
+        self.on_failure = on_failure
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stopping = False
+        self._loop = None
+        # Только в потоке диспетчера: {chat_id: deque уведомлений}; чат есть в словаре, пока он в очереди или в отправке
+        self._chat_notifications = {}
+        self._chat_buckets = {}
+        # Без запаса на всплески: сообщения идут равномерно, и в любой секунде их не больше лимита
+        self._global_bucket = TokenBucket(self.global_rate_per_s, 1.0, time.monotonic())
+        self._ready_chats = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def pending(self) -> int:
+        """:return: Число уведомлений в очереди и в отправке."""
+
+        return self._pending
+
+    def start(self):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._run()), name='NotificationDispatcherThread', daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout=5):
+            self.logger.error('Notification dispatcher did not start in time')
+
+    def stop(self, timeout_s: float = 10.0):
+        """Дожидается отправки уже поставленных уведомлений (не дольше timeout_s) и закрывает соединения."""
+
+        with self._lock:
+            self._stopping = True
+            loop = self._loop
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), loop)
+        self._thread.join(timeout=timeout_s)
+        if self._thread.is_alive():
+            self.logger.warning(f'Notification dispatcher did not finish in time, {self._pending} notification(s) not sent')
+        self.metrics.flush(force=True)
+
+    def enqueue(self, chat_id: str, text: str, inline_keyboard: list | None = None, alarm_id: int | None = None,
+                event_timestamp: float | None = None, event_type: str | None = None, summary: str | None = None,
+                notified_at: datetime | None = None, previous_notification_at: datetime | None = None) -> bool:
+        """
+        Ставит уведомление в очередь, не дожидаясь отправки.
+        :param event_timestamp: Время события (time.time()) для замера задержки событие -> уведомление.
+        :param event_type: Тип события и summary - строка о машине для сводки, если уведомления чата будут объединены.
+        :param notified_at: Отметка кулдауна тревоги и previous_notification_at - прежняя; передаются в on_failure.
+        :return: False, если уведомление отброшено (очередь заполнена, диспетчер не запущен или нет токена).
+        """
+
+        if not self.token:
+            self.logger.error('Telegram Bot Token is not configured')
+            return False
+        if not chat_id:
+            self.logger.error('Chat ID was not given')
+            return False
+
+        with self._lock:
+            if self._loop is None or self._stopping:
+                self.logger.warning(f'Notification dispatcher is not running. Dropped notification for Alarm ID {alarm_id}')
+                self.metrics.count('notifications_dropped')
+                return False
+            if self._pending >= self.max_queue_size:
+                self.logger.warning(f'Notification queue is full ({self.max_queue_size}). Dropped notification for Alarm ID {alarm_id}')
+                self.metrics.count('notifications_dropped')
+                return False
+            self._pending += 1
+            loop = self._loop
+
+        notification = {
+            'chat_id': chat_id,
+            'text': text,
+            'inline_keyboard': inline_keyboard,
+            'alarm_id': alarm_id,
+            'event_timestamp': event_timestamp,
+            'event_type': event_type,
+            'summary': summary,
+            'notified_at': notified_at,
+            'previous_notification_at': previous_notification_at
+        }
+        loop.call_soon_threadsafe(self._accept, notification)
+        self.metrics.count('notifications_enqueued')
+        return True
+
+    async def _run(self):
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(timeout=self.request_timeout_s, limits=limits) as client:
+            self._ready_chats = asyncio.Queue()
+            with self._lock:
+                self._loop = asyncio.get_running_loop()
+            self._ready.set()
+            self.logger.info(f'Notification dispatcher started ({self.concurrency} sender(s), queue limit {self.max_queue_size}, '
+                             f'{self.chat_rate_per_s} msg/s per chat, {self.global_rate_per_s} msg/s total)')
+            await asyncio.gather(*(self._sender(client) for _ in range(self.concurrency)))
+        self.logger.info('Notification dispatcher stopped')
+
+    async def _shutdown(self):
+        while self._pending:
+            await asyncio.sleep(0.05)
+        for _ in range(self.concurrency):
+            self._ready_chats.put_nowait(None)
+
+    def _accept(self, notification: dict):
+        chat_notifications = self._chat_notifications.get(notification['chat_id'])
+        if chat_notifications is None:
+            self._chat_notifications[notification['chat_id']] = deque([notification])
+            self._ready_chats.put_nowait(notification['chat_id'])
+        else:
+            chat_notifications.append(notification)
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        chat_bucket = self._chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            now = time.monotonic()
+            if len(self._chat_buckets) > 1000 + 2 * len(self._chat_notifications):
+                # Полное ведро не отличается от нового - такие можно забыть
+                self._chat_buckets = {
+                    known_chat_id: bucket for known_chat_id, bucket in self._chat_buckets.items()
+                    if known_chat_id in self._chat_notifications or not bucket.is_full(now)
+                }
+            chat_bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate_per_s, 1.0, now)
+        return chat_bucket
+
+    async def _acquire(self, chat_bucket: TokenBucket):
+        """Ждёт токены чата и общий, затем забирает оба."""
+
+        while True:
+            wait_s = max(chat_bucket.wait_s(time.monotonic()), self._global_bucket.wait_s(time.monotonic()))
+            if wait_s <= 0:
+                break
+            await asyncio.sleep(wait_s)
+        now = time.monotonic()
+        chat_bucket.take(now)
+        self._global_bucket.take(now)
+
+    async def _sender(self, client: httpx.AsyncClient):
+        send_url = telegram_method_url(self.api_base_url, self.token, 'sendMessage')
+        while True:
+            chat_id = await self._ready_chats.get()
+            if chat_id is None:
+                return
+            chat_notifications = self._chat_notifications[chat_id]
+            chat_bucket = self._chat_bucket(chat_id)
+            wait_s = chat_bucket.wait_s(time.monotonic())
+            if wait_s > 0:
+                # Чат вернётся в очередь, когда появится токен; уведомления за это время попадут в сводку
+                asyncio.get_running_loop().call_later(wait_s, self._ready_chats.put_nowait, chat_id)
+                continue
+
+            batch = list(chat_notifications)
+            chat_notifications.clear()
+            alarm_ids = ', '.join(str(notification['alarm_id']) for notification in batch)
+            if len(batch) == 1:
+                payload = build_message_payload(chat_id, batch[0]['text'], batch[0]['inline_keyboard'])
+            else:
+                payload = build_message_payload(chat_id, build_digest_text(batch))
+                self.metrics.count('notification_digests')
+                self.logger.info(f'Coalesced {len(batch)} notifications for Telegram chat {chat_id} into a digest')
+            try:
+                if await self._deliver(client, send_url, chat_id, chat_bucket, payload, alarm_ids):
+                    self.metrics.count('notifications_sent', len(batch))
+                    now = time.time()
+                    for notification in batch:
+                        if notification['event_timestamp']:
+                            self.metrics.observe('event_to_notification', now - notification['event_timestamp'])
+                else:
+                    self.metrics.count('notifications_failed', len(batch))
+                    await self._report_failure(batch)
+            except Exception as e:
+                self.metrics.count('notifications_failed', len(batch))
+                self.logger.error(f'Unexpected error while sending notification for Alarm ID(s) {alarm_ids}: {e}', exc_info=True)
+                await self._report_failure(batch)
+            finally:
+                with self._lock:
+                    self._pending -= len(batch)
+                # Следующее сообщение чата - в конец очереди, чтобы чат с длинной очередью не занимал отправителя
+                if chat_notifications:
+                    self._ready_chats.put_nowait(chat_id)
+                else:
+                    del self._chat_notifications[chat_id]
+
+    async def _report_failure(self, batch: list):
+        if self.on_failure is None:
+            return
+        try:
+            # Обработчик ходит в БД - не в цикле asyncio
+            await asyncio.get_running_loop().run_in_executor(None, self.on_failure, batch)
+        except Exception as e:
+            self.logger.error(f'Error in notification failure handler: {e}', exc_info=True)
+
+    async def _deliver(self, client: httpx.AsyncClient, send_url: str, chat_id: str, chat_bucket: TokenBucket, payload: dict, alarm_ids: str) -> bool:
+        """:return: True, если Telegram принял сообщение."""
+
+        for attempt in range(1, self.max_attempts + 1):
+            retry_in_s = self.retry_backoff_s * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+            await self._acquire(chat_bucket)
+            started_at = time.perf_counter()
+            try:
+                response = await client.post(send_url, json=payload)
+            except httpx.TransportError as e:
+                self.logger.warning(f'Error occurred while sending message to Telegram chat {chat_id} (attempt {attempt}/{self.max_attempts}): {e!r}')
+            else:
+                self.metrics.observe('telegram_send', time.perf_counter() - started_at)
+                if response.status_code == 429:
+                    self.metrics.count('telegram_rate_limited')
+                    retry_in_s = _retry_after_s(response, retry_in_s)
+                    self.logger.warning(f'Telegram rate limit for chat {chat_id}. Retrying in {retry_in_s:.1f}s')
+                elif response.status_code >= 500:
+                    self.logger.warning(f'Telegram API returned {response.status_code} for chat {chat_id} (attempt {attempt}/{self.max_attempts})')
+                else:
+                    try:
+                        response_json = response.json()
+                    except ValueError:
+                        response_json = {}
+                    if response_json.get('ok'):
+                        self.logger.info(f'Message to Telegram chat {chat_id} sent successfully')
+                        return True
+                    self.logger.error(f'Telegram API error for chat {chat_id}: {response_json.get('description', response.status_code)}')
+                    return False
+
+            if attempt < self.max_attempts:
+                self.metrics.count('notification_retries')
+                await asyncio.sleep(retry_in_s)
+
+        self.logger.error(f'Unable to send Telegram notification for Alarm ID(s) {alarm_ids} after {self.max_attempts} attempt(s)')
+        return False
+
+def _retry_after_s(response: httpx.Response, default_s: float) -> float:
+    """:return: Пауза из parameters.retry_after ответа 429 (или заголовка Retry-After)."""
+
+    try:
+        retry_after = response.json().get('parameters', {}).get('retry_after')
+    except ValueError:
+        retry_after = None
+    if retry_after is None:
+        retry_after = response.headers.get('Retry-After')
+    try:
+        return max(float(retry_after), 0.0)
+    except (TypeError, ValueError):
+        return default_s
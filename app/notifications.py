@@ -2,9 +2,26 @@ import requests
 from flask import current_app
 from telegram import InlineKeyboardMarkup
 
+def telegram_method_url(api_base_url: str, token: str, method: str) -> str:
+    return f'{api_base_url.rstrip('/')}/bot{token}/{method}'
+
+def build_message_payload(chat_id: str, text: str, inline_keyboard: list | None = None) -> dict:
+    """:return: Тело запроса sendMessage (текст экранируется для MarkdownV2)."""
+
+    payload = {
+        'chat_id': chat_id,
+        'text': escape_markdown_v2(text),
+        'parse_mode': 'MarkdownV2'
+    }
+    if inline_keyboard:
+        reply_markup = InlineKeyboardMarkup(inline_keyboard)
+        payload['reply_markup'] = reply_markup.to_json()
+    return payload
+
 def send_telegram_message(chat_id: str, text: str, inline_keyboard: list | None = None) -> bool:
     """
-    Отправляет сообщение в Telegram указанному chat_id
+    Отправляет сообщение в Telegram указанному chat_id синхронно.
+    Рабочий цикл отправляет уведомления через TelegramNotificationDispatcher
     """
 
     token = current_app.config.get('TELEGRAM_BOT_TOKEN')
@@ -15,16 +32,8 @@ def send_telegram_message(chat_id: str, text: str, inline_keyboard: list | None
         current_app.logger.error('Chat ID was not given')
         return False
 
-    send_url = f'https://api.telegram.org/bot{token}/sendMessage'
-    payload = {
-        'chat_id': chat_id,
-        'text': escape_markdown_v2(text),
-        'parse_mode': 'MarkdownV2'
-    }
-
-    if inline_keyboard:
-        reply_markup = InlineKeyboardMarkup(inline_keyboard)
-        payload['reply_markup'] = reply_markup.to_json()
+    send_url = telegram_method_url(current_app.config.get('TELEGRAM_API_BASE_URL'), token, 'sendMessage')
+    payload = build_message_payload(chat_id, text, inline_keyboard)
 
     try:
         response = requests.post(send_url, json=payload, timeout=10)
@@ -0,0 +1,49 @@
+import base64
+import binascii
+import struct
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, or_
+
+CURSOR_STRUCT = struct.Struct('>qq')
+
+EPOCH = datetime(1970, 1, 1)
+
+def _naive_utc(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """
+    Непрозрачный курсор keyset-пагинации по (timestamp, id).
+    :return: 22 символа base64url - помещается и в callback_data Telegram (до 64 байт).
+    """
+
+    microseconds = (_naive_utc(timestamp) - EPOCH) // timedelta(microseconds=1)
+    return base64.urlsafe_b64encode(CURSOR_STRUCT.pack(microseconds, row_id)).rstrip(b'=').decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    :return: (timestamp - naive UTC, как хранится в БД, id).
+    :raises ValueError: Если курсор повреждён.
+    """
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        microseconds, row_id = CURSOR_STRUCT.unpack(raw)
+        timestamp = EPOCH + timedelta(microseconds=microseconds)
+    except (binascii.Error, struct.error, TypeError, OverflowError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+    return timestamp, row_id
+
+def keyset_before(timestamp_column, id_column, cursor: str):
+    """Условие для строк после курсора при сортировке (timestamp, id) по убыванию."""
+
+    timestamp, row_id = decode_cursor(cursor)
+    return or_(timestamp_column < timestamp, and_(timestamp_column == timestamp, id_column < row_id))
+
+def keyset_after(timestamp_column, id_column, cursor: str):
+    """Условие для строк до курсора при сортировке (timestamp, id) по убыванию (страница назад)."""
+
+    timestamp, row_id = decode_cursor(cursor)
+    return or_(timestamp_column > timestamp, and_(timestamp_column == timestamp, id_column > row_id))
@@ -4,7 +4,9 @@ import os
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CommandHandler, MessageHandler, filters, ContextTypes, ApplicationBuilder, CallbackQueryHandler
 from .notifications import escape_markdown_v2
+from sqlalchemy.orm import contains_eager
 from .models import User, Alarm, AlarmEvent, TelegramVerificationCode
+from .pagination import encode_cursor, keyset_before, keyset_after
 from . import db
 
 STATE_AWAITING_USERNAME = 1
@@ -185,27 +187,50 @@ async def send_history_page(
     update_or_query,
     context: ContextTypes.DEFAULT_TYPE,
     user_id: int,
-    page:int = 1
+    page:int = 1,
+    cursor: str | None = None,
+    direction: str = 'n'
 ) -> None:
-    """Отправляет или редактирует сообщение с указанной страницей истории."""
+    """
+    Отправляет или редактирует сообщение с указанной страницей истории.
+    Страницы листаются по курсору (timestamp, id) соседнего события: direction 'n' - события старше курсора,
+    'p' - новее. OFFSET и подсчёт всех событий не нужны, поэтому глубокие страницы не медленнее первой.
+    """
 
     ITEMS_PER_PAGE_HISTORY = 5
     flask_app = context.bot_data['flask_app']
 
     with flask_app.app_context():
-        offset = (page - 1) * ITEMS_PER_PAGE_HISTORY
-
-        user_alarm_events = db.session.query(AlarmEvent)\
-            .join(AlarmEvent.alarm)\
-            .filter(Alarm.user_id == user_id)\
-            .order_by(AlarmEvent.timestamp.desc())\
-            .limit(ITEMS_PER_PAGE_HISTORY)\
-            .offset(offset)\
-            .all()
-        total_events_count = db.session.query(db.func.count(AlarmEvent.id))\
+        events_query = db.session.query(AlarmEvent)\
             .join(AlarmEvent.alarm)\
-            .filter(Alarm.user_id == user_id)\
-            .scalar() or 0
+            .options(contains_eager(AlarmEvent.alarm))\
+            .filter(Alarm.user_id == user_id)
+
+        if cursor and direction == 'p':
+            newer_events = events_query\
+                .filter(keyset_after(AlarmEvent.timestamp, AlarmEvent.id, cursor))\
+                .order_by(AlarmEvent.timestamp.asc(), AlarmEvent.id.asc())\
+                .limit(ITEMS_PER_PAGE_HISTORY + 1)\
+                .all()
+            if len(newer_events) <= ITEMS_PER_PAGE_HISTORY:
+                # Новее курсора не больше страницы событий - это первая страница, показываем её целиком
+                cursor = None
+                page = 1
+
+        if cursor and direction == 'p':
+            user_alarm_events = list(reversed(newer_events[:ITEMS_PER_PAGE_HISTORY]))
+            has_newer = True
+            has_older = True
+        else:
+            if cursor:
+                events_query = events_query.filter(keyset_before(AlarmEvent.timestamp, AlarmEvent.id, cursor))
+            older_events = events_query\
+                .order_by(AlarmEvent.timestamp.desc(), AlarmEvent.id.desc())\
+                .limit(ITEMS_PER_PAGE_HISTORY + 1)\
+                .all()
+            has_older = len(older_events) > ITEMS_PER_PAGE_HISTORY
+            user_alarm_events = older_events[:ITEMS_PER_PAGE_HISTORY]
+            has_newer = cursor is not None
 
         if not user_alarm_events and page == 1:
             message_text = escape_markdown_v2('Для твоих сигнализаций пока нет зарегистрированных событий')
@@ -214,7 +239,7 @@ async def send_history_page(
             message_text = escape_markdown_v2('Больше событий нет')
             reply_markup = InlineKeyboardMarkup([
                 [
-                    InlineKeyboardButton('⏪ Назад', callback_data=f'history_page:{page-1}')
+                    InlineKeyboardButton('⏪ В начало', callback_data='history_page:1')
                 ]
             ])
         else:
@@ -227,6 +252,7 @@ async def send_history_page(
                 alarm_id_str = str(event.alarm_id)
                 event_id_str = str(event.id)
                 track_id_str = str(event.alarm.vehicle_track_id)
+                camera_id_str = event.alarm.camera_id
                 event_type_str = event.event_type
                 details_str = event_details_json_to_str(event)
 
@@ -234,6 +260,7 @@ async def send_history_page(
                     f'🗓️ {event_time_str}\n'
                     f'🚨 ID сигнализации: {alarm_id_str}\n'
                     f'🆔 ID события: {event_id_str}\n'
+                    f'📷 Камера: {camera_id_str}\n'
                     f'🚗 Трек ID т/с: {track_id_str}\n'
                 )
 
@@ -250,15 +277,17 @@ async def send_history_page(
             response_text_parts[-1] = response_text_parts[-1] + '--------------------\n'
 
             message_text = ''.join(response_text_parts)
+            # callback_data ограничена 64 байтами: номер страницы, направление и курсор (22 символа)
             keyboard_row = []
-            if page > 1:
+            if has_newer:
+                newest_event = user_alarm_events[0]
                 keyboard_row.append(
-                    InlineKeyboardButton(f'⏪ Предыдущая', callback_data=f'history_page:{page-1}')
+                    InlineKeyboardButton(f'⏪ Предыдущая', callback_data=f'history_page:{page-1}:p:{encode_cursor(newest_event.timestamp, newest_event.id)}')
                 )
-            total_pages = (total_events_count + ITEMS_PER_PAGE_HISTORY - 1) // ITEMS_PER_PAGE_HISTORY
-            if page < total_pages:
+            if has_older:
+                oldest_event = user_alarm_events[-1]
                 keyboard_row.append(
-                    InlineKeyboardButton(f'Следующая ⏩', callback_data=f'history_page:{page+1}')
+                    InlineKeyboardButton(f'Следующая ⏩', callback_data=f'history_page:{page+1}:n:{encode_cursor(oldest_event.timestamp, oldest_event.id)}')
                 )
             reply_markup = InlineKeyboardMarkup([keyboard_row]) if keyboard_row else None
 
@@ -522,9 +551,13 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
             try:
                 page_to_show = int(action_parts[1])
                 if page_to_show < 1: page_to_show = 1
-                await send_history_page(query, context, user.id, page=page_to_show)
+                if len(action_parts) >= 4:
+                    await send_history_page(query, context, user.id, page=page_to_show, direction=action_parts[2], cursor=action_parts[3])
+                else:
+                    # Кнопки старого формата (history_page:<номер>) без курсора открывают первую страницу
+                    await send_history_page(query, context, user.id)
             except ValueError:
-                await query.edit_message_text(text=escape_markdown_v2('Ошибка: неверный номер страницы'), parse_mode='MarkdownV2')
+                await query.edit_message_text(text=escape_markdown_v2('Ошибка: неверные данные для страницы истории'), parse_mode='MarkdownV2')
             except Exception as e:
                 flask_app.logger.error(f'Error processing history_page callback: {e}', exc_info=True)
                 await query.edit_message_text(text=escape_markdown_v2('Произошла ошибка при загрузке страницы истории'), parse_mode='MarkdownV2')
@@ -1,4 +1,5 @@
 import cv2
+import numpy as np
 import queue
 import logging
 import os
@@ -6,9 +7,14 @@ import time
 from datetime import datetime, timezone, timedelta
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from app.detection.frame_ring import SharedFrameRing
+from app.metrics import MetricsRecorder
 
 video_writer_logger = logging.getLogger('VideoWriterProcess')
 
+RING_RECORDING_STALL_TIMEOUT_S = 10
+RING_FRAMES_PER_ITERATION = 25
+
 def setup_video_writer_logging(level_str='INFO'):
     level = getattr(logging, level_str.upper(), logging.INFO)
     handler = logging.StreamHandler()
@@ -18,14 +24,190 @@ def setup_video_writer_logging(level_str='INFO'):
     video_writer_logger.setLevel(level)
     video_writer_logger.propagate = False
 
+def update_alarm_event_video_path(SessionLocal, filepath: str, event_info_for_db: dict):
+    """Проставляет путь к видео в соответствующем AlarmEvent."""
+
+    db_session = SessionLocal()
+    try:
+        from app.models import AlarmEvent
+
+        alarm_db_id_from_event = event_info_for_db.get('alarm_db_id')
+        event_type_from_event = event_info_for_db.get('type')
+        event_timestamp_from_detector = event_info_for_db.get('timestamp')
+
+        if alarm_db_id_from_event and event_type_from_event and event_timestamp_from_detector:
+            dt_from_detector = datetime.fromtimestamp(event_timestamp_from_detector, tz=timezone.utc)
+            time_window_for_even_match_seconds = 5
+
+            target_alarm_event = db_session.query(AlarmEvent).filter(
+                AlarmEvent.alarm_id == alarm_db_id_from_event,
+                AlarmEvent.event_type == event_type_from_event,
+                AlarmEvent.timestamp >= (dt_from_detector - timedelta(seconds=time_window_for_even_match_seconds)),
+                AlarmEvent.timestamp <= (dt_from_detector + timedelta(seconds=time_window_for_even_match_seconds))
+            ).order_by(AlarmEvent.timestamp.desc()).first()
+
+            if target_alarm_event:
+                relative_video_path = os.path.basename(filepath)
+                target_alarm_event.video_path = relative_video_path
+                db_session.commit()
+                video_writer_logger.info(f'Updated AlarmEvent ID {target_alarm_event.id} with video_path: {relative_video_path}')
+            else:
+                video_writer_logger.warning(
+                    f'Could not find matching AlarmEvent for video {filepath}. '
+                    f'Criteria: alarm_id={alarm_db_id_from_event}, type={event_type_from_event}, '
+                    f'approx_ts={dt_from_detector.isoformat()}'
+                )
+        else:
+            video_writer_logger.warning(f'Not enough info in event_data to update AlarmEvent for video {filepath}')
+    except Exception as e_db_update:
+        video_writer_logger.error(f'Error updating AlarmEvent for video {filepath}: {e_db_update}', exc_info=True)
+        db_session.rollback()
+    finally:
+        db_session.close()
+
+def start_ring_recording(video_task: dict, frame_rings: dict, fourcc) -> dict | None:
+    """
+    Открывает VideoWriter для задачи, ссылающейся на кольцевой буфер кадров в разделяемой памяти.
+    :return: Состояние записи или None, если начать запись не удалось.
+    """
+
+    filepath = video_task.get('video_filepath')
+    ring_descriptor = video_task['frame_ring']
+    frame_ring = frame_rings.get(ring_descriptor['name'])
+    if frame_ring is None:
+        try:
+            frame_ring = SharedFrameRing.attach(ring_descriptor)
+        except FileNotFoundError:
+            video_writer_logger.error(f'Shared frame ring {ring_descriptor['name']} for video {filepath} no longer exists. Skipping')
+            return None
+        frame_rings[ring_descriptor['name']] = frame_ring
+        video_writer_logger.info(f'Attached to shared frame ring {frame_ring.name} ({frame_ring.slots} slots of {frame_ring.frame_shape})')
+
+    out = cv2.VideoWriter(filepath, fourcc, float(video_task['fps']), tuple(video_task['frame_size']))
+    if not out.isOpened():
+        video_writer_logger.error(f'Failed to open VideoWriter for: {filepath}. Skipping')
+        return None
+
+    video_writer_logger.info(f'Starting to stream video from shared memory: {filepath}, Size: {video_task['frame_size']}, FPS: {video_task['fps']}, Start seq: {video_task['start_seq']}')
+    return {
+        'task': video_task,
+        'out': out,
+        'frame_ring': frame_ring,
+        'next_seq': video_task['start_seq'],
+        'frames_written': 0,
+        'frames_lost': 0,
+        'last_progress_at': time.time()
+    }
+
+def advance_ring_recording(recording: dict, metrics: MetricsRecorder) -> bool:
+    """
+    Дописывает в файл кадры, уже появившиеся в кольцевом буфере.
+    :return: True, если запись завершена (дошли до end_timestamp или поток кадров остановился).
+    """
+
+    frame_ring = recording['frame_ring']
+    end_timestamp = recording['task']['end_timestamp']
+    frame_size = tuple(recording['task']['frame_size'])
+
+    for _ in range(RING_FRAMES_PER_ITERATION):
+        next_seq = recording['next_seq']
+        if next_seq > frame_ring.latest_seq:
+            return time.time() - recording['last_progress_at'] > RING_RECORDING_STALL_TIMEOUT_S
+
+        if next_seq < frame_ring.oldest_seq or not frame_ring.is_valid(next_seq):
+            recording['frames_lost'] += frame_ring.oldest_seq - next_seq
+            recording['next_seq'] = frame_ring.oldest_seq
+            continue
+
+        frame_timestamp = frame_ring.timestamp(next_seq)
+        if frame_timestamp is None:
+            continue
+        if frame_timestamp > end_timestamp:
+            return True
+
+        frame_np = frame_ring.slot_view(next_seq)
+        if frame_np is not None:
+            if (frame_np.shape[1], frame_np.shape[0]) != frame_size:
+                frame_np = cv2.resize(frame_np, frame_size)
+            with metrics.timed('encode'):
+                recording['out'].write(frame_np)
+            metrics.count('frames_encoded')
+            if not frame_ring.is_valid(next_seq):
+                video_writer_logger.warning(f'Frame {next_seq} was overwritten while being written to {recording['task']['video_filepath']}')
+            recording['frames_written'] += 1
+        recording['next_seq'] = next_seq + 1
+        recording['last_progress_at'] = time.time()
+    return False
+
+def write_frames_task(video_task: dict, fourcc, metrics: MetricsRecorder) -> bool:
+    """
+    Записывает видео из кадров, переданных прямо в задаче:
+    несжатых (frames_data) или закодированных в JPEG (encoded_frames, frame_encoding='jpeg').
+    """
+
+    filepath = video_task.get('video_filepath')
+    frames_data = video_task.get('frames_data') or video_task.get('encoded_frames')
+    is_encoded = video_task.get('frame_encoding') == 'jpeg'
+    frame_size = video_task.get('frame_size')
+    fps = video_task.get('fps')
+
+    if not frames_data:
+        video_writer_logger.warning(f'No frames to write for video: {filepath}. Skipping')
+        return False
+
+    video_writer_logger.info(f'Starting to write video: {filepath}, Size: {frame_size}, FPS: {fps}, Frames: {len(frames_data)}')
+    out = cv2.VideoWriter(filepath, fourcc, float(fps), frame_size)
+
+    if not out.isOpened():
+        video_writer_logger.error(f'Failed to open VideoWriter for: {filepath}. Skipping')
+        return False
+
+    try:
+        for frame_np, _ in frames_data:
+            if is_encoded:
+                with metrics.timed('jpeg_decode'):
+                    frame_np = cv2.imdecode(np.frombuffer(frame_np, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame_np is not None:
+                if (frame_np.shape[1], frame_np.shape[0]) != frame_size:
+                    frame_np = cv2.resize(frame_np, frame_size)
+                with metrics.timed('encode'):
+                    out.write(frame_np)
+                metrics.count('frames_encoded')
+            else:
+                video_writer_logger.warning(f'Encountered a None frame for video {filepath}, skipping frame')
+    finally:
+        out.release()
+    return True
+
+def remove_failed_video(filepath: str | None):
+    if filepath and os.path.exists(filepath):
+        try:
+            os.remove(filepath)
+            video_writer_logger.info(f'Remove partially written/failed video file: {filepath}')
+        except Exception as e_remove:
+            video_writer_logger.error(f'Failed to remove video file {filepath} after error: {e_remove}')
+
+def finish_video(SessionLocal, filepath: str, event_info_for_db: dict, metrics: MetricsRecorder):
+    video_writer_logger.info(f'Successfully wrote video: {filepath}')
+    metrics.count('videos_written')
+    if SessionLocal and filepath:
+        # Видео одного события может относиться к нескольким сигнализациям на одном треке
+        for alarm_db_id in event_info_for_db.get('alarm_db_ids') or [event_info_for_db.get('alarm_db_id')]:
+            with metrics.timed('db_commit'):
+                update_alarm_event_video_path(SessionLocal, filepath, {**event_info_for_db, 'alarm_db_id': alarm_db_id})
+    elif not SessionLocal:
+        video_writer_logger.warning(f'DB session not available. Cannot update AlarmEvent for video {filepath}')
+
 def video_writer_worker(
     db_uri: str,
     log_level: str,
     video_writer_queue_shared,
-    running_flag_shared
+    running_flag_shared,
+    metrics_shared=None
 ):
     setup_video_writer_logging(log_level)
     video_writer_logger.info('Video Writer worker started')
+    metrics = MetricsRecorder(metrics_shared, 'video_writer')
 
     engine = None
     SessionLocal = None
@@ -41,95 +223,62 @@ def video_writer_worker(
         return
 
     fourcc = cv2.VideoWriter.fourcc(*'mp4v')
+    frame_rings = {}
+    active_recordings = {}
     while running_flag_shared.value:
+        filepath = None
         try:
-            video_task = video_writer_queue_shared.get(timeout=1)
-            video_writer_logger.info(f'Received video task for: {video_task.get('video_filepath')}')
-
-            filepath = video_task.get('video_filepath')
-            frames_data = video_task.get('frames_data')
-            frame_size = video_task.get('frame_size')
-            fps = video_task.get('fps')
-            event_info_for_db = video_task.get('event_data')
-
-            if not all([filepath, frames_data, frame_size, fps, event_info_for_db]):
-                video_writer_logger.error(f'Incomplete video task received: {filepath if filepath else 'path_missing'}. Skipping')
-                continue
-
-            if not frames_data:
-                video_writer_logger.warning(f'No frames to write for video: {filepath}. Skipping')
-                continue
-
-            # video_dir = os.path.dirname(filepath)
-            video_writer_logger.info(f'Starting to write video: {filepath}, Size: {frame_size}, FPS: {fps}, Frames: {len(frames_data)}')
-            out = cv2.VideoWriter(filepath, fourcc, float(fps), frame_size)
-
-            if not out.isOpened():
-                video_writer_logger.error(f'Failed to open VideoWriter for: {filepath}. Skipping')
-                continue
-
-            for frame_np, _ in frames_data:
-                if frame_np is not None:
-                    if (frame_np.shape[1], frame_np.shape[0]) != frame_size:
-                        frame_np = cv2.resize(frame_np, frame_size)
-                    out.write(frame_np)
+            try:
+                video_task = video_writer_queue_shared.get(timeout=0.05 if active_recordings else 1)
+            except queue.Empty:
+                video_task = None
+                metrics.flush()
+
+            if video_task is not None:
+                filepath = video_task.get('video_filepath')
+                video_writer_logger.info(f'Received video task for: {filepath}')
+                frame_size = video_task.get('frame_size')
+                fps = video_task.get('fps')
+                event_info_for_db = video_task.get('event_data')
+                has_frames = video_task.get('frame_ring') or video_task.get('frames_data') or video_task.get('encoded_frames')
+
+                if not all([filepath, has_frames, frame_size, fps, event_info_for_db]):
+                    video_writer_logger.error(f'Incomplete video task received: {filepath if filepath else 'path_missing'}. Skipping')
+                elif video_task.get('frame_ring'):
+                    recording = start_ring_recording(video_task, frame_rings, fourcc)
+                    if recording is not None:
+                        active_recordings[filepath] = recording
                 else:
-                    video_writer_logger.warning(f'Encountered a None frame for video {filepath}, skipping frame')
-            out.release()
-            video_writer_logger.info(f'Successfully wrote video: {filepath}')
+                    with metrics.timed('video_write'):
+                        written = write_frames_task(video_task, fourcc, metrics)
+                    if written:
+                        finish_video(SessionLocal, filepath, event_info_for_db, metrics)
 
-            if SessionLocal and filepath:
-                db_session = SessionLocal()
+            for filepath, recording in list(active_recordings.items()):
                 try:
-                    from app.models import AlarmEvent
-
-                    alarm_db_id_from_event = event_info_for_db.get('alarm_db_id')
-                    event_type_from_event = event_info_for_db.get('type')
-                    event_timestamp_from_detector = event_info_for_db.get('timestamp')
-
-                    if alarm_db_id_from_event and event_type_from_event and event_timestamp_from_detector:
-                        dt_from_detector = datetime.fromtimestamp(event_timestamp_from_detector, tz=timezone.utc)
-                        time_window_for_even_match_seconds = 5
-
-                        target_alarm_event = db_session.query(AlarmEvent).filter(
-                            AlarmEvent.alarm_id == alarm_db_id_from_event,
-                            AlarmEvent.event_type == event_type_from_event,
-                            AlarmEvent.timestamp >= (dt_from_detector - timedelta(seconds=time_window_for_even_match_seconds)),
-                            AlarmEvent.timestamp <= (dt_from_detector + timedelta(seconds=time_window_for_even_match_seconds))
-                        ).order_by(AlarmEvent.timestamp.desc()).first()
-
-                        if target_alarm_event:
-                            relative_video_path = os.path.basename(filepath)
-                            target_alarm_event.video_path = relative_video_path
-                            db_session.commit()
-                            video_writer_logger.info(f'Updated AlarmEvent ID {target_alarm_event.id} with video_path: {relative_video_path}')
-                        else:
-                            video_writer_logger.warning(
-                                f'Could not find matching AlarmEvent for video {filepath}. '
-                                f'Criteria: alarm_id={alarm_db_id_from_event}, type={event_type_from_event}, '
-                                f'approx_ts={dt_from_detector.isoformat()}'
-                            )
-                    else:
-                        video_writer_logger.warning(f'Not enough info in event_data to update AlarmEvent for video {filepath}')
-                except Exception as e_db_update:
-                    video_writer_logger.error(f'Error updating AlarmEvent for video {filepath}: {e_db_update}', exc_info=True)
-                    db_session.rollback()
-                finally:
-                    db_session.close()
-            elif not SessionLocal:
-                video_writer_logger.warning(f'DB session not available. Cannot update AlarmEvent for video {filepath}')
-        except queue.Empty:
-            continue
+                    finished = advance_ring_recording(recording, metrics)
+                except Exception:
+                    recording['out'].release()
+                    del active_recordings[filepath]
+                    raise
+                if finished:
+                    recording['out'].release()
+                    del active_recordings[filepath]
+                    if recording['frames_lost']:
+                        video_writer_logger.warning(f'Video {filepath}: {recording['frames_lost']} frame(s) were overwritten in the ring before they could be written')
+                    if recording['frames_written'] == 0:
+                        video_writer_logger.warning(f'No frames were written for video: {filepath}. Removing')
+                        remove_failed_video(filepath)
+                        continue
+                    finish_video(SessionLocal, filepath, recording['task']['event_data'], metrics)
         except Exception as e:
             video_writer_logger.error(f'Error in Video Writer worker: {e}', exc_info=True)
-            if 'out' in locals() and out.isOpened():
-                out.release()
-            if 'filepath' in locals() and os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                    video_writer_logger.info(f'Remove partially written/failed video file: {filepath}')
-                except Exception as e_remove:
-                    video_writer_logger.error(f'Failed to remove video file {filepath} after error: {e_remove}')
+            remove_failed_video(filepath)
             time.sleep(1)
 
+    for filepath, recording in active_recordings.items():
+        recording['out'].release()
+        video_writer_logger.warning(f'Video Writer stopping: video {filepath} was cut short after {recording['frames_written']} frame(s)')
+    for frame_ring in frame_rings.values():
+        frame_ring.close()
     video_writer_logger.info('Video Writer worker stopped')
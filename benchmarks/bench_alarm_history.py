@@ -0,0 +1,141 @@
+"""
+Задержка и число SQL-запросов GET /api/alarms/history на большой истории в SQLite.
+Для сравнения тот же ответ собирается по-старому: отдельный запрос событий на каждую тревогу страницы.
+Проверяет, что число запросов эндпоинта не зависит от per_page, и сравнивает глубокую страницу
+по номеру (?page=, OFFSET + COUNT) и по курсору (?cursor=).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_alarm_history [--alarms 5000] [--events-per-alarm 20] [--per-page 10 25 50 100] [--deep-page 400]
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, insert
+from app import db
+from app.models import User, Alarm, AlarmEvent
+from app.pagination import encode_cursor
+from benchmarks.common import bench_app
+
+# Страница тревог и события страницы (+ COUNT в режиме ?page=)
+MAX_HISTORY_QUERIES = 3
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+def seed_history(user_id: int, alarms: int, events_per_alarm: int):
+    rng = random.Random(42)
+    started_at = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    alarm_rows = [{
+        'id': alarm_id,
+        'user_id': user_id,
+        'vehicle_track_id': rng.randint(1, 5000),
+        'camera_id': 'main',
+        'set_at': started_at + timedelta(hours=alarm_id),
+        'unset_at': started_at + timedelta(hours=alarm_id, minutes=30),
+        'is_active': False
+    } for alarm_id in range(1, alarms + 1)]
+    db.session.execute(insert(Alarm), alarm_rows)
+
+    event_rows = []
+    for alarm in alarm_rows:
+        for index in range(events_per_alarm):
+            event_type = 'disappearance' if index == events_per_alarm - 1 else 'movement'
+            event_rows.append({
+                'alarm_id': alarm['id'],
+                'event_type': event_type,
+                'timestamp': alarm['set_at'] + timedelta(seconds=index * 60),
+                'details_json': json.dumps({'distance_px': rng.randint(10, 400), 'time_seconds': 0.5})
+            })
+        if len(event_rows) >= 50_000:
+            db.session.execute(insert(AlarmEvent), event_rows)
+            event_rows = []
+    if event_rows:
+        db.session.execute(insert(AlarmEvent), event_rows)
+    db.session.commit()
+
+def legacy_history(user_id: int, per_page: int) -> list:
+    """Прежняя выборка: события каждой тревоги страницы отдельным запросом через alarm.events."""
+
+    page = Alarm.query.filter_by(user_id=user_id).order_by(Alarm.set_at.desc()).paginate(page=1, per_page=per_page, error_out=False)
+    return [[{
+        'event_id': alarm_event.id,
+        'event_type': alarm_event.event_type,
+        'timestamp': alarm_event.timestamp.isoformat(),
+        'details': alarm_event.details_json
+    } for alarm_event in alarm.events.order_by(AlarmEvent.timestamp.asc()).all()] for alarm in page.items]
+
+def measure(run, counter: QueryCounter, repeat: int) -> tuple:
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        counter.count = 0
+        started_at = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started_at)
+        queries = counter.count
+    return statistics.median(timings) * 1000, queries
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--alarms', type=int, default=5000)
+    parser.add_argument('--events-per-alarm', type=int, default=20)
+    parser.add_argument('--per-page', type=int, nargs='+', default=[10, 25, 50, 100])
+    parser.add_argument('--deep-page', type=int, default=400, help='Номер страницы (по 10 тревог) для сравнения ?page= и ?cursor=')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with bench_app() as app:
+        with app.app_context():
+            db.create_all()
+            user = User(username='history_bench')
+            user.set_password('history_bench')
+            db.session.add(user)
+            db.session.commit()
+
+            seeding_started_at = time.perf_counter()
+            seed_history(user.id, args.alarms, args.events_per_alarm)
+            print(f'Seeded {args.alarms} alarms with {args.alarms * args.events_per_alarm} events in {time.perf_counter() - seeding_started_at:.1f}s')
+
+            user_id = user.id
+            headers = {'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'}
+            counter = QueryCounter(db.engine)
+
+        client = app.test_client()
+        print(f'{'per_page':>8} {'endpoint, ms':>13} {'queries':>8} {'per-alarm, ms':>14} {'queries':>8}')
+        for per_page in args.per_page:
+            def request_history():
+                response = client.get(f'/api/alarms/history?per_page={per_page}', headers=headers)
+                assert response.status_code == 200, response.get_json()
+
+            endpoint_ms, endpoint_queries = measure(request_history, counter, args.repeat)
+            with app.app_context():
+                legacy_ms, legacy_queries = measure(lambda: legacy_history(user_id, per_page), counter, args.repeat)
+            print(f'{per_page:>8} {endpoint_ms:>13.2f} {endpoint_queries:>8} {legacy_ms:>14.2f} {legacy_queries:>8}')
+            assert endpoint_queries <= MAX_HISTORY_QUERIES, f'per_page={per_page}: {endpoint_queries} queries (> {MAX_HISTORY_QUERIES})'
+
+        deep_offset = (args.deep_page - 1) * 10
+        with app.app_context():
+            previous_alarm = Alarm.query.filter_by(user_id=user_id).order_by(Alarm.set_at.desc(), Alarm.id.desc()).offset(deep_offset - 1).first()
+        if args.deep_page > 1 and previous_alarm is not None:
+            deep_cursor = encode_cursor(previous_alarm.set_at, previous_alarm.id)
+            deep_variants = [
+                (f'?page={args.deep_page}', f'/api/alarms/history?per_page=10&page={args.deep_page}'),
+                ('?cursor=', f'/api/alarms/history?per_page=10&cursor={deep_cursor}')
+            ]
+            print(f'Page {args.deep_page} (alarms {deep_offset + 1}-{deep_offset + 10}):')
+            for name, url in deep_variants:
+                deep_ms, deep_queries = measure(lambda: client.get(url, headers=headers), counter, args.repeat)
+                print(f'{name:>14} {deep_ms:>8.2f} ms {deep_queries:>3} queries')
+
+if __name__ == '__main__':
+    main()
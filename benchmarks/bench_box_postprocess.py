@@ -0,0 +1,95 @@
+"""
+Микробенчмарк постобработки боксов в цикле детектора: поштучная обработка
+(boxes[i], .item() на каждое поле) против векторной (app.detection.postprocess).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_box_postprocess [--counts 1 10 30 60 120] [--repeat 200] [--device cpu]
+"""
+
+import argparse
+import time
+import numpy as np
+import torch
+from ultralytics.engine.results import Boxes
+from app.detection.postprocess import BOX_TRACK_ID, boxes_to_array, box_centroids, build_api_detections, match_alarmed_rows
+
+CLASS_MAP = {2: 'car', 3: 'motorcycle', 5: 'bus', 7: 'truck'}
+FRAME_SHAPE = (720, 1280)
+
+def make_boxes(count: int, device: str) -> Boxes:
+    rng = np.random.default_rng(count)
+    xy = rng.uniform(0, 1100, size=(count, 2))
+    wh = rng.uniform(40, 180, size=(count, 2))
+    data = np.column_stack([
+        xy, xy + wh,
+        np.arange(1, count + 1),
+        rng.uniform(0.5, 1.0, size=count),
+        rng.choice(list(CLASS_MAP.keys()), size=count)
+    ])
+    return Boxes(torch.as_tensor(data, dtype=torch.float32, device=device), FRAME_SHAPE)
+
+def per_box_path(boxes: Boxes, alarmed_track_ids: set):
+    """Прежняя реализация: индексирование boxes[i] и отдельный .item() на каждое поле."""
+
+    detections = []
+    alarmed_positions = {}
+    for i in range(len(boxes)):
+        box = boxes[i]
+        track_id = int(box.id.item())
+        cls_id = int(box.cls.item())
+        class_name = CLASS_MAP.get(cls_id, f'class_{cls_id}')
+        confidence = float(box.conf.item())
+        x1, y1, x2, y2 = map(float, box.xyxy[0])
+        detections.append({
+            'camera_id': 'main',
+            'name': class_name,
+            'class_id': cls_id,
+            'confidence': round(confidence, 3),
+            'track_id': track_id,
+            'box': {'x1': round(x1), 'y1': round(y1), 'x2': round(x2), 'y2': round(y2)}
+        })
+        if track_id in alarmed_track_ids:
+            alarmed_positions[track_id] = ((x1 + x2) / 2, (y1 + y2) / 2)
+    return detections, alarmed_positions
+
+def vectorized_path(boxes: Boxes, alarmed_track_ids: set):
+    box_array = boxes_to_array(boxes)
+    detections = build_api_detections(box_array, 'main', CLASS_MAP)
+    centroids = box_centroids(box_array)
+    alarmed_positions = {
+        int(box_array[row, BOX_TRACK_ID]): tuple(centroids[row].tolist())
+        for row in match_alarmed_rows(box_array, alarmed_track_ids).tolist()
+    }
+    return detections, alarmed_positions
+
+def measure(fn, boxes: Boxes, alarmed_track_ids: set, repeat: int) -> float:
+    fn(boxes, alarmed_track_ids)
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        fn(boxes, alarmed_track_ids)
+    return (time.perf_counter() - started_at) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 10, 30, 60, 120])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    print(f'{'boxes':>6} {'per-box, ms':>12} {'vectorized, ms':>15} {'speedup':>8}')
+    for count in args.counts:
+        boxes = make_boxes(count, args.device)
+        alarmed_track_ids = set(range(1, count + 1, 5))
+
+        legacy_detections, legacy_positions = per_box_path(boxes, alarmed_track_ids)
+        detections, positions = vectorized_path(boxes, alarmed_track_ids)
+        assert [d['track_id'] for d in detections] == [d['track_id'] for d in legacy_detections]
+        assert [d['box'] for d in detections] == [d['box'] for d in legacy_detections]
+        assert positions.keys() == legacy_positions.keys()
+
+        legacy_ms = measure(per_box_path, boxes, alarmed_track_ids, args.repeat)
+        vectorized_ms = measure(vectorized_path, boxes, alarmed_track_ids, args.repeat)
+        print(f'{count:>6} {legacy_ms:>12.3f} {vectorized_ms:>15.3f} {legacy_ms / vectorized_ms:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Сравнение декодеров видеопотока на пути до кадра для детекции (ширина до --target-width):
+cv2.VideoCapture + cv2.resize(INTER_AREA), как было в FrameGrabber, и PyAV с уменьшением при
+преобразовании цвета - однопоточно и с многопоточным декодером.
+CPU на кадр считается по времени процесса (все потоки), поэтому многопоточный декодер не выглядит бесплатным.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_decode camera_4k.mp4 [--frames 300] [--target-width 1280]
+"""
+
+import argparse
+import time
+import cv2
+from app.detection.decoders import PyAvCapture
+
+def decode_opencv(source: str, frames: int, target_width: int) -> int:
+    cap = cv2.VideoCapture(source)
+    decoded = 0
+    while decoded < frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        height, width = frame.shape[:2]
+        if width > target_width:
+            cv2.resize(frame, (target_width, int(height * target_width / width)), interpolation=cv2.INTER_AREA)
+        decoded += 1
+    cap.release()
+    return decoded
+
+def decode_pyav(source: str, frames: int, target_width: int, threads: int) -> int:
+    cap = PyAvCapture(source, target_width, threads)
+    decoded = 0
+    while decoded < frames:
+        ret, _ = cap.read()
+        if not ret:
+            break
+        decoded += 1
+    cap.release()
+    return decoded
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Видеофайл или URL потока')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--target-width', type=int, default=1280, help='Ширина кадра для детекции (как target_detection_width в детекторе)')
+    parser.add_argument('--repeat', type=int, default=3, help='Повторы; берётся лучший результат')
+    args = parser.parse_args()
+
+    variants = [
+        ('opencv + resize', lambda: decode_opencv(args.source, args.frames, args.target_width)),
+        ('pyav, 1 thread', lambda: decode_pyav(args.source, args.frames, args.target_width, 1)),
+        ('pyav, threaded', lambda: decode_pyav(args.source, args.frames, args.target_width, 0))
+    ]
+
+    cap = cv2.VideoCapture(args.source)
+    source_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+    print(f'Source {source_size[0]}x{source_size[1]}, target width {args.target_width}, {cv2.getNumberOfCPUs()} CPU(s)')
+
+    print(f'{'decoder':<18} {'frames':>7} {'CPU ms/frame':>13} {'wall ms/frame':>14} {'FPS':>7}')
+    baseline_cpu = None
+    for name, run in variants:
+        best = None
+        for _ in range(args.repeat):
+            cpu_started_at = time.process_time()
+            wall_started_at = time.perf_counter()
+            decoded = run()
+            cpu_s = time.process_time() - cpu_started_at
+            wall_s = time.perf_counter() - wall_started_at
+            if decoded and (best is None or cpu_s < best[1]):
+                best = (decoded, cpu_s, wall_s)
+        if best is None:
+            print(f'{name:<18} no frames decoded')
+            continue
+        decoded, cpu_s, wall_s = best
+        cpu_ms = cpu_s / decoded * 1000
+        baseline_cpu = baseline_cpu or cpu_ms
+        print(f'{name:<18} {decoded:>7} {cpu_ms:>13.2f} {wall_s / decoded * 1000:>14.2f} {decoded / wall_s:>7.1f}'
+              f'{f'  ({cpu_ms / baseline_cpu:.2f}x CPU)' if cpu_ms != baseline_cpu else ''}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Пропускная способность event_processor_worker на накопившейся очереди событий (SQLite).
+Сравнивает EVENT_BATCH_MAX_SIZE=1 (транзакция на событие, как раньше) с пачками.
+У пользователей нет telegram_chat_id, поэтому замер не ходит в сеть.
+Проверяет, что все события записаны и что при пачках транзакций меньше, чем событий.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_event_processor [--events 5000] [--alarms 50] [--batch-sizes 1 25 100]
+"""
+
+import argparse
+import random
+import threading
+import time
+from multiprocessing import Manager
+from types import SimpleNamespace
+from sqlalchemy import delete, insert
+from app import db
+from app.event_processor import event_processor_worker
+from app.models import User, Alarm, AlarmEvent
+from benchmarks.common import bench_app
+
+def make_events(alarms: list, count: int) -> list:
+    rng = random.Random(42)
+    events = []
+    for _ in range(count):
+        alarm_id, user_id, track_id = rng.choice(alarms)
+        events.append({
+            'type': 'movement',
+            'alarm_db_id': alarm_id,
+            'user_id': user_id,
+            'track_id': track_id,
+            'camera_id': 'main',
+            'timestamp': time.time(),
+            'details': {'distance_px': rng.randint(10, 400), 'time_seconds': 0.5}
+        })
+    return events
+
+def run_backlog(app, event_queue, events: list) -> tuple:
+    """:return: (секунды на всю очередь, счётчики метрик обработчика)."""
+
+    for event_data in events:
+        event_queue.put(event_data)
+
+    running_flag = SimpleNamespace(value=True)
+    metrics_shared = {}
+    worker = threading.Thread(target=event_processor_worker, args=(app, event_queue, None, running_flag, metrics_shared), daemon=True)
+    started_at = time.perf_counter()
+    worker.start()
+    with app.app_context():
+        while AlarmEvent.query.count() < len(events):
+            time.sleep(0.01)
+    elapsed_s = time.perf_counter() - started_at
+    running_flag.value = False
+    worker.join(timeout=5)
+    return elapsed_s, metrics_shared['event_processor']['counters']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--alarms', type=int, default=50)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 25, 100])
+    args = parser.parse_args()
+
+    with bench_app() as app:
+        with app.app_context():
+            db.create_all()
+            user = User(username='event_bench')
+            db.session.add(user)
+            db.session.commit()
+            alarm_rows = [{'id': alarm_id, 'user_id': user.id, 'vehicle_track_id': alarm_id, 'camera_id': 'main', 'is_active': True} for alarm_id in range(1, args.alarms + 1)]
+            db.session.execute(insert(Alarm), alarm_rows)
+            db.session.commit()
+            alarms = [(row['id'], user.id, row['vehicle_track_id']) for row in alarm_rows]
+
+        events = make_events(alarms, args.events)
+        with Manager() as manager:
+            event_queue = manager.Queue()
+            print(f'{'batch size':>10} {'events/s':>10} {'batches':>8} {'avg batch':>10}')
+            for batch_size in args.batch_sizes:
+                app.config['EVENT_BATCH_MAX_SIZE'] = batch_size
+                elapsed_s, counters = run_backlog(app, event_queue, events)
+                batches = counters['event_batches']
+                print(f'{batch_size:>10} {args.events / elapsed_s:>10.0f} {batches:>8} {counters['events_received'] / batches:>10.1f}')
+
+                assert counters['events_stored'] == args.events, f'batch size {batch_size}: stored {counters['events_stored']} of {args.events} events'
+                assert batch_size == 1 or batches < args.events, f'batch size {batch_size}: {batches} batches for {args.events} events'
+
+                with app.app_context():
+                    db.session.execute(delete(AlarmEvent))
+                    db.session.commit()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Планы (EXPLAIN) и задержки горячих запросов к alarms/alarm_events на большой истории.
+Схема создаётся из моделей (db.create_all), поэтому одинаково разворачивается в SQLite и PostgreSQL.
+Каждый запрос выполняется дважды: с составными индексами моделей и с прежними одноколоночными
+(ix_alarms_user_id, ix_alarm_events_alarm_id). Проверяет, что с составными индексами в SQLite
+ни один запрос не читает таблицу целиком.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_hot_queries [--users 50] [--alarms 100000] [--events-per-alarm 20] [--database-url URL]
+
+По умолчанию - временный файл SQLite. Для PostgreSQL передайте URL пустой базы
+(нужен драйвер, например psycopg2); таблицы удаляются по завершении.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, insert, text
+from app import db
+from app.models import User, Alarm, AlarmEvent
+from app.pagination import encode_cursor, keyset_before
+from benchmarks.common import bench_app
+
+ACTIVE_ALARM_SHARE = 0.01
+
+# Прежние индексы, которые заменили составные
+SINGLE_COLUMN_INDEXES = {
+    'ix_alarms_user_id': ('alarms', 'user_id'),
+    'ix_alarm_events_alarm_id': ('alarm_events', 'alarm_id')
+}
+
+COMPOSITE_INDEXES = [index for model in (Alarm, AlarmEvent) for index in model.__table__.indexes if len(index.columns) > 1]
+
+class StatementRecorder:
+    """Запоминает последний SQL, отправленный в БД, чтобы получить EXPLAIN ровно того запроса, что строит ORM."""
+
+    def __init__(self, engine):
+        self.statement = None
+        self.parameters = None
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith('EXPLAIN'):
+            self.statement = statement
+            self.parameters = parameters
+
+def seed(users: int, alarms: int, events_per_alarm: int) -> list:
+    """:return: id созданных пользователей."""
+
+    rng = random.Random(42)
+    user_rows = [{'id': user_id, 'username': f'hot_queries_{user_id}', 'password_hash': None} for user_id in range(1, users + 1)]
+    db.session.execute(insert(User), user_rows)
+
+    started_at = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    event_rows = []
+    alarm_rows = []
+    for alarm_id in range(1, alarms + 1):
+        set_at = started_at + timedelta(minutes=alarm_id)
+        is_active = rng.random() < ACTIVE_ALARM_SHARE
+        alarm_rows.append({
+            'id': alarm_id,
+            'user_id': rng.randint(1, users),
+            'vehicle_track_id': rng.randint(1, 5000),
+            'camera_id': rng.choice(('main', 'gate', 'yard')),
+            'set_at': set_at,
+            'unset_at': None if is_active else set_at + timedelta(minutes=30),
+            'is_active': is_active
+        })
+        for index in range(events_per_alarm):
+            event_rows.append({
+                'alarm_id': alarm_id,
+                'event_type': 'disappearance' if index == events_per_alarm - 1 else 'movement',
+                'timestamp': set_at + timedelta(seconds=index * 5),
+                'details_json': json.dumps({'distance_px': rng.randint(10, 400), 'time_seconds': 0.5})
+            })
+        if len(event_rows) >= 100_000:
+            db.session.execute(insert(Alarm), alarm_rows)
+            db.session.execute(insert(AlarmEvent), event_rows)
+            alarm_rows = []
+            event_rows = []
+    if alarm_rows:
+        db.session.execute(insert(Alarm), alarm_rows)
+    if event_rows:
+        db.session.execute(insert(AlarmEvent), event_rows)
+    db.session.commit()
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+    return [row['id'] for row in user_rows]
+
+def hot_queries(user_id: int, alarm: Alarm) -> dict:
+    """Запросы в том виде, в каком их строят маршруты API, бот, обработчик событий и video_writer_worker."""
+
+    middle_event_at = alarm.set_at + timedelta(seconds=30)
+    page_cursor = encode_cursor(alarm.set_at, alarm.id)
+    return {
+        'active alarms of user': lambda: Alarm.query.filter_by(user_id=user_id, is_active=True).all(),
+        'active alarm for track': lambda: Alarm.query.filter_by(
+            user_id=user_id,
+            camera_id=alarm.camera_id,
+            vehicle_track_id=alarm.vehicle_track_id,
+            is_active=True
+        ).first(),
+        'history page (cursor)': lambda: Alarm.query.filter_by(user_id=user_id)
+            .filter(keyset_before(Alarm.set_at, Alarm.id, page_cursor))
+            .order_by(Alarm.set_at.desc(), Alarm.id.desc())
+            .limit(11)
+            .all(),
+        'history page events': lambda: db.session.query(AlarmEvent.alarm_id, AlarmEvent.id, AlarmEvent.event_type, AlarmEvent.timestamp, AlarmEvent.details_json)
+            .filter(AlarmEvent.alarm_id.in_(range(alarm.id, alarm.id + 10)))
+            .order_by(AlarmEvent.alarm_id, AlarmEvent.timestamp.asc(), AlarmEvent.id.asc())
+            .all(),
+        'telegram history': lambda: db.session.query(AlarmEvent)
+            .join(AlarmEvent.alarm)
+            .filter(Alarm.user_id == user_id)
+            .order_by(AlarmEvent.timestamp.desc(), AlarmEvent.id.desc())
+            .limit(6)
+            .all(),
+        'video event match': lambda: db.session.query(AlarmEvent).filter(
+            AlarmEvent.alarm_id == alarm.id,
+            AlarmEvent.event_type == 'movement',
+            AlarmEvent.timestamp >= middle_event_at - timedelta(seconds=5),
+            AlarmEvent.timestamp <= middle_event_at + timedelta(seconds=5)
+        ).order_by(AlarmEvent.timestamp.desc()).first()
+    }
+
+def explain(recorder: StatementRecorder) -> list:
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {recorder.statement}', recorder.parameters).all()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql(f'EXPLAIN {recorder.statement}', recorder.parameters).all()
+    return [row[0] for row in rows]
+
+def measure(queries: dict, recorder: StatementRecorder, repeat: int) -> dict:
+    """:return: Словарь {название: (медиана в мс, строки плана)}."""
+
+    results = {}
+    for name, run in queries.items():
+        run()
+        plan = explain(recorder)
+        timings = []
+        for _ in range(repeat):
+            db.session.expunge_all()
+            started_at = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started_at)
+        results[name] = (statistics.median(timings) * 1000, plan)
+    return results
+
+def use_single_column_indexes():
+    for index in COMPOSITE_INDEXES:
+        db.session.execute(text(f'DROP INDEX {index.name}'))
+    for name, (table, column) in SINGLE_COLUMN_INDEXES.items():
+        db.session.execute(text(f'CREATE INDEX {name} ON {table} ({column})'))
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--alarms', type=int, default=100_000)
+    parser.add_argument('--events-per-alarm', type=int, default=20)
+    parser.add_argument('--database-url', help='URL пустой базы (по умолчанию - временный файл SQLite)')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with bench_app(args.database_url) as app:
+        with app.app_context():
+            db.create_all()
+            dialect = db.engine.dialect.name
+
+            seeding_started_at = time.perf_counter()
+            user_ids = seed(args.users, args.alarms, args.events_per_alarm)
+            print(f'[{dialect}] Seeded {args.users} users, {args.alarms} alarms, {args.alarms * args.events_per_alarm} events in {time.perf_counter() - seeding_started_at:.1f}s')
+
+            user_id = user_ids[0]
+            alarm = Alarm.query.filter_by(user_id=user_id)\
+                .order_by(Alarm.set_at.desc())\
+                .offset(Alarm.query.filter_by(user_id=user_id).count() // 2)\
+                .first()
+            queries = hot_queries(user_id, alarm)
+            recorder = StatementRecorder(db.engine)
+
+            composite = measure(queries, recorder, args.repeat)
+            use_single_column_indexes()
+            single_column = measure(queries, recorder, args.repeat)
+
+            print(f'{'query':<24} {'composite, ms':>14} {'single-column, ms':>18}')
+            for name in queries:
+                print(f'{name:<24} {composite[name][0]:>14.3f} {single_column[name][0]:>18.3f}')
+
+            for title, results in (('composite indexes', composite), ('single-column indexes', single_column)):
+                print(f'\nEXPLAIN, {title}:')
+                for name, (_, plan) in results.items():
+                    print(f'  {name}:')
+                    for line in plan:
+                        print(f'    {line}')
+
+            if dialect == 'sqlite':
+                for name, (_, plan) in composite.items():
+                    full_scans = [line for line in plan if line.startswith('SCAN') and 'USING' not in line]
+                    assert not full_scans, f'{name}: full table scan with composite indexes: {full_scans}'
+
+            if args.database_url is not None:
+                db.session.remove()
+                db.drop_all()
+
+if __name__ == '__main__':
+    main()
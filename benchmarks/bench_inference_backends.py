@@ -0,0 +1,108 @@
+"""
+Сравнение бэкендов инференса (PyTorch, ONNX Runtime, OpenVINO, их INT8-варианты) на кадрах камеры:
+FPS и отклонение mAP относительно PyTorch (детекции PyTorch принимаются за эталон).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_inference_backends --frames-source instance/event_videos \\
+        [--model yolo11m.pt] [--backends torch onnx onnx-int8 openvino openvino-int8] [--frames 100]
+
+Размер входа по умолчанию берётся из YOLO_IMG_HEIGHT/YOLO_IMG_WIDTH (app/config.py).
+"""
+
+import argparse
+import time
+import numpy as np
+from ultralytics.utils.metrics import ap_per_class, box_iou
+import torch
+from app.config import Config
+from app.detection.backends import collect_calibration_frames, load_detection_model
+
+VEHICLE_CLASSES = [2, 3, 7]
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+def match_predictions(pred_boxes, pred_classes, pred_conf, true_boxes, true_classes) -> np.ndarray:
+    """Жадное сопоставление предсказаний с эталоном по убыванию уверенности; :return: tp (N, 10)."""
+
+    tp = np.zeros((len(pred_boxes), len(IOU_THRESHOLDS)), dtype=bool)
+    if not len(pred_boxes) or not len(true_boxes):
+        return tp
+    iou = box_iou(torch.as_tensor(pred_boxes), torch.as_tensor(true_boxes)).numpy()
+    iou[pred_classes[:, None] != true_classes[None, :]] = 0.0
+    order = np.argsort(-pred_conf)
+    for t, threshold in enumerate(IOU_THRESHOLDS):
+        matched = set()
+        for i in order:
+            candidates = [j for j in np.argsort(-iou[i]) if iou[i, j] >= threshold and j not in matched]
+            if candidates:
+                matched.add(candidates[0])
+                tp[i, t] = True
+    return tp
+
+def run_backend(model, overrides: dict, frames: list, imgsz: tuple, conf: float, iou: float, classes: list | None) -> tuple:
+    # Прогрев
+    model.predict(frames[0], imgsz=imgsz, conf=conf, iou=iou, classes=classes, verbose=False, **overrides)
+    predictions = []
+    started_at = time.perf_counter()
+    for frame in frames:
+        result = model.predict(frame, imgsz=imgsz, conf=conf, iou=iou, classes=classes, verbose=False, **overrides)[0]
+        data = result.boxes.data.cpu().numpy()
+        predictions.append((data[:, :4], data[:, 5].astype(int), data[:, 4]))
+    return len(frames) / (time.perf_counter() - started_at), predictions
+
+def map_against_reference(predictions: list, reference: list, reference_conf: float) -> tuple:
+    stats = []
+    for (boxes, classes, confidences), (ref_boxes, ref_classes, ref_confidences) in zip(predictions, reference):
+        keep = ref_confidences >= reference_conf
+        tp = match_predictions(boxes, classes, confidences, ref_boxes[keep], ref_classes[keep])
+        stats.append((tp, confidences, classes, ref_classes[keep]))
+    if not stats or not sum(len(s[3]) for s in stats):
+        return float('nan'), float('nan')
+    tp, conf, pred_cls, target_cls = (np.concatenate(parts) for parts in zip(*stats))
+    ap = ap_per_class(tp, conf, pred_cls, target_cls)[5]
+    return float(ap[:, 0].mean()), float(ap.mean())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=Config.YOLO_MODEL_PATH)
+    parser.add_argument('--frames-source', default=Config.INFERENCE_CALIBRATION_SOURCE, help='Каталог с кадрами/видео камеры или видеофайл')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'onnx-int8', 'openvino', 'openvino-int8'])
+    parser.add_argument('--imgsz', type=int, nargs=2, default=[Config.YOLO_IMG_HEIGHT, Config.YOLO_IMG_WIDTH], metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--conf', type=float, default=0.001, help='Порог для подсчёта mAP (низкий, как при валидации)')
+    parser.add_argument('--reference-conf', type=float, default=Config.YOLO_CONF_THRESH, help='Порог эталонных детекций PyTorch')
+    parser.add_argument('--classes', type=int, nargs='*', default=VEHICLE_CLASSES, help='Классы COCO; без значений - все классы')
+    parser.add_argument('--calibration-frames', type=int, default=Config.INFERENCE_CALIBRATION_FRAMES)
+    args = parser.parse_args()
+
+    imgsz = tuple(args.imgsz)
+    frames = collect_calibration_frames(args.frames_source, args.frames)
+    print(f'{len(frames)} frame(s) from {args.frames_source}, imgsz={imgsz}')
+
+    reference = None
+    rows = []
+    for backend_name in ['torch'] + [name for name in args.backends if name != 'torch']:
+        backend, _, variant = backend_name.partition('-')
+        model, overrides = load_detection_model(
+            args.model,
+            backend,
+            imgsz,
+            int8=variant == 'int8',
+            calibration_source=args.frames_source,
+            calibration_frames=args.calibration_frames
+        )
+        fps, predictions = run_backend(model, overrides, frames, imgsz, args.conf, 0.7, args.classes or None)
+        if reference is None:
+            reference = predictions
+        map50, map50_95 = map_against_reference(predictions, reference, args.reference_conf)
+        if backend_name == 'torch' and 'torch' not in args.backends:
+            continue
+        rows.append((backend_name, fps, map50, map50_95))
+
+    torch_fps = next((fps for name, fps, _, _ in rows if name == 'torch'), None)
+    print(f'{'backend':<15} {'FPS':>7} {'speedup':>8} {'mAP50 vs torch':>15} {'mAP50-95 vs torch':>18}')
+    for name, fps, map50, map50_95 in rows:
+        speedup = f'{fps / torch_fps:.2f}x' if torch_fps else '-'
+        print(f'{name:<15} {fps:>7.1f} {speedup:>8} {map50:>15.3f} {map50_95:>18.3f}')
+
+if __name__ == '__main__':
+    main()
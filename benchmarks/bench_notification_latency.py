@@ -0,0 +1,121 @@
+"""
+Задержка событие -> уведомление и запись событий при медленном Telegram (локальная замена API, SQLite).
+События приходят равномерно; каждое - движение своей машины с уведомлением в свой чат.
+Сравнивает синхронную отправку из обработчика событий с TelegramNotificationDispatcher.
+Проверяет, что с диспетчером доставлены все уведомления, а события записываются, не дожидаясь Telegram.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_notification_latency [--events 200] [--rate 20] [--delay-ms 100] [--slow-share 0.05] [--slow-ms 3000]
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from multiprocessing import Manager
+from types import SimpleNamespace
+from sqlalchemy import insert
+from app import db
+from app.event_processor import event_processor_worker
+from app.models import User, Alarm, AlarmEvent
+from app.notification_dispatcher import TelegramNotificationDispatcher
+from benchmarks.common import bench_app
+from benchmarks.telegram_stub import TelegramStub
+
+def seed_alarms(first_id: int, count: int) -> list:
+    """:return: Список (alarm_id, user_id, chat_id); у каждой тревоги свой пользователь и чат."""
+
+    rows = [(first_id + index, first_id + index, f'chat-{first_id + index}') for index in range(count)]
+    db.session.execute(insert(User), [{'id': user_id, 'username': f'notify_bench_{user_id}', 'telegram_chat_id': chat_id} for _, user_id, chat_id in rows])
+    db.session.execute(insert(Alarm), [{'id': alarm_id, 'user_id': user_id, 'vehicle_track_id': alarm_id, 'camera_id': 'main', 'is_active': True} for alarm_id, user_id, _ in rows])
+    db.session.commit()
+    return rows
+
+def percentile(values: list, share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+def run_scenario(app, event_queue, stub: TelegramStub, alarms: list, rate: float, dispatcher) -> dict:
+    running_flag = SimpleNamespace(value=True)
+    worker = threading.Thread(target=event_processor_worker, args=(app, event_queue, None, running_flag, None, None, dispatcher), daemon=True)
+    worker.start()
+
+    messages_before = len(stub.messages)
+    connections_before = stub.connections
+    with app.app_context():
+        events_before = AlarmEvent.query.count()
+    event_times = {}
+    started_at = time.time()
+    for index, (alarm_id, user_id, chat_id) in enumerate(alarms):
+        delay_s = started_at + index / rate - time.time()
+        if delay_s > 0:
+            time.sleep(delay_s)
+        event_times[chat_id] = time.time()
+        event_queue.put({
+            'type': 'movement',
+            'alarm_db_id': alarm_id,
+            'user_id': user_id,
+            'track_id': alarm_id,
+            'camera_id': 'main',
+            'timestamp': event_times[chat_id],
+            'details': {'distance_px': 120, 'time_seconds': 0.5}
+        })
+    last_event_at = time.time()
+
+    with app.app_context():
+        while AlarmEvent.query.count() < events_before + len(alarms):
+            time.sleep(0.01)
+    events_stored_lag_s = time.time() - last_event_at
+
+    deadline = time.time() + 60
+    while len(stub.messages) < messages_before + len(alarms) and time.time() < deadline:
+        time.sleep(0.01)
+    running_flag.value = False
+    worker.join(timeout=15)
+
+    latencies = [received_at - event_times[chat_id] for received_at, chat_id, _ in stub.messages[messages_before:] if chat_id in event_times]
+    return {'delivered': len(latencies), 'stored_lag_s': events_stored_lag_s, 'latencies': latencies, 'connections': stub.connections - connections_before}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=20, help='Событий в секунду')
+    parser.add_argument('--delay-ms', type=float, default=100, help='Обычное время ответа Telegram')
+    parser.add_argument('--slow-share', type=float, default=0.05, help='Доля медленных ответов')
+    parser.add_argument('--slow-ms', type=float, default=3000, help='Время медленного ответа')
+    parser.add_argument('--rate-limit-share', type=float, default=0.02, help='Доля ответов 429 (retry_after=1)')
+    args = parser.parse_args()
+
+    stub = TelegramStub(delay_s=args.delay_ms / 1000, slow_share=args.slow_share, slow_delay_s=args.slow_ms / 1000, rate_limit_share=args.rate_limit_share)
+    stub.start()
+
+    try:
+        with bench_app(TELEGRAM_BOT_TOKEN='bench', TELEGRAM_API_BASE_URL=stub.base_url, NOTIFICATION_RETRY_BACKOFF_S=0.2) as app:
+            with app.app_context():
+                db.create_all()
+                sync_alarms = seed_alarms(1, args.events)
+                dispatcher_alarms = seed_alarms(args.events + 1, args.events)
+
+            with Manager() as manager:
+                event_queue = manager.Queue()
+                print(f'{'mode':>10} {'delivered':>10} {'stored lag, s':>14} {'p50, ms':>9} {'p95, ms':>9} {'max, ms':>9} {'connections':>12}')
+                results = {}
+                for mode, alarms in (('sync', sync_alarms), ('dispatcher', dispatcher_alarms)):
+                    dispatcher = None
+                    if mode == 'dispatcher':
+                        dispatcher = TelegramNotificationDispatcher(app)
+                        dispatcher.start()
+                    results[mode] = result = run_scenario(app, event_queue, stub, alarms, args.rate, dispatcher)
+                    if dispatcher is not None:
+                        dispatcher.stop()
+                    latencies_ms = [latency * 1000 for latency in result['latencies']] or [0.0]
+                    print(f'{mode:>10} {result['delivered']:>10} {result['stored_lag_s']:>14.2f} {statistics.median(latencies_ms):>9.0f} {percentile(latencies_ms, 0.95):>9.0f} {max(latencies_ms):>9.0f} {result['connections']:>12}')
+                print(f'Stub: {stub.requests} request(s), {stub.rate_limited} rate limited')
+
+                assert results['dispatcher']['delivered'] == args.events, f'dispatcher delivered {results['dispatcher']['delivered']} of {args.events} notifications'
+                assert results['dispatcher']['stored_lag_s'] < 1.0, f'events stored {results['dispatcher']['stored_lag_s']:.2f}s after the last one with the dispatcher'
+    finally:
+        stub.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Общие заготовки бенчмарков.
+"""
+
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from app import create_app
+from app.alarm_registry import AlarmRegistry
+from app.config import Config
+
+class LocalValue:
+    """Замена Manager.Value внутри одного процесса."""
+
+    def __init__(self, value):
+        self.value = value
+
+def make_local_registry() -> AlarmRegistry:
+    # Те же операции, что и у прокси Manager, но без отдельного процесса, чтобы мерить только детектор
+    return AlarmRegistry({}, LocalValue(0), threading.Lock())
+
+@contextmanager
+def bench_app(database_url: str | None = None, **overrides):
+    """
+    Приложение для бенчмарка. Без database_url база - временный файл SQLite, который удаляется на выходе.
+    :param overrides: Дополнительные атрибуты конфигурации (например, TELEGRAM_BOT_TOKEN).
+    :return: Flask-приложение; таблицы создаёт сам бенчмарк.
+    """
+
+    db_path = None
+    if database_url is None:
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+        database_url = f'sqlite:///{db_path}'
+
+    class BenchConfig(Config):
+        TESTING = True
+        LOG_LEVEL = 'WARNING'
+        SQLALCHEMY_DATABASE_URI = database_url
+        SQLALCHEMY_ECHO = False
+
+    for name, value in overrides.items():
+        setattr(BenchConfig, name, value)
+
+    try:
+        yield create_app(BenchConfig)
+    finally:
+        if db_path is not None:
+            os.remove(db_path)
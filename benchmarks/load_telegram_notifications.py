@@ -0,0 +1,130 @@
+"""
+Нагрузочный тест TelegramNotificationDispatcher против локальной замены Telegram API,
+которая, как Telegram, отвечает 429 при превышении 1 сообщения в секунду на чат и 30 в секунду всего.
+Уведомления приходят потоком в случайные чаты (часть чатов «горячие»). Сравнивает диспетчер
+с ведрами токенов и сводками с тем же диспетчером без ограничения частоты.
+Проверяет, что с ограничением все уведомления доставлены (в том числе в сводках) и лимиты не нарушены.
+
+Запуск из корня проекта:
+    python -m benchmarks.load_telegram_notifications [--chats 100] [--rate 200] [--duration 10] [--delay-ms 50]
+"""
+
+import argparse
+import bisect
+import random
+import threading
+import time
+from collections import Counter
+from flask import Flask
+from app.config import Config
+from app.metrics import LATENCY_BUCKETS_S
+from app.notification_dispatcher import TelegramNotificationDispatcher
+from benchmarks.telegram_stub import TelegramStub
+
+TELEGRAM_CHAT_RATE_PER_S = 1
+TELEGRAM_GLOBAL_RATE_PER_S = 30
+
+def produce(dispatcher: TelegramNotificationDispatcher, chats: int, rate: float, duration_s: float, seed: int = 42) -> int:
+    """:return: Число поставленных уведомлений."""
+
+    rng = random.Random(seed)
+    hot_chats = max(1, chats // 10)
+    enqueued = 0
+    started_at = time.time()
+    index = 0
+    while time.time() - started_at < duration_s:
+        delay_s = started_at + index / rate - time.time()
+        if delay_s > 0:
+            time.sleep(delay_s)
+        # Половина уведомлений - в десятую часть чатов
+        chat = rng.randrange(hot_chats) if rng.random() < 0.5 else rng.randrange(chats)
+        event_type = 'movement' if rng.random() < 0.8 else 'disappearance'
+        summary = f'Машина (камера: main, трек ID: {index}, ID сигнализации: {index}) {'начала движение' if event_type == 'movement' else 'пропала из виду'}'
+        if dispatcher.enqueue(f'chat-{chat}', summary, alarm_id=index, event_timestamp=time.time(), event_type=event_type, summary=summary):
+            enqueued += 1
+        index += 1
+    return enqueued
+
+def peak_per_second(timestamps: list) -> int:
+    timestamps = sorted(timestamps)
+    return max((bisect.bisect_left(timestamps, timestamp + 1.0) - position for position, timestamp in enumerate(timestamps)), default=0)
+
+def histogram_quantile(histogram: dict, share: float) -> float:
+    """:return: Верхняя граница корзины гистограммы MetricsRecorder, в которую попадает квантиль."""
+
+    target = share * histogram['count']
+    cumulative = 0
+    for upper_bound, bucket_count in zip(LATENCY_BUCKETS_S + (float('inf'),), histogram['buckets']):
+        cumulative += bucket_count
+        if cumulative >= target:
+            return upper_bound
+    return float('inf')
+
+def run_mode(args, rate_limited: bool) -> dict:
+    stub = TelegramStub(delay_s=args.delay_ms / 1000, chat_rate_per_s=TELEGRAM_CHAT_RATE_PER_S, global_rate_per_s=TELEGRAM_GLOBAL_RATE_PER_S)
+    stub.start()
+
+    flask_app = Flask(__name__)
+    flask_app.config.from_object(Config)
+    flask_app.config.update(
+        TELEGRAM_BOT_TOKEN='load',
+        TELEGRAM_API_BASE_URL=stub.base_url,
+        NOTIFICATION_RETRY_BACKOFF_S=0.2,
+        TELEGRAM_CHAT_RATE_PER_S=TELEGRAM_CHAT_RATE_PER_S if rate_limited else 0,
+        TELEGRAM_GLOBAL_RATE_PER_S=TELEGRAM_GLOBAL_RATE_PER_S if rate_limited else 0
+    )
+    flask_app.logger.setLevel('ERROR')
+    metrics_shared = {}
+    dispatcher = TelegramNotificationDispatcher(flask_app, metrics_shared)
+    dispatcher.start()
+    try:
+        enqueued = produce(dispatcher, args.chats, args.rate, args.duration)
+        drain_started_at = time.time()
+        dispatcher.stop(timeout_s=120)
+        drain_s = time.time() - drain_started_at
+    finally:
+        stub.stop()
+
+    snapshot = metrics_shared['notification_dispatcher']
+    counters = snapshot['counters']
+    latency = snapshot['histograms'].get('event_to_notification', {'count': 0, 'sum': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS_S) + 1)})
+    chat_peaks = Counter()
+    for chat_id in {chat_id for _, chat_id, _ in stub.messages}:
+        chat_peaks[chat_id] = peak_per_second([received_at for received_at, message_chat_id, _ in stub.messages if message_chat_id == chat_id])
+    return {
+        'enqueued': enqueued,
+        'delivered': counters.get('notifications_sent', 0),
+        'failed': counters.get('notifications_failed', 0),
+        'messages': len(stub.messages),
+        'digests': counters.get('notification_digests', 0),
+        'requests': stub.requests,
+        'rate_limited': stub.rate_limited,
+        'global_peak': peak_per_second([received_at for received_at, _, _ in stub.messages]),
+        'chat_peak': max(chat_peaks.values(), default=0),
+        'latency_mean_s': latency['sum'] / latency['count'] if latency['count'] else 0.0,
+        'latency_p95_s': histogram_quantile(latency, 0.95) if latency['count'] else 0.0,
+        'drain_s': drain_s
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=200, help='Уведомлений в секунду')
+    parser.add_argument('--duration', type=float, default=10, help='Длительность нагрузки, секунд')
+    parser.add_argument('--delay-ms', type=float, default=50, help='Время ответа Telegram')
+    args = parser.parse_args()
+
+    print(f'{args.rate:.0f} notifications/s for {args.duration:.0f}s into {args.chats} chats; Telegram limits: {TELEGRAM_CHAT_RATE_PER_S}/s per chat, {TELEGRAM_GLOBAL_RATE_PER_S}/s total')
+    print(f'{'mode':>12} {'enqueued':>9} {'delivered':>10} {'failed':>7} {'messages':>9} {'digests':>8} {'429s':>6} {'peak/s':>7} {'chat peak/s':>12} {'mean, s':>8} {'p95 <=, s':>10} {'drain, s':>9}')
+    results = {}
+    for mode, rate_limited in (('scheduler', True), ('unlimited', False)):
+        results[mode] = result = run_mode(args, rate_limited)
+        print(f'{mode:>12} {result['enqueued']:>9} {result['delivered']:>10} {result['failed']:>7} {result['messages']:>9} {result['digests']:>8} {result['rate_limited']:>6} '
+              f'{result['global_peak']:>7} {result['chat_peak']:>12} {result['latency_mean_s']:>8.2f} {result['latency_p95_s']:>10.2f} {result['drain_s']:>9.1f}')
+
+    scheduler = results['scheduler']
+    assert scheduler['delivered'] == scheduler['enqueued'], f'scheduler delivered {scheduler['delivered']} of {scheduler['enqueued']} notifications'
+    assert scheduler['rate_limited'] == 0, f'scheduler got {scheduler['rate_limited']} rate limit responses'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Прогон записанного видео через конвейер детектора (detect_vehicles) без RTSP и Manager:
+общие структуры заменены локальными объектами, события пишутся в JSONL для сравнения между прогонами.
+Печатает пропускную способность и p50/p95/p99 по этапам обработки кадра.
+
+Запуск из корня проекта:
+    python -m benchmarks.replay_detector recording.mp4 [parking_b=other.mp4 ...] \\
+        [--pace fast|file] [--alarm 12] [--alarm 7@parking_b] [--events-out replay_events.jsonl]
+
+--pace fast (по умолчанию) отдаёт кадры так быстро, как их обрабатывает детектор, без пропусков,
+поэтому события воспроизводимы; --pace file - в темпе исходного видео, как с живой камеры.
+Метки времени кадров и событий - секунды от начала файла. Остальные настройки детектора
+(модель, бэкенд, motion gate, ROI, буфер кадров) берутся из переменных окружения, как в run.py.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from app.config import Config, build_detector_config, parse_camera_sources
+from app.detection.detector import detect_vehicles
+from app.detection.detection_snapshot import DetectionSnapshot
+from app.detection.postprocess import BOX_TRACK_ID
+from benchmarks.common import LocalValue, make_local_registry
+
+PERCENTILES = (50, 95, 99)
+
+class RecordingQueue:
+    """Замена очереди Manager: запоминает всё, что в неё положили."""
+
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+class RecordingSnapshot(DetectionSnapshot):
+    """Настоящий снимок детекций в разделяемой памяти, который дополнительно запоминает, какие треки появлялись на каждой камере."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.seen_track_ids = {}
+        self.last_timestamp = 0.0
+
+    def publish(self, camera_boxes: dict, timestamp: float):
+        for camera_id, box_array in camera_boxes.items():
+            self.seen_track_ids.setdefault(camera_id, set()).update(box_array[:, BOX_TRACK_ID].astype(int).tolist())
+        self.last_timestamp = timestamp
+        super().publish(camera_boxes, timestamp)
+
+class StageRecorder:
+    """Собирает замеры этапов от detect_vehicles (интерфейс stage_observer); первые warmup_cycles циклов не учитываются."""
+
+    def __init__(self, warmup_cycles: int = 0):
+        self.warmup_cycles = warmup_cycles
+        self.cycles = 0
+        self.samples = {}
+        self.counters = {}
+        self.replay_started_at = None
+        self.first_frame_at = None
+        self.last_frame_at = None
+
+    def observe(self, stage: str, seconds: float):
+        cycle_index = self.cycles
+        if stage == 'cycle':
+            self.cycles += 1
+            if self.replay_started_at is None:
+                self.replay_started_at = time.perf_counter() - seconds
+        if cycle_index < self.warmup_cycles:
+            return
+        self.samples.setdefault(stage, []).append(seconds)
+        if stage == 'cycle':
+            now = time.perf_counter()
+            if self.first_frame_at is None:
+                self.first_frame_at = now - seconds
+            self.last_frame_at = now
+
+    def count(self, name: str, value: int = 1):
+        # count вызывается после observe('cycle') того же цикла
+        if self.cycles - 1 < self.warmup_cycles:
+            return
+        self.counters[name] = self.counters.get(name, 0) + value
+
+def parse_alarm(value: str, default_camera_id: str) -> tuple:
+    track_id, _, camera_id = value.partition('@')
+    return int(track_id), camera_id or default_camera_id
+
+def event_for_diff(event: dict) -> dict:
+    return {**event, 'timestamp': round(event['timestamp'], 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('videos', nargs='+', help='Видеофайлы; camera_id=path задаёт идентификатор камеры')
+    parser.add_argument('--pace', choices=['fast', 'file'], default='fast')
+    parser.add_argument('--alarm', action='append', default=[], metavar='TRACK_ID[@CAMERA]', help='Поставить сигнализацию на трек')
+    parser.add_argument('--events-out', default='replay_events.jsonl')
+    parser.add_argument('--warmup-cycles', type=int, default=3, help='Сколько первых циклов (прогрев модели) не учитывать в замерах')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    cameras = parse_camera_sources(','.join(args.videos), args.videos[0])
+    default_camera_id = next(iter(cameras))
+
+    config = build_detector_config({key: getattr(Config, key) for key in dir(Config) if key.isupper()})
+    config.update({
+        'cameras': cameras,
+        'default_camera_id': default_camera_id,
+        'camera_rois': {camera_id: polygons for camera_id, polygons in (config['camera_rois'] or {}).items() if camera_id in cameras},
+        'replay_pace': args.pace,
+        'detector_debug_draw': False,
+        'log_level': args.log_level,
+        'video_save_path': tempfile.gettempdir()
+    })
+
+    alarm_registry = make_local_registry()
+    for alarm_id, alarm in enumerate(args.alarm, start=1):
+        track_id, camera_id = parse_alarm(alarm, default_camera_id)
+        alarm_registry.add(alarm_id, {'track_id': track_id, 'user_id': 1, 'camera_id': camera_id})
+
+    detection_snapshot = RecordingSnapshot.create(list(cameras), Config.DETECTION_SNAPSHOT_CAPACITY)
+    event_queue = RecordingQueue()
+    video_writer_queue = RecordingQueue()
+    recorder = StageRecorder(args.warmup_cycles)
+
+    try:
+        detect_vehicles(
+            LocalValue(True),
+            config,
+            detection_snapshot,
+            alarm_registry,
+            event_queue,
+            video_writer_queue,
+            {},
+            stage_observer=recorder
+        )
+    finally:
+        detection_snapshot.close()
+        detection_snapshot.unlink()
+
+    if recorder.first_frame_at is None:
+        print('No frames were processed')
+        return
+
+    with open(args.events_out, 'w') as f:
+        for event in event_queue.items:
+            f.write(json.dumps(event_for_diff(event), sort_keys=True) + '\n')
+
+    elapsed = recorder.last_frame_at - recorder.first_frame_at
+    frames_inferred = recorder.counters.get('frames_inferred', 0)
+    frames_skipped = recorder.counters.get('frames_skipped', 0)
+    # Темп относительно реального времени - по всему прогону, включая прогрев
+    realtime_factor = detection_snapshot.last_timestamp / (recorder.last_frame_at - recorder.replay_started_at)
+    warmup_note = f', first {args.warmup_cycles} cycle(s) excluded' if args.warmup_cycles else ''
+    print(f'{frames_inferred + frames_skipped} frame(s) from {len(cameras)} camera(s) in {elapsed:.1f}s: '
+          f'{(frames_inferred + frames_skipped) / elapsed:.1f} frames/s, {frames_inferred} inferred, {frames_skipped} skipped by motion gate, '
+          f'{realtime_factor:.2f}x real time (pace: {args.pace}{warmup_note})')
+
+    print(f'{'stage':<16} {'count':>7} ' + ' '.join(f'{f'p{p}, ms':>9}' for p in PERCENTILES) + f' {'total, s':>9}')
+    for stage in ('decode', 'resize', 'grab', 'motion_gate', 'inference', 'postprocess', 'event_queue_put', 'publish', 'recordings', 'cycle'):
+        samples = recorder.samples.get(stage)
+        if not samples:
+            continue
+        values = np.percentile(np.asarray(samples) * 1000, PERCENTILES)
+        print(f'{stage:<16} {len(samples):>7} ' + ' '.join(f'{value:>9.2f}' for value in values) + f' {sum(samples):>9.2f}')
+
+    for camera_id, track_ids in detection_snapshot.seen_track_ids.items():
+        print(f'Camera {camera_id}: {len(track_ids)} track(s) seen: {sorted(track_ids)[:30]}{' ...' if len(track_ids) > 30 else ''}')
+    print(f'{len(event_queue.items)} event(s) written to {os.path.abspath(args.events_out)}, {len(video_writer_queue.items)} video task(s)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Soak-бенчмарк состояния треков под охраной: долго гоняет поток кадров с постоянной
+сменой сигнализаций (постановка, перемещения, исчезновения, снятие) через тот же код, что и детектор
+(refresh_camera_alarms, detect_movements, detect_disappearances, mark_alarmed_tracks_seen поверх
+AlarmRegistry/AlarmTrackIndex/AlarmedTrackStore), и следит, что память не растёт.
+Боксы кадра синтетические: модель и трекер не нужны.
+
+Запуск из корня проекта:
+    python -m benchmarks.soak_alarmed_tracks [--frames 20000] [--alarms 50] [--churn 0.005]
+"""
+
+import argparse
+import gc
+import logging
+import random
+import time
+import tracemalloc
+import numpy as np
+from app.alarm_registry import AlarmTrackIndex
+from app.detection.detector import CameraContext, detect_disappearances, detect_movements, detector_logger, mark_alarmed_tracks_seen, refresh_camera_alarms
+from app.detection.motion_gate import MotionGate
+from app.detection.postprocess import BOX_TRACK_ID, BOX_X1, BOX_X2, BOX_Y1, BOX_Y2
+from app.detection.track_history import AlarmedTrackStore
+from benchmarks.common import make_local_registry
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=20_000)
+    parser.add_argument('--alarms', type=int, default=50, help='Сколько сигнализаций активно одновременно')
+    parser.add_argument('--churn', type=float, default=0.005, help='Доля сигнализаций, сменяемых за кадр')
+    parser.add_argument('--fps', type=float, default=25.0)
+    parser.add_argument('--time-window', type=float, default=0.5)
+    parser.add_argument('--min-distance', type=float, default=10.0)
+    parser.add_argument('--disappearance-thresh', type=float, default=5.0)
+    parser.add_argument('--skip-share', type=float, default=0.3, help='Доля кадров, пропущенных motion gate')
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--tolerance-kb', type=float, default=256.0, help='Допустимый рост памяти после прогрева')
+    args = parser.parse_args()
+
+    # События пишутся в лог детектора на каждом кадре; здесь нужен только их счёт
+    detector_logger.setLevel(logging.WARNING)
+    rng = random.Random(42)
+    registry = make_local_registry()
+    alarm_index = AlarmTrackIndex(registry, 'main')
+    camera = CameraContext('main', None, None, AlarmedTrackStore(args.time_window, args.fps), MotionGate())
+    alarmed_tracks = camera.alarmed_tracks
+
+    next_alarm_id = 1
+    next_track_id = 1
+    active_alarm_ids = []
+    for _ in range(args.alarms):
+        registry.add(next_alarm_id, {'track_id': next_track_id, 'user_id': 1, 'camera_id': 'main'})
+        active_alarm_ids.append(next_alarm_id)
+        next_alarm_id += 1
+        next_track_id += 1
+
+    tracemalloc.start()
+    sample_every = max(1, args.frames // args.samples)
+    samples = []
+    events = 0
+    churn_budget = 0.0
+    started_at = time.perf_counter()
+
+    for frame_index in range(args.frames):
+        timestamp = frame_index / args.fps
+
+        churn_budget += args.churn * args.alarms
+        while churn_budget >= 1:
+            churn_budget -= 1
+            alarm_id = active_alarm_ids.pop(rng.randrange(len(active_alarm_ids)))
+            registry.remove(alarm_id)
+            registry.add(next_alarm_id, {'track_id': next_track_id, 'user_id': 1, 'camera_id': 'main'})
+            active_alarm_ids.append(next_alarm_id)
+            next_alarm_id += 1
+            next_track_id += 1
+
+        refresh_camera_alarms(alarm_index, [camera])
+        camera_alarms_by_track_id = alarm_index.for_camera('main')
+
+        if rng.random() < args.skip_share:
+            mark_alarmed_tracks_seen(camera, camera_alarms_by_track_id, timestamp)
+        else:
+            # Часть охраняемых машин (track_id % 7 == 0) пропадает из кадра, часть дрожит или едет; плюс посторонние машины
+            visible_track_ids = [track_id for track_id in camera_alarms_by_track_id if track_id % 7 != 0] + [-(index + 1) for index in range(5)]
+            box_array = np.zeros((len(visible_track_ids), 7), dtype=np.float64)
+            for row, track_id in enumerate(visible_track_ids):
+                x = 100 + rng.random() * (track_id % 3) * 30
+                box_array[row, [BOX_X1, BOX_Y1, BOX_X2, BOX_Y2, BOX_TRACK_ID]] = (x - 20, 80, x + 20, 120, track_id)
+            camera.last_track_ids = set(visible_track_ids)
+
+            for movement_events in detect_movements(camera, camera_alarms_by_track_id, box_array, timestamp, args.time_window, args.min_distance):
+                events += len(movement_events)
+            for disappearance_events in detect_disappearances(camera, camera_alarms_by_track_id, camera.last_track_ids, timestamp, args.disappearance_thresh):
+                events += len(disappearance_events)
+
+        if frame_index % sample_every == sample_every - 1:
+            gc.collect()
+            current_bytes, _ = tracemalloc.get_traced_memory()
+            samples.append((frame_index + 1, len(alarmed_tracks), current_bytes))
+
+    elapsed = time.perf_counter() - started_at
+    tracemalloc.stop()
+
+    print(f'{'frames':>10} {'tracks':>7} {'traced, KB':>11}')
+    for frames, tracks, current_bytes in samples:
+        print(f'{frames:>10} {tracks:>7} {current_bytes / 1024:>11.1f}')
+    print(f'{args.frames} frames in {elapsed:.1f}s ({args.frames / elapsed:.0f} frames/s), {events} events, {next_alarm_id - 1} alarms set in total')
+
+    # Первую выборку считаем прогревом
+    baseline_bytes = samples[1][2] if len(samples) > 1 else samples[0][2]
+    growth_kb = (samples[-1][2] - baseline_bytes) / 1024
+    print(f'Memory growth after warm-up: {growth_kb:.1f} KB')
+    assert len(alarmed_tracks) <= args.alarms, f'Track state leaked: {len(alarmed_tracks)} entries for {args.alarms} alarms'
+    assert growth_kb <= args.tolerance_kb, f'Memory grew by {growth_kb:.1f} KB (> {args.tolerance_kb} KB)'
+
+if __name__ == '__main__':
+    main()
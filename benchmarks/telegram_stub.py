@@ -0,0 +1,143 @@
+"""
+Локальная замена Telegram Bot API для бенчмарков: принимает sendMessage и запоминает сообщения.
+Умеет отвечать с задержкой, изредка медленно и отдавать 429 с retry_after - случайно
+или, как Telegram, при превышении лимитов сообщений в секунду на чат и всего.
+Запуск отдельно (например, для ручной проверки с TELEGRAM_API_BASE_URL=http://127.0.0.1:8081):
+    python -m benchmarks.telegram_stub [--port 8081] [--delay-ms 100] [--chat-rate 1] [--global-rate 30]
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class TelegramStub:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, delay_s: float = 0.0, slow_share: float = 0.0,
+                 slow_delay_s: float = 0.0, rate_limit_share: float = 0.0, retry_after_s: int = 1, seed: int = 42,
+                 chat_rate_per_s: int = 0, global_rate_per_s: int = 0):
+        self.delay_s = delay_s
+        self.slow_share = slow_share
+        self.slow_delay_s = slow_delay_s
+        self.rate_limit_share = rate_limit_share
+        self.retry_after_s = retry_after_s
+        # Лимиты принятых сообщений за скользящую секунду (0 - без лимита)
+        self.chat_rate_per_s = chat_rate_per_s
+        self.global_rate_per_s = global_rate_per_s
+
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        # (время получения time.time(), chat_id, текст)
+        self.messages = []
+        self.requests = 0
+        self.rate_limited = 0
+        self.limit_violations = 0
+        self.connections = 0
+        self.accepted_at = deque()
+        self.chat_accepted_at = {}
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status, response = stub.handle(self.path, json.loads(body or b'{}'))
+                data = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def process_request(self, request, client_address):
+                with stub.lock:
+                    stub.connections += 1
+                super().process_request(request, client_address)
+
+        self.server = Server((host, port), Handler)
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def handle(self, path: str, payload: dict) -> tuple:
+        """:return: (HTTP-статус, тело ответа)."""
+
+        if not path.endswith('/sendMessage'):
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        chat_id = str(payload.get('chat_id'))
+        with self.lock:
+            self.requests += 1
+            rate_limited = self.rng.random() < self.rate_limit_share
+            if not rate_limited and self.over_limit(chat_id, time.monotonic()):
+                rate_limited = True
+                self.limit_violations += 1
+            slow = self.rng.random() < self.slow_share
+            if rate_limited:
+                self.rate_limited += 1
+        if rate_limited:
+            return 429, {'ok': False, 'error_code': 429, 'description': f'Too Many Requests: retry after {self.retry_after_s}', 'parameters': {'retry_after': self.retry_after_s}}
+
+        time.sleep(self.slow_delay_s if slow else self.delay_s)
+        with self.lock:
+            self.messages.append((time.time(), chat_id, payload.get('text', '')))
+            message_id = len(self.messages)
+        return 200, {'ok': True, 'result': {'message_id': message_id, 'chat': {'id': payload.get('chat_id')}, 'text': payload.get('text', '')}}
+
+    def over_limit(self, chat_id: str, now: float) -> bool:
+        """Учитывает запрос в окнах последней секунды. :return: True, если он превышает лимит (вызывать под lock)."""
+
+        chat_accepted_at = self.chat_accepted_at.setdefault(chat_id, deque())
+        for window in (self.accepted_at, chat_accepted_at):
+            while window and window[0] <= now - 1.0:
+                window.popleft()
+        if self.global_rate_per_s and len(self.accepted_at) >= self.global_rate_per_s:
+            return True
+        if self.chat_rate_per_s and len(chat_accepted_at) >= self.chat_rate_per_s:
+            return True
+        self.accepted_at.append(now)
+        chat_accepted_at.append(now)
+        return False
+
+    def start(self) -> str:
+        self.thread = threading.Thread(target=self.server.serve_forever, name='TelegramStubThread', daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay-ms', type=float, default=100)
+    parser.add_argument('--rate-limit-share', type=float, default=0.0)
+    parser.add_argument('--chat-rate', type=int, default=1, help='Сообщений в секунду на чат (0 - без лимита)')
+    parser.add_argument('--global-rate', type=int, default=30, help='Сообщений в секунду всего (0 - без лимита)')
+    args = parser.parse_args()
+
+    stub = TelegramStub(port=args.port, delay_s=args.delay_ms / 1000, rate_limit_share=args.rate_limit_share,
+                        chat_rate_per_s=args.chat_rate, global_rate_per_s=args.global_rate)
+    print(f'Telegram stub listening on {stub.base_url}')
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f'Received {len(stub.messages)} message(s), {stub.rate_limited} rate limited ({stub.limit_violations} over the limits)')
+
+if __name__ == '__main__':
+    main()
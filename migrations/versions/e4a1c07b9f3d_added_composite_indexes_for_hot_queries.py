@@ -0,0 +1,41 @@
+"""Added composite indexes for hot queries
+
+Revision ID: e4a1c07b9f3d
+Revises: 7c3e91a4d5b2
+Create Date: 2026-10-17 15:08:44.172390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a1c07b9f3d'
+down_revision = '7c3e91a4d5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ix_alarms_user_id и ix_alarm_events_alarm_id - префиксы новых составных индексов
+    with op.batch_alter_table('alarms', schema=None) as batch_op:
+        batch_op.create_index('ix_alarms_user_id_is_active_track', ['user_id', 'is_active', 'vehicle_track_id', 'camera_id'], unique=False)
+        batch_op.create_index('ix_alarms_user_id_set_at', ['user_id', 'set_at', 'id'], unique=False)
+        batch_op.drop_index(batch_op.f('ix_alarms_user_id'))
+
+    with op.batch_alter_table('alarm_events', schema=None) as batch_op:
+        batch_op.create_index('ix_alarm_events_alarm_id_timestamp', ['alarm_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_alarm_events_alarm_id_event_type_timestamp', ['alarm_id', 'event_type', 'timestamp'], unique=False)
+        batch_op.drop_index(batch_op.f('ix_alarm_events_alarm_id'))
+
+
+def downgrade():
+    with op.batch_alter_table('alarm_events', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_alarm_events_alarm_id'), ['alarm_id'], unique=False)
+        batch_op.drop_index('ix_alarm_events_alarm_id_event_type_timestamp')
+        batch_op.drop_index('ix_alarm_events_alarm_id_timestamp')
+
+    with op.batch_alter_table('alarms', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_alarms_user_id'), ['user_id'], unique=False)
+        batch_op.drop_index('ix_alarms_user_id_set_at')
+        batch_op.drop_index('ix_alarms_user_id_is_active_track')
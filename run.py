@@ -7,9 +7,14 @@ from app import create_app
 from app import db
 from app.api.routes import initialize_shared_data
 from app.detection.detector import detect_vehicles
-from app.event_processor import event_processor_worker
+from app.detection.detection_snapshot import DetectionSnapshot
+from app.event_processor import event_processor_worker, release_notification_cooldowns
+from app.notification_dispatcher import TelegramNotificationDispatcher
 from app.video_writer import video_writer_worker
 from app.models import Alarm
+from app.alarm_registry import AlarmRegistry
+from app.alarm_read_model import ActiveAlarmReadModel, alarm_read_model_consistency_worker
+from app.config import build_detector_config
 from app.telegram_bot import run_telegram_bot
 # from dotenv import load_dotenv
 
@@ -23,15 +28,26 @@ if __name__ == '__main__':
     freeze_support() # for running on Windows
 
     with Manager() as manager:
-        last_processed_bboxes_shared = manager.list([None, 0.0])
-        active_alarms_shared = manager.dict()
+        active_alarms_shared = AlarmRegistry.from_manager(manager)
+        alarm_read_model = ActiveAlarmReadModel()
         event_queue_shared = manager.Queue()
         running_flag_shared = manager.Value('b', True)
         video_writer_queue_shared = manager.Queue()
+        detector_stats_shared = manager.dict()
+        metrics_shared = manager.dict()
         # alarms_lock_shared = manager.Lock()
+        # Детекции последнего кадра: детектор пишет, потоки Flask читают напрямую из разделяемой памяти
+        detection_snapshot = DetectionSnapshot.create(list(flask_app.config.get('CAMERA_SOURCES')), flask_app.config.get('DETECTION_SNAPSHOT_CAPACITY'))
 
         with flask_app.app_context():
-            initialize_shared_data(last_processed_bboxes_shared, active_alarms_shared)
+            initialize_shared_data(
+                detection_snapshot,
+                active_alarms_shared,
+                detector_stats_shared,
+                metrics_shared,
+                {'events': event_queue_shared, 'video_writer': video_writer_queue_shared},
+                alarm_read_model
+            )
             flask_app.logger.info('Deactivating all previously active alarms due to system restart...')
             updated_count = Alarm.query.filter_by(is_active=True).update({
                 Alarm.is_active: False,
@@ -40,26 +56,9 @@ if __name__ == '__main__':
             db.session.commit()
             if updated_count > 0:
                 flask_app.logger.info(f'Deactivated {updated_count} alarm(s)')
+            alarm_read_model.load(Alarm.query.filter_by(is_active=True).all())
 
-        detector_config = {
-            'rtsp_source': flask_app.config.get('RTSP_SOURCE'),
-            'yolo_model_path': flask_app.config.get('YOLO_MODEL_PATH'),
-            'img_height': flask_app.config.get('YOLO_IMG_HEIGHT'),
-            'img_width': flask_app.config.get('YOLO_IMG_WIDTH'),
-            'conf_thresh': flask_app.config.get('YOLO_CONF_THRESH'),
-            'iou_thresh': flask_app.config.get('YOLO_IOU_THRESH'),
-            'verbose': flask_app.config.get('YOLO_VERBOSE'),
-            'detection_time_window': flask_app.config.get('DETECTION_TIME_WINDOW'),
-            'detection_min_distance': flask_app.config.get('DETECTION_MIN_DISTANCE'),
-            'disappearance_thresh_s': flask_app.config.get('DISAPPEARANCE_THRESH_S'),
-            'detector_debug_draw': flask_app.config.get('DETECTOR_DEBUG_DRAW'),
-            'log_level': flask_app.config.get('LOG_LEVEL'),
-            'video_save_path': flask_app.config.get('VIDEO_SAVE_PATH'),
-            'video_fps': flask_app.config.get('VIDEO_FPS'),
-            'camera_fps': flask_app.config.get('CAMERA_FPS'),
-            'video_seconds_before_event': flask_app.config.get('VIDEO_SECONDS_BEFORE_EVENT'),
-            'video_seconds_after_event': flask_app.config.get('VIDEO_SECONDS_AFTER_EVENT')
-        }
+        detector_config = build_detector_config(flask_app.config)
 
         flask_app.logger.info('Starting detection process...')
         detection_process = Process(
@@ -67,16 +66,26 @@ if __name__ == '__main__':
             args=(
                 running_flag_shared,
                 detector_config,
-                last_processed_bboxes_shared,
+                detection_snapshot.descriptor(),
                 active_alarms_shared,
                 event_queue_shared,
-                video_writer_queue_shared
+                video_writer_queue_shared,
+                detector_stats_shared,
+                metrics_shared
                 # alarms_lock_shared
             ),
             name='VehicleDetectorProcess'
         )
         detection_process.start()
 
+        flask_app.logger.info('Starting Telegram notification dispatcher...')
+        notification_dispatcher = TelegramNotificationDispatcher(
+            flask_app,
+            metrics_shared,
+            on_failure=lambda notifications: release_notification_cooldowns(flask_app, notifications)
+        )
+        notification_dispatcher.start()
+
         flask_app.logger.info('Starting Event Processor Worker thread...')
         event_processor_thread = Thread(
             target=event_processor_worker,
@@ -84,13 +93,30 @@ if __name__ == '__main__':
                 flask_app,
                 event_queue_shared,
                 active_alarms_shared,
-                running_flag_shared
+                running_flag_shared,
+                metrics_shared,
+                alarm_read_model,
+                notification_dispatcher
             ),
             name='EventProcessorThread'
         )
         event_processor_thread.daemon = True
         event_processor_thread.start()
 
+        flask_app.logger.info('Starting Alarm Read Model consistency thread...')
+        alarm_read_model_thread = Thread(
+            target=alarm_read_model_consistency_worker,
+            args=(
+                flask_app,
+                alarm_read_model,
+                running_flag_shared,
+                flask_app.config.get('ALARM_READ_MODEL_CHECK_INTERVAL_S')
+            ),
+            name='AlarmReadModelThread'
+        )
+        alarm_read_model_thread.daemon = True
+        alarm_read_model_thread.start()
+
         if flask_app.config.get('VIDEO_SAVE_PATH'):
             flask_app.logger.info('Starting Video Writer worker proces...')
             video_writer_process = Process(
@@ -99,7 +125,8 @@ if __name__ == '__main__':
                     flask_app.config.get('SQLALCHEMY_DATABASE_URI'),
                     flask_app.config.get('LOG_LEVEL', 'INFO'),
                     video_writer_queue_shared,
-                    running_flag_shared
+                    running_flag_shared,
+                    metrics_shared
                 ),
                 name='VideoWriterProcess'
             )
@@ -168,6 +195,9 @@ if __name__ == '__main__':
             else:
                 flask_app.logger.info('Event Processor Worker thread finished')
 
+            flask_app.logger.info('Sending pending notifications...')
+            notification_dispatcher.stop(timeout_s=10)
+
             if video_writer_process and video_writer_process.is_alive():
                 flask_app.logger.info('Waiting for Video Writer worker process to join...')
                 video_writer_process.join(timeout=10)
@@ -186,4 +216,7 @@ if __name__ == '__main__':
                 else:
                     flask_app.logger.info('Telegram Bot thread finished')
 
+            detection_snapshot.close()
+            detection_snapshot.unlink()
+
             flask_app.logger.info('Application shutdown complete')
\ No newline at end of file
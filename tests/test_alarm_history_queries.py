@@ -0,0 +1,103 @@
+"""
+Число SQL-запросов GET /api/alarms/history не зависит от размера страницы (нет N+1 по событиям тревог).
+
+Запуск из корня проекта:
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, insert
+from app import create_app, db
+from app.config import Config
+from app.models import User, Alarm, AlarmEvent
+
+ALARMS = 12
+EVENTS_PER_ALARM = 3
+# Страница тревог и события страницы (+ COUNT в режиме ?page=)
+MAX_PAGE_QUERIES = 3
+MAX_CURSOR_QUERIES = 2
+
+class AlarmHistoryQueryCountTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        db_fd, cls.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+
+        class TestConfig(Config):
+            TESTING = True
+            LOG_LEVEL = 'WARNING'
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{cls.db_path}'
+            SQLALCHEMY_ECHO = False
+
+        cls.app = create_app(TestConfig)
+        with cls.app.app_context():
+            db.create_all()
+            db.session.execute(insert(User), [{'id': 1, 'username': 'history_test'}])
+            started_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+            db.session.execute(insert(Alarm), [{
+                'id': alarm_id,
+                'user_id': 1,
+                'vehicle_track_id': alarm_id,
+                'camera_id': 'main',
+                'set_at': started_at + timedelta(hours=alarm_id),
+                'is_active': False
+            } for alarm_id in range(1, ALARMS + 1)])
+            db.session.execute(insert(AlarmEvent), [{
+                'alarm_id': alarm_id,
+                'event_type': 'movement',
+                'timestamp': started_at + timedelta(hours=alarm_id, minutes=index),
+                'details_json': json.dumps({'distance_px': 100 + index})
+            } for alarm_id in range(1, ALARMS + 1) for index in range(EVENTS_PER_ALARM)])
+            db.session.commit()
+            cls.headers = {'Authorization': f'Bearer {create_access_token(identity='1')}'}
+            cls.queries = 0
+            event.listen(db.engine, 'before_cursor_execute', cls._on_execute)
+        cls.client = cls.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', cls._on_execute)
+            db.engine.dispose()
+        os.remove(cls.db_path)
+
+    @classmethod
+    def _on_execute(cls, *args):
+        cls.queries += 1
+
+    def _history(self, query: str) -> tuple:
+        """:return: (JSON ответа, число SQL-запросов)."""
+
+        type(self).queries = 0
+        response = self.client.get(f'/api/alarms/history?{query}', headers=self.headers)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response.get_json(), type(self).queries
+
+    def test_page_mode_query_count_is_bounded(self):
+        for per_page in (2, 10):
+            with self.subTest(per_page=per_page):
+                body, queries = self._history(f'per_page={per_page}&page=1')
+                self.assertEqual(len(body['alarms_history']), per_page)
+                self.assertTrue(all(len(alarm['events']) == EVENTS_PER_ALARM for alarm in body['alarms_history']))
+                self.assertIn('total_pages', body['pagination'])
+                self.assertLessEqual(queries, MAX_PAGE_QUERIES)
+
+    def test_cursor_mode_query_count_is_bounded(self):
+        for per_page in (2, 10):
+            with self.subTest(per_page=per_page):
+                body, queries = self._history(f'per_page={per_page}&cursor=')
+                self.assertEqual(len(body['alarms_history']), per_page)
+                self.assertLessEqual(queries, MAX_CURSOR_QUERIES)
+
+                next_body, next_queries = self._history(f'per_page={per_page}&cursor={body['pagination']['next_cursor']}')
+                self.assertTrue(next_body['alarms_history'])
+                self.assertTrue(all(len(alarm['events']) == EVENTS_PER_ALARM for alarm in next_body['alarms_history']))
+                self.assertLessEqual(next_queries, MAX_CURSOR_QUERIES)
+
+if __name__ == '__main__':
+    unittest.main()